@@ -4,20 +4,48 @@ import secrets
 import datetime
 
 from telegramtracker.core import database
+from telegramtracker.core import maintenance
 from telegramtracker.web import routes
+from telegramtracker.web import api
+from telegramtracker.web import assets
+
+SECRET_KEY_FILE = '.secret_key'
+
+def load_secret_key():
+    """Return the session secret key shared by all worker processes.
+
+    Uses SECRET_KEY from the environment if set; otherwise a random key is
+    generated once and stored in SECRET_KEY_FILE.
+    """
+    if os.getenv('SECRET_KEY'):
+        return os.getenv('SECRET_KEY')
+    try:
+        # O_EXCL makes sure only one worker creates the key when several start at once
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        pass
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
 
 # Create Flask application
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)  # Generate secure random secret key
+app.secret_key = load_secret_key()
 
 def create_app():
     """Configure and return the Flask application."""
     
     # Initialize database
     database.init_db()
+
+    # Start background cleanup of orphaned media, database space and the downloads quota
+    maintenance.start_maintenance_worker()
     
     # Register routes
     routes.register_routes(app)
+    api.register_api_routes(app)
+    assets.register_asset_routes(app)
     
     # Add datetime.now function to all templates
     @app.context_processor
@@ -29,5 +57,5 @@ def create_app():
 if __name__ == '__main__':
     app = create_app()
     
-    # Development server - Use waitress or gunicorn for production
-    app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
+    # Development server - Use waitress or gunicorn for production (see wsgi.py)
+    app.run(debug=True, host='0.0.0.0', port=5001) 
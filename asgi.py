@@ -0,0 +1,139 @@
+"""
+ASGI entry point (single process, native asyncio).
+
+Run with uvicorn:
+    uvicorn asgi:app --port 5001
+
+Telegram work, the progress stream and the chat list run as coroutines on the
+server's own event loop and share one connected Telegram client. All other
+routes are served by the Flask app through asgiref's WSGI adapter, which runs
+them in a thread pool.
+"""
+import asyncio
+import json
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+from telegramtracker.core import job_store
+from telegramtracker.services import event_loop
+from telegramtracker.services.telegram_client import get_user_chats_async
+
+KEEPALIVE_SECONDS = 15
+JOB_POLL_SECONDS = 5  # Safety net for updates written by other processes
+
+flask_app = create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+def _job_id_from_scope(scope):
+    """Read the job id from ?job= or from the Flask session cookie."""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if query.get('job'):
+        return query['job'][0]
+
+    cookie_header = b'; '.join(value for name, value in scope.get('headers', []) if name == b'cookie')
+    cookies = SimpleCookie()
+    cookies.load(cookie_header.decode('latin-1'))
+    cookie = cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if cookie is None:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        session = serializer.loads(cookie.value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+    return session.get('job_id')
+
+
+async def _send_headers(send, content_type, extra_headers=()):
+    headers = [(b'content-type', content_type), (b'cache-control', b'no-cache')]
+    headers.extend(extra_headers)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+
+async def stream_progress(scope, receive, send):
+    """Server-Sent Events endpoint that waits on job updates instead of polling."""
+    job_id = _job_id_from_scope(scope)
+    queue = job_store.progress_hub.subscribe(job_id)
+    tracker = job_store.ProgressTracker()
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    await _send_headers(send, b'text/event-stream', [(b'x-accel-buffering', b'no')])
+    try:
+        last_sent = time.monotonic()
+        while not disconnected.is_set():
+            # The job row is the source of truth; the queue only tells us when to look
+            job = await asyncio.to_thread(job_store.get_job, job_id)
+            for update in tracker.events(job):
+                await send({'type': 'http.response.body', 'body': f"data: {json.dumps(update)}\n\n".encode(), 'more_body': True})
+                last_sent = time.monotonic()
+            if tracker.finished:
+                break
+
+            try:
+                await asyncio.wait_for(queue.get(), timeout=min(JOB_POLL_SECONDS, KEEPALIVE_SECONDS))
+                # Collapse bursts of updates into one read of the job row
+                while not queue.empty():
+                    queue.get_nowait()
+            except asyncio.TimeoutError:
+                pass
+
+            if time.monotonic() - last_sent >= KEEPALIVE_SECONDS:
+                await send({'type': 'http.response.body', 'body': b": keepalive\n\n", 'more_body': True})
+                last_sent = time.monotonic()
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        job_store.progress_hub.unsubscribe(job_id, queue)
+        watcher.cancel()
+        print("SSE stream closing.")
+
+
+async def get_chats(scope, receive, send):
+    """Return the user's chats as JSON, awaited directly on the server loop."""
+    try:
+        chats = await get_user_chats_async()
+        status, body = 200, json.dumps(chats)
+    except Exception as e:
+        print(f"Error in /get_chats route: {e}")
+        status, body = 500, json.dumps({"error": "Failed to fetch chats"})
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body.encode('utf-8')})
+
+
+NATIVE_ROUTES = {
+    '/stream-progress': stream_progress,
+    '/get_chats': get_chats,
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                event_loop.attach_loop(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Servers without lifespan support attach the loop on the first request
+    if event_loop.get_attached_loop() is not asyncio.get_running_loop():
+        event_loop.attach_loop(asyncio.get_running_loop())
+
+    handler = NATIVE_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if handler is not None and scope.get('method') == 'GET':
+        await handler(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
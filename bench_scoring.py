@@ -0,0 +1,72 @@
+"""
+Ranking benchmark.
+
+Fills a temporary database with one history entry of --rows results and
+measures how long each ranking takes for the first view: reading its columns
+from SQLite and computing the order. The target is well under a second at
+1,000,000 results.
+
+    python bench_scoring.py [--rows 1000000] [--runs 3]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from telegramtracker.core import database  # noqa: E402
+from telegramtracker.core import scoring  # noqa: E402
+
+TARGET_SECONDS = 1.0
+
+
+def fill(rows):
+    """Create one history entry with `rows` results; returns its id."""
+    database.init_db()
+    conn = sqlite3.connect(database.DATABASE)
+    history_id = conn.execute(
+        "INSERT INTO search_history (chat_identifier, chat_title, messages_found, scanned_count) VALUES ('bench', 'Bench', ?, ?)", (rows, rows)
+    ).lastrowid
+    now = int(time.time())
+    conn.executemany("""
+        INSERT INTO search_results (history_id, message_id, reaction_count, message_preview, views, forwards, replies, posted_at)
+        VALUES (?, ?, ?, '', ?, ?, ?, ?)
+    """, ((history_id, i, random.randint(0, 500), random.randint(0, 50000), random.randint(0, 50),
+           random.randint(0, 20), now - random.randint(0, 365 * 86400)) for i in range(rows)))
+    conn.commit()
+    conn.close()
+    return history_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='results in the history entry (default: 1000000)')
+    parser.add_argument('--runs', type=int, default=3, help='runs per ranking (default: 3)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database.DATABASE = os.path.join(workdir, 'bench.db')
+        history_id = fill(args.rows)
+        missed = False
+        for ranking in scoring.RANKINGS:
+            timings = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                _, columns = scoring.load_columns(history_id, ranking)
+                scoring.rank_order(columns, ranking)
+                timings.append(time.perf_counter() - started)
+            median = statistics.median(timings)
+            missed = missed or median >= TARGET_SECONDS
+            print(f"{ranking:10s} median {median * 1000:8.1f} ms   min {min(timings) * 1000:8.1f} ms")
+        print(f"Target: under {TARGET_SECONDS * 1000:.0f} ms per ranking at {args.rows} results -", 'missed' if missed else 'met')
+    sys.exit(1 if missed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Startup and template render benchmark.
+
+Measures, in fresh interpreter processes, how long it takes to import the web
+routes and to create the app, how much Telethon would add if it were imported
+eagerly, and how long the history page takes to render.
+
+    python bench_startup.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_ROUTES = "import telegramtracker.web.routes"
+CREATE_APP = "import app; app.create_app()"
+IMPORT_TELETHON = "import telethon"
+RENDER_HISTORY = """
+import app as app_module
+flask_app = app_module.create_app()
+from flask import render_template
+from telegramtracker.utils.translations import get_text, LANGUAGES
+entries = [{'id': i, 'chat_title': f'Chat {i}', 'chat_identifier': f'@chat{i}', 'chat_username': f'chat{i}',
+            'chat_numeric_id': i, 'period_days': 7, 'messages_found': 10, 'scanned_count': 100,
+            'timestamp': '2024-01-01 00:00:00'} for i in range(200)]
+with flask_app.test_request_context('/history'):
+    render_template('history.html', history=entries, lang='en', t=get_text, languages=LANGUAGES)
+    started = time.perf_counter()
+    for _ in range(50):
+        render_template('history.html', history=entries, lang='en', t=get_text, languages=LANGUAGES)
+    elapsed = (time.perf_counter() - started) / 50
+"""
+
+
+def time_snippet(code, workdir):
+    """Run code in a fresh interpreter and return the seconds it took (or the value of `elapsed`)."""
+    script = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {ROOT!r})\n"
+        "started = time.perf_counter()\n"
+        "elapsed = None\n"
+        f"{code}\n"
+        "print(elapsed if elapsed is not None else time.perf_counter() - started)\n"
+    )
+    env = dict(os.environ, MAINTENANCE_INTERVAL_SECONDS='0')
+    output = subprocess.run(
+        [sys.executable, '-c', script], cwd=workdir, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='runs per measurement (default: 5)')
+    args = parser.parse_args()
+
+    # The app creates its database and asset cache in the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, code in (
+            ('import routes', IMPORT_ROUTES),
+            ('create app', CREATE_APP),
+            ('import telethon (deferred until first use)', IMPORT_TELETHON),
+            ('render history.html (200 entries)', RENDER_HISTORY),
+        ):
+            timings = [time_snippet(code, workdir) for _ in range(args.runs)]
+            print(f"{label:45s} median {statistics.median(timings) * 1000:8.2f} ms   min {min(timings) * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
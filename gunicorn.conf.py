@@ -0,0 +1,16 @@
+# Gunicorn settings for `gunicorn wsgi:app`
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5001')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Progress streams (SSE) hold a connection open for the whole scan, so each
+# worker serves requests from a thread pool and long requests are not killed.
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 16))
+timeout = 0
+
+# Initialize the database (and run migrations) once in the master process before
+# forking; the maintenance worker then also runs only once, in the master.
+preload_app = True
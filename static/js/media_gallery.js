@@ -1,5 +1,13 @@
 // static/js/media_gallery.js
 
+// Media is only requested once a card comes near the viewport. The first item's
+// source waits in data-src; the rest of an album is fetched from the card's
+// data-media-url the first time the visitor browses it.
+
+const IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'];
+const VIDEO_EXTENSIONS = ['mp4', 'mov', 'avi', 'mkv', 'webm'];
+const LAZY_ROOT_MARGIN = '200px 0px'; // Start loading slightly before a card becomes visible
+
 // Function to apply aspect ratio to a container
 function applyAspectRatio(container, width, height) {
     if (container && width > 0 && height > 0) {
@@ -9,140 +17,179 @@ function applyAspectRatio(container, width, height) {
     }
 }
 
-document.addEventListener('DOMContentLoaded', function() {
-    document.querySelectorAll('.media-container').forEach(container => {
-        try {
-            const mediaPathsData = container.dataset.mediaPaths;
-            if (!mediaPathsData) {
-                // console.warn("Media container found without media-paths data.", container);
-                return;
-            }
-            const mediaPaths = JSON.parse(mediaPathsData);
+// Apply the aspect ratio of an image or video once its size is known
+function trackAspectRatio(wrapper, element) {
+    if (element.tagName === 'IMG') {
+        if (element.complete && element.naturalWidth) {
+            applyAspectRatio(wrapper, element.naturalWidth, element.naturalHeight);
+        } else {
+            element.addEventListener('load', () => {
+                applyAspectRatio(wrapper, element.naturalWidth, element.naturalHeight);
+            });
+        }
+    } else if (element.tagName === 'VIDEO') {
+        if (element.readyState >= 1) { // HAVE_METADATA
+            applyAspectRatio(wrapper, element.videoWidth, element.videoHeight);
+        } else {
+            element.addEventListener('loadedmetadata', () => {
+                applyAspectRatio(wrapper, element.videoWidth, element.videoHeight);
+            });
+        }
+    }
+}
 
-            if (!mediaPaths || mediaPaths.length === 0) {
-                // console.warn("No media paths found for container.", container);
-                return; // No paths, nothing to display or navigate
-            }
+// Move data-src into src so the browser starts loading the rendered first item
+function loadInitialItem(container) {
+    const wrapper = container.querySelector('.media-item');
+    if (!wrapper || container.dataset.loaded) {
+        return;
+    }
+    container.dataset.loaded = 'true';
 
-            const mediaItemWrapper = container.querySelector('.media-item'); // Expects a div.media-item
-            const leftArrow = container.querySelector('.left-arrow');
-            const rightArrow = container.querySelector('.right-arrow');
-            let currentIndex = 0; // The first item is already rendered by the template
-
-            // Hide arrows if only one item, even if template rendered them
-            if (mediaPaths.length <= 1) {
-                if(leftArrow) leftArrow.style.display = 'none';
-                if(rightArrow) rightArrow.style.display = 'none';
-                // If first item is an image, try to apply aspect ratio
-                const firstImg = mediaItemWrapper ? mediaItemWrapper.querySelector('img') : null;
-                if (firstImg) {
-                    if (firstImg.complete) {
-                         applyAspectRatio(mediaItemWrapper, firstImg.naturalWidth, firstImg.naturalHeight);
-                    } else {
-                        firstImg.addEventListener('load', () => {
-                            applyAspectRatio(mediaItemWrapper, firstImg.naturalWidth, firstImg.naturalHeight);
-                        });
-                    }
-                }
-                // If first item is a video, try to apply aspect ratio
-                const firstVid = mediaItemWrapper ? mediaItemWrapper.querySelector('video') : null;
-                if (firstVid) {
-                     if (firstVid.readyState >= 1) { // HAVE_METADATA
-                        applyAspectRatio(mediaItemWrapper, firstVid.videoWidth, firstVid.videoHeight);
-                    } else {
-                        firstVid.addEventListener('loadedmetadata', () => {
-                            applyAspectRatio(mediaItemWrapper, firstVid.videoWidth, firstVid.videoHeight);
-                        });
+    const img = wrapper.querySelector('img[data-src]');
+    if (img) {
+        img.src = img.dataset.src;
+        trackAspectRatio(wrapper, img);
+        return;
+    }
+
+    const video = wrapper.querySelector('video');
+    const source = video ? video.querySelector('source[data-src]') : null;
+    if (source) {
+        source.src = source.dataset.src;
+        // Only the metadata and first frame are fetched, which also serves as the poster
+        video.preload = 'metadata';
+        video.load();
+        trackAspectRatio(wrapper, video);
+    }
+}
+
+function mediaKind(path) {
+    const extension = path.split('.').pop().toLowerCase();
+    if (IMAGE_EXTENSIONS.includes(extension)) return 'image';
+    if (VIDEO_EXTENSIONS.includes(extension)) return 'video';
+    return 'other';
+}
+
+// Resolve to the full media list of a card: [{url, type, name}, ...]
+function loadMediaList(container) {
+    if (!container._mediaList) {
+        if (container.dataset.mediaUrl) {
+            container._mediaList = fetch(container.dataset.mediaUrl, { credentials: 'same-origin' })
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`Media list request failed: ${response.status}`);
                     }
-                }
-                return;
-            }
+                    return response.json();
+                })
+                .then(data => data.media)
+                .catch(error => {
+                    // Allow a retry on the next click
+                    container._mediaList = null;
+                    throw error;
+                });
+        } else {
+            // Older markup carries the paths inline
+            const mediaPaths = JSON.parse(container.dataset.mediaPaths || '[]');
+            container._mediaList = Promise.resolve(mediaPaths.map(path => ({
+                url: `/downloads/${path}`,
+                type: mediaKind(path),
+                name: path.split('/').pop()
+            })));
+        }
+    }
+    return container._mediaList;
+}
 
+// Replace the displayed item of a card
+function showMediaItem(container, item) {
+    const wrapper = container.querySelector('.media-item');
+    if (!wrapper) {
+        console.error("Media item wrapper not found in container.", container);
+        return;
+    }
+    wrapper.innerHTML = '';
+    wrapper.style.aspectRatio = '';
 
-            // Function to update the displayed media
-            function updateMediaDisplay(index) {
-                if (!mediaItemWrapper) {
-                    console.error("Media item wrapper not found in container.", container);
-                    return;
-                }
-                const mediaPath = mediaPaths[index];
-                const fileExtension = mediaPath.split('.').pop().toLowerCase();
-                // The URL is constructed in the template using url_for,
-                // here we just need the subpath for the serve_downloaded_file route
-                const mediaUrl = `/downloads/${mediaPath}`; // This needs to match the Flask route
-
-                // Clear previous media
-                mediaItemWrapper.innerHTML = '';
-
-                let newMediaElement;
-                if (['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'].includes(fileExtension)) {
-                    newMediaElement = document.createElement('img');
-                    newMediaElement.src = mediaUrl;
-                    // Alt text should be dynamic, passed from template or use a generic one
-                    newMediaElement.alt = container.dataset.altText || 'Downloaded media';
-                    newMediaElement.addEventListener('load', () => {
-                        applyAspectRatio(mediaItemWrapper, newMediaElement.naturalWidth, newMediaElement.naturalHeight);
-                    });
-                } else if (['mp4', 'mov', 'avi', 'mkv', 'webm'].includes(fileExtension)) {
-                    newMediaElement = document.createElement('video');
-                    newMediaElement.controls = true;
-                    const source = document.createElement('source');
-                    source.src = mediaUrl;
-                    source.type = `video/${fileExtension === 'mov' ? 'quicktime' : (fileExtension === 'mkv' ? 'x-matroska' : fileExtension)}`;
-                    newMediaElement.appendChild(source);
-                    newMediaElement.appendChild(document.createTextNode(container.dataset.videoNotSupportedText || 'Your browser does not support the video tag.'));
-                    newMediaElement.addEventListener('loadedmetadata', () => {
-                         applyAspectRatio(mediaItemWrapper, newMediaElement.videoWidth, newMediaElement.videoHeight);
-                    });
-                } else {
-                    newMediaElement = document.createElement('p');
-                    newMediaElement.textContent = (container.dataset.unsupportedMediaText || 'Unsupported media type') + `: ${mediaPath.split('/').pop()}`;
-                }
+    let element;
+    if (item.type === 'image') {
+        element = document.createElement('img');
+        element.decoding = 'async';
+        element.alt = container.dataset.altText || 'Downloaded media';
+        element.src = item.url;
+    } else if (item.type === 'video') {
+        const extension = item.name.split('.').pop().toLowerCase();
+        element = document.createElement('video');
+        element.controls = true;
+        element.playsInline = true;
+        element.preload = 'metadata';
+        const source = document.createElement('source');
+        source.src = item.url;
+        source.type = `video/${extension === 'mov' ? 'quicktime' : (extension === 'mkv' ? 'x-matroska' : extension)}`;
+        element.appendChild(source);
+        element.appendChild(document.createTextNode(container.dataset.videoNotSupportedText || 'Your browser does not support the video tag.'));
+    } else {
+        element = document.createElement('p');
+        element.textContent = (container.dataset.unsupportedMediaText || 'Unsupported media type') + `: ${item.name}`;
+    }
+    wrapper.appendChild(element);
+    trackAspectRatio(wrapper, element);
+}
 
-                if (newMediaElement) {
-                    mediaItemWrapper.appendChild(newMediaElement);
-                }
-            }
+function setupNavigation(container) {
+    const leftArrow = container.querySelector('.left-arrow');
+    const rightArrow = container.querySelector('.right-arrow');
+    const count = parseInt(container.dataset.mediaCount || '1', 10);
+    let currentIndex = 0; // The first item is already rendered by the template
 
-            // Attach event listeners
-            if (leftArrow) {
-                leftArrow.addEventListener('click', () => {
-                    currentIndex = (currentIndex - 1 + mediaPaths.length) % mediaPaths.length;
-                    updateMediaDisplay(currentIndex);
-                });
-            }
+    if (count <= 1) {
+        if (leftArrow) leftArrow.style.display = 'none';
+        if (rightArrow) rightArrow.style.display = 'none';
+        return;
+    }
 
-            if (rightArrow) {
-                rightArrow.addEventListener('click', () => {
-                    currentIndex = (currentIndex + 1) % mediaPaths.length;
-                    updateMediaDisplay(currentIndex);
-                });
-            }
-             // Initial aspect ratio for the first item if it's an image/video
-            const initialMediaElement = mediaItemWrapper.querySelector('img, video');
-            if (initialMediaElement) {
-                if (initialMediaElement.tagName === 'IMG') {
-                    if (initialMediaElement.complete) {
-                        applyAspectRatio(mediaItemWrapper, initialMediaElement.naturalWidth, initialMediaElement.naturalHeight);
-                    } else {
-                        initialMediaElement.addEventListener('load', () => {
-                            applyAspectRatio(mediaItemWrapper, initialMediaElement.naturalWidth, initialMediaElement.naturalHeight);
-                        });
-                    }
-                } else if (initialMediaElement.tagName === 'VIDEO') {
-                    if (initialMediaElement.readyState >= 1) { // HAVE_METADATA
-                        applyAspectRatio(mediaItemWrapper, initialMediaElement.videoWidth, initialMediaElement.videoHeight);
-                    } else {
-                        initialMediaElement.addEventListener('loadedmetadata', () => {
-                            applyAspectRatio(mediaItemWrapper, initialMediaElement.videoWidth, initialMediaElement.videoHeight);
-                        });
-                    }
-                }
-            }
+    function step(offset) {
+        loadMediaList(container).then(items => {
+            if (!items.length) return;
+            currentIndex = (currentIndex + offset + items.length) % items.length;
+            showMediaItem(container, items[currentIndex]);
+        }).catch(error => console.error("Error loading media list:", error));
+    }
 
+    if (leftArrow) leftArrow.addEventListener('click', () => step(-1));
+    if (rightArrow) rightArrow.addEventListener('click', () => step(1));
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const containers = document.querySelectorAll('.media-container');
 
+    let observer = null;
+    if ('IntersectionObserver' in window) {
+        observer = new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                const container = entry.target;
+                if (entry.isIntersecting) {
+                    loadInitialItem(container);
+                } else {
+                    // Stop playback of cards that scrolled away
+                    const video = container.querySelector('video');
+                    if (video && !video.paused) video.pause();
+                }
+            });
+        }, { rootMargin: LAZY_ROOT_MARGIN });
+    }
+
+    containers.forEach(container => {
+        try {
+            setupNavigation(container);
+            if (observer) {
+                observer.observe(container);
+            } else {
+                // Very old browsers: load everything right away
+                loadInitialItem(container);
+            }
         } catch (e) {
-            console.error("Error processing media container:", e, "Container data:", container.dataset.mediaPaths);
+            console.error("Error processing media container:", e, container);
         }
     });
 });
@@ -0,0 +1,104 @@
+"""
+Comparison of two history entries of the same chat.
+
+Everything is read from the covering indexes, without touching the table:
+each entry's results in ranking order from idx_search_results_history_reactions,
+and the messages in both entries from a join on idx_search_results_history_message.
+NumPy then looks up the ranks of the joined results and orders every view, so
+a comparison is built in one pass and its pages are served from the cache:
+
+    gained   messages in both entries, most reactions gained first
+    rank     messages in both entries, biggest climbers in the ranking first
+    new      messages only in the newer entry, in its ranking order
+    dropped  messages only in the older entry, in its ranking order
+
+View rows are (result id a, result id b, reactions a, reactions b, rank a,
+rank b) lists, with None for the side a message is missing from.
+"""
+from itertools import chain
+
+import numpy as np
+
+from telegramtracker.core import database
+
+VIEWS = ('gained', 'rank', 'new', 'dropped')
+
+
+def _int_pairs(rows):
+    # fromiter over the flattened pairs is much faster than np.array() over a list of tuples
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)).reshape(-1, 2)
+
+
+def _positions(ranked_ids, result_ids):
+    """Position of each of result_ids in ranked_ids."""
+    sorter = np.argsort(ranked_ids)
+    return sorter[np.searchsorted(ranked_ids, result_ids, sorter=sorter)]
+
+
+def _unmatched_rows(ranked, matched_ids, missing_side):
+    """View rows of the results of one entry that are not in the other, in ranking order."""
+    positions = np.flatnonzero(~np.isin(ranked[:, 0], matched_ids))
+    rows = []
+    for result_id, reactions, rank in zip(ranked[positions, 0].tolist(), ranked[positions, 1].tolist(), (positions + 1).tolist()):
+        if missing_side == 'a':
+            rows.append([None, result_id, None, reactions, None, rank])
+        else:
+            rows.append([result_id, None, reactions, None, rank, None])
+    return rows
+
+
+def compare(history_a, history_b):
+    """
+    Compare an older history entry a with a newer entry b. Returns (summary, views):
+    result counts and the total reaction gain, and the rows of every view.
+    """
+    ranked_a, ranked_b, pairs = database.get_history_comparison_rows(history_a, history_b)
+    ranked_a, ranked_b, pairs = _int_pairs(ranked_a), _int_pairs(ranked_b), _int_pairs(pairs)
+    positions_a = _positions(ranked_a[:, 0], pairs[:, 0])
+    positions_b = _positions(ranked_b[:, 0], pairs[:, 1])
+    reactions_a, reactions_b = ranked_a[positions_a, 1], ranked_b[positions_b, 1]
+    ranks_a, ranks_b = positions_a + 1, positions_b + 1
+    delta = reactions_b - reactions_a
+    matched = np.column_stack((pairs[:, 0], pairs[:, 1], reactions_a, reactions_b, ranks_a, ranks_b))
+    new = _unmatched_rows(ranked_b, pairs[:, 1], 'a')
+    dropped = _unmatched_rows(ranked_a, pairs[:, 0], 'b')
+
+    summary = {
+        'total_a': len(ranked_a),
+        'total_b': len(ranked_b),
+        'matched': len(pairs),
+        'reactions_gained': int(delta.sum()),
+        'new': len(new),
+        'dropped': len(dropped),
+    }
+    views = {
+        # lexsort sorts by its last key first; ties go to the better rank in b
+        'gained': matched[np.lexsort((ranks_b, -delta))].tolist(),
+        'rank': matched[np.lexsort((ranks_b, ranks_b - ranks_a))].tolist(),
+        'new': new,
+        'dropped': dropped,
+    }
+    return summary, views
+
+
+def page_rows(rows):
+    """Turn view rows into dicts for the template, with the preview and link of each message."""
+    results = {result['result_id']: result for result in database.get_history_results_by_ids(
+        [id_b if id_b is not None else id_a for id_a, id_b, _, _, _, _ in rows]
+    )}
+    page = []
+    for id_a, id_b, reactions_a, reactions_b, rank_a, rank_b in rows:
+        result = results.get(id_b if id_b is not None else id_a)
+        if result is None:
+            continue
+        page.append({
+            'message_id': result['message_id'],
+            'reactions_a': reactions_a,
+            'reactions_b': reactions_b,
+            'delta': (reactions_b or 0) - (reactions_a or 0),
+            'rank_a': rank_a,
+            'rank_b': rank_b,
+            'message_preview': result['message_preview'],
+            'message_link': result['message_link'],
+        })
+    return page
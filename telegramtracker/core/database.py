@@ -1,13 +1,26 @@
 import sqlite3
 import os
+import threading
+import time
+import json
 
 # Database settings
 DATABASE = 'history.db'
+VIEW_FLUSH_SECONDS = 60  # Views of history entries are written at most this often
+
+_pending_views = {}  # history_id -> time of the last view not written yet
+_pending_views_lock = threading.Lock()
+_view_flush_timer = None
 
 def init_db():
     """Initialize database and create necessary tables."""
     conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
+    # Only takes effect for new databases; existing ones are converted with
+    # `python -m telegramtracker.core.maintenance --enable-incremental-vacuum`
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL lets worker processes read while another one writes
+    cursor.execute("PRAGMA journal_mode = WAL")
     
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS search_history (
@@ -23,6 +36,30 @@ def init_db():
             download_folder_path TEXT
         )
     ''')
+    # One row per (chat, message), shared by every search of that chat
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            message_preview TEXT,
+            message_link TEXT NOT NULL,
+            first_seen INTEGER NOT NULL,
+            last_seen INTEGER NOT NULL,
+            UNIQUE (chat_id, message_id)
+        )
+    ''')
+    # Append-only reaction counts per stored message; a row is only written when the count changed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reaction_snapshots (
+            chat_message_id INTEGER NOT NULL,
+            captured_at INTEGER NOT NULL,
+            reaction_count INTEGER NOT NULL,
+            history_id INTEGER,
+            PRIMARY KEY (chat_message_id, captured_at)
+        ) WITHOUT ROWID
+    ''')
+    # Per-search ranking; preview and link live in chat_messages (kept here only for legacy rows)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS search_results (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,8 +67,10 @@ def init_db():
             message_id INTEGER NOT NULL,
             reaction_count INTEGER NOT NULL,
             message_preview TEXT,
-            message_link TEXT NOT NULL,
-            FOREIGN KEY (history_id) REFERENCES search_history (id)
+            message_link TEXT,
+            chat_message_id INTEGER,
+            FOREIGN KEY (history_id) REFERENCES search_history (id),
+            FOREIGN KEY (chat_message_id) REFERENCES chat_messages (id)
         )
     ''')
     cursor.execute('''
@@ -42,11 +81,309 @@ def init_db():
             FOREIGN KEY (result_id) REFERENCES search_results (id) ON DELETE CASCADE
         )
     ''')
+    # Per-reaction counts of each result; reaction keys are interned in reaction_types
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reaction_types (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reaction_key TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS result_reactions (
+            history_id INTEGER NOT NULL,
+            reaction_type_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (history_id, reaction_type_id, message_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_result_reactions_count ON result_reactions (history_id, reaction_type_id, count)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_results_history_message ON search_results (history_id, message_id)")
+    # Scan jobs shared by all worker processes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            owner_pid INTEGER,
+            original_identifier TEXT,
+            period_days INTEGER,
+            phase TEXT NOT NULL DEFAULT 'scan',
+            scanned_count INTEGER NOT NULL DEFAULT 0,
+            media_total INTEGER NOT NULL DEFAULT 0,
+            media_processed INTEGER NOT NULL DEFAULT 0,
+            history_id INTEGER,
+            error TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+    # Scan settings and the last scanned message, so interrupted scans can be resumed
+    job_columns = _column_names(cursor, 'jobs')
+    if 'scan_params' not in job_columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN scan_params TEXT")
+    if 'scan_since' not in job_columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN scan_since INTEGER")
+    if 'last_message_id' not in job_columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN last_message_id INTEGER")
+    # Why a scan ended early: 'cancelled', 'time_budget' or 'message_budget' (NULL if it ran to the end)
+    if 'stop_reason' not in job_columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN stop_reason TEXT")
+    if 'stop_reason' not in _column_names(cursor, 'search_history'):
+        cursor.execute("ALTER TABLE search_history ADD COLUMN stop_reason TEXT")
+    # Sender aggregates of checkpoints written before job_checkpoint_senders (JSON)
+    if 'sender_stats' not in job_columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN sender_stats TEXT")
+    # Identifies the run of the owning process; PIDs repeat after restarts, tokens do not
+    if 'owner_token' not in job_columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN owner_token TEXT")
+    # How the scan read its messages ('regular', 'takeout' or 'sample'), restored when it is resumed
+    if 'scan_mode' not in job_columns:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN scan_mode TEXT")
+    # Results collected by a running scan up to its last checkpoint
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_checkpoint_messages (
+            job_id TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (job_id, message_id)
+        ) WITHOUT ROWID
+    ''')
+    # Sender aggregates of a running scan up to its last checkpoint, one row per sender
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_checkpoint_senders (
+            job_id TEXT NOT NULL,
+            sender_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            reaction_total INTEGER NOT NULL,
+            top_message_id INTEGER,
+            top_reactions INTEGER,
+            PRIMARY KEY (job_id, sender_id)
+        ) WITHOUT ROWID
+    ''')
+    # Result pages spilled from the in-memory result cache
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache_sets (
+            cache_key TEXT PRIMARY KEY,
+            total_items INTEGER NOT NULL,
+            per_page INTEGER NOT NULL,
+            page_count INTEGER NOT NULL,
+            meta TEXT,
+            created_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache_pages (
+            cache_key TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            PRIMARY KEY (cache_key, page)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_results_chat_message ON search_results (chat_message_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_history_chat ON search_history (chat_numeric_id)")
+    if 'message_text' not in _column_names(cursor, 'chat_messages'):
+        cursor.execute("ALTER TABLE chat_messages ADD COLUMN message_text TEXT")
+    if 'last_viewed_at' not in _column_names(cursor, 'search_history'):
+        cursor.execute("ALTER TABLE search_history ADD COLUMN last_viewed_at INTEGER")
+    # Bumped whenever the stored results of an entry change; used for API ETags
+    if 'revision' not in _column_names(cursor, 'search_history'):
+        cursor.execute("ALTER TABLE search_history ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    # Media type, sender, date range and reaction minimum a scan was limited to (JSON)
+    if 'scan_filters' not in _column_names(cursor, 'search_history'):
+        cursor.execute("ALTER TABLE search_history ADD COLUMN scan_filters TEXT")
+    # History entries saved by one batch scan share its batch id (the id of the batch's job)
+    if 'batch_id' not in _column_names(cursor, 'search_history'):
+        cursor.execute("ALTER TABLE search_history ADD COLUMN batch_id TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_history_batch ON search_history (batch_id)")
+    # Views, forwards, replies and post date of results, for engagement scoring (core/scoring.py)
+    result_columns = _column_names(cursor, 'search_results')
+    for column in ('views', 'forwards', 'replies', 'posted_at'):
+        if column not in result_columns:
+            cursor.execute(f"ALTER TABLE search_results ADD COLUMN {column} INTEGER")
+    # Per-sender aggregates of a scan, for the sender leaderboard
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_senders (
+            history_id INTEGER NOT NULL,
+            sender_id INTEGER NOT NULL,
+            sender_name TEXT,
+            sender_username TEXT,
+            message_count INTEGER NOT NULL,
+            reaction_total INTEGER NOT NULL,
+            top_message_id INTEGER,
+            top_reactions INTEGER,
+            PRIMARY KEY (history_id, sender_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_senders_total ON history_senders (history_id, reaction_total)")
+    # How a scan read its messages ('regular', 'takeout' or 'sample') and a sample's estimates (JSON)
+    if 'scan_mode' not in _column_names(cursor, 'search_history'):
+        cursor.execute("ALTER TABLE search_history ADD COLUMN scan_mode TEXT")
+    if 'sample_stats' not in _column_names(cursor, 'search_history'):
+        cursor.execute("ALTER TABLE search_history ADD COLUMN sample_stats TEXT")
+    # Chats followed live by the reaction watcher (services/watcher.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS watched_chats (
+            chat_id INTEGER PRIMARY KEY,
+            chat_identifier TEXT NOT NULL,
+            chat_title TEXT,
+            added_at INTEGER NOT NULL
+        )
+    ''')
+    # The process currently running the watcher; only one may, since they share the Telegram session
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS watcher_lease (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            owner_pid INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    if 'owner_token' not in _column_names(cursor, 'watcher_lease'):
+        cursor.execute("ALTER TABLE watcher_lease ADD COLUMN owner_token TEXT")
+    # A pending maintenance run requested by any worker process; the maintenance worker polls it
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_requests (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            requested_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_media_path ON message_media (media_path)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_media_result ON message_media (result_id)")
+    # Lets ranked reads of a history entry walk the index instead of sorting
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_results_history_reactions ON search_results (history_id, reaction_count DESC)")
     conn.commit()
+
+    if 'chat_message_id' not in _column_names(cursor, 'search_results'):
+        _migrate_search_results_to_message_store(conn)
+
+    _init_message_search(conn)
+
     conn.close()
     print("Database initialized.")
 
-def save_search_history(original_identifier, entity, period_days, message_count, scanned_count, download_folder_path=None):
+def _column_names(cursor, table):
+    """Return the column names of a table."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+def _migrate_search_results_to_message_store(conn):
+    """Move previews and links of existing results into chat_messages and seed reaction_snapshots."""
+    print("Migrating search results to the shared message store...")
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_keys = OFF;") # message_media keeps pointing at search_results while it is rebuilt
+    try:
+        cursor.execute("BEGIN")
+        # Rebuild search_results so message_link can be NULL for rows stored in chat_messages
+        cursor.execute('''
+            CREATE TABLE search_results_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                history_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                reaction_count INTEGER NOT NULL,
+                message_preview TEXT,
+                message_link TEXT,
+                chat_message_id INTEGER,
+                FOREIGN KEY (history_id) REFERENCES search_history (id),
+                FOREIGN KEY (chat_message_id) REFERENCES chat_messages (id)
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO search_results_new (id, history_id, message_id, reaction_count, message_preview, message_link)
+            SELECT id, history_id, message_id, reaction_count, message_preview, message_link FROM search_results
+        ''')
+        cursor.execute("DROP TABLE search_results")
+        cursor.execute("ALTER TABLE search_results_new RENAME TO search_results")
+
+        # Oldest search first, so the newest preview of a message wins
+        cursor.execute('''
+            INSERT INTO chat_messages (chat_id, message_id, message_preview, message_link, first_seen, last_seen)
+            SELECT sh.chat_numeric_id, sr.message_id, sr.message_preview, sr.message_link,
+                   CAST(strftime('%s', sh.timestamp) AS INTEGER), CAST(strftime('%s', sh.timestamp) AS INTEGER)
+            FROM search_results sr
+            JOIN search_history sh ON sh.id = sr.history_id
+            WHERE sh.chat_numeric_id IS NOT NULL
+            ORDER BY sh.timestamp
+            ON CONFLICT (chat_id, message_id) DO UPDATE SET
+                message_preview = excluded.message_preview,
+                message_link = excluded.message_link,
+                last_seen = excluded.last_seen
+        ''')
+        cursor.execute('''
+            UPDATE search_results SET
+                chat_message_id = (
+                    SELECT cm.id FROM chat_messages cm
+                    JOIN search_history sh ON sh.chat_numeric_id = cm.chat_id
+                    WHERE sh.id = search_results.history_id AND cm.message_id = search_results.message_id
+                ),
+                message_preview = NULL,
+                message_link = NULL
+            WHERE history_id IN (SELECT id FROM search_history WHERE chat_numeric_id IS NOT NULL)
+        ''')
+        cursor.execute('''
+            INSERT OR REPLACE INTO reaction_snapshots (chat_message_id, captured_at, reaction_count, history_id)
+            SELECT sr.chat_message_id, CAST(strftime('%s', sh.timestamp) AS INTEGER), sr.reaction_count, sr.history_id
+            FROM search_results sr
+            JOIN search_history sh ON sh.id = sr.history_id
+            WHERE sr.chat_message_id IS NOT NULL
+        ''')
+        conn.commit()
+        print("Migration complete.")
+    except Exception as e:
+        print(f"Error migrating search results: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON;")
+
+def _init_message_search(conn):
+    """Create the FTS5 index over stored messages and the triggers that keep it in sync."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_search'")
+    needs_rebuild = cursor.fetchone() is None
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                message_preview,
+                message_text,
+                content='chat_messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search unavailable (SQLite built without FTS5?): {e}")
+        return
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_search_insert AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO message_search (rowid, message_preview, message_text)
+            VALUES (new.id, new.message_preview, new.message_text);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_search_delete AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO message_search (message_search, rowid, message_preview, message_text)
+            VALUES ('delete', old.id, old.message_preview, old.message_text);
+        END
+    ''')
+    # Rescans rewrite the preview on every upsert, so only reindex when the text actually changed
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_search_update AFTER UPDATE OF message_preview, message_text ON chat_messages
+        WHEN old.message_preview IS NOT new.message_preview OR old.message_text IS NOT new.message_text
+        BEGIN
+            INSERT INTO message_search (message_search, rowid, message_preview, message_text)
+            VALUES ('delete', old.id, old.message_preview, old.message_text);
+            INSERT INTO message_search (rowid, message_preview, message_text)
+            VALUES (new.id, new.message_preview, new.message_text);
+        END
+    ''')
+    if needs_rebuild:
+        # Index messages stored before the search table existed
+        cursor.execute("INSERT INTO message_search (message_search) VALUES ('rebuild')")
+    conn.commit()
+
+def save_search_history(original_identifier, entity, period_days, message_count, scanned_count, download_folder_path=None, stop_reason=None, batch_id=None, scan_filters=None,
+                        scan_mode=None, sample_stats=None):
     """Save search history to database and return history_id."""
     try:
         conn = sqlite3.connect(DATABASE)
@@ -58,9 +395,10 @@ def save_search_history(original_identifier, entity, period_days, message_count,
 
         # Add to history table
         cursor.execute('''
-            INSERT INTO search_history (chat_identifier, chat_title, chat_username, chat_numeric_id, period_days, messages_found, scanned_count, download_folder_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (str(original_identifier), chat_title, chat_username, chat_numeric_id, period_days, message_count, scanned_count, download_folder_path))
+            INSERT INTO search_history (chat_identifier, chat_title, chat_username, chat_numeric_id, period_days, messages_found, scanned_count, download_folder_path, stop_reason, batch_id, scan_filters, scan_mode, sample_stats)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (str(original_identifier), chat_title, chat_username, chat_numeric_id, period_days, message_count, scanned_count, download_folder_path, stop_reason, batch_id,
+              json.dumps(scan_filters) if scan_filters else None, scan_mode, json.dumps(sample_stats) if sample_stats else None))
 
         history_id = cursor.lastrowid  # Get ID of inserted record
         conn.commit()
@@ -92,10 +430,13 @@ def delete_history_entries_by_ids(history_ids):
         id_placeholders = ','.join('?' for _ in safe_ids)
 
         # First delete related results
+        cursor.execute(f"DELETE FROM result_reactions WHERE history_id IN ({id_placeholders})", safe_ids)
+        cursor.execute(f"DELETE FROM history_senders WHERE history_id IN ({id_placeholders})", safe_ids)
         cursor.execute(f"DELETE FROM search_results WHERE history_id IN ({id_placeholders})", safe_ids)
         results_deleted = cursor.rowcount
 
         # Then delete the history entries
+        _bump_following_revisions(cursor, safe_ids)
         cursor.execute(f"DELETE FROM search_history WHERE id IN ({id_placeholders})", safe_ids)
         history_deleted = cursor.rowcount
 
@@ -112,7 +453,7 @@ def delete_history_entries_by_ids(history_ids):
             conn.close()
 
 def save_search_results(history_id, messages, build_link_func):
-    """Save search results to database."""
+    """Save search results (ScannedMessage records) to database."""
     if not history_id:
         print("Cannot save results without a valid history_id")
         return False
@@ -120,37 +461,51 @@ def save_search_results(history_id, messages, build_link_func):
     try:
         conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
-        
-        # Prepare results
-        results_to_insert = []
-        for msg in messages:
-            link = build_link_func(msg['id'])  # Create link
-            results_to_insert.append((
-                history_id,
-                msg['id'],
-                msg['reactions'],
-                msg['preview'],
-                link
-            ))
+
+        cursor.execute("SELECT chat_numeric_id FROM search_history WHERE id = ?", (history_id,))
+        row = cursor.fetchone()
+        chat_id = row[0] if row else None
+        captured_at = int(time.time())
+        reaction_type_cache = {}
 
         # Insert results one by one to get the result_id for media
         for msg in messages:
-            link = build_link_func(msg['id'])  # Create link
-            cursor.execute('''
-                INSERT INTO search_results (history_id, message_id, reaction_count, message_preview, message_link)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (history_id, msg['id'], msg['reactions'], msg['preview'], link))
+            link = build_link_func(msg.id)  # Links are not kept in memory during the scan
+
+            if chat_id is not None:
+                # Store the message once per chat and reference it from this search
+                chat_message_id = _upsert_chat_message(cursor, chat_id, msg.id, msg.preview, link, captured_at, msg.text)
+                _append_reaction_snapshot(cursor, chat_message_id, captured_at, msg.reactions, history_id)
+                cursor.execute('''
+                    INSERT INTO search_results (history_id, message_id, reaction_count, chat_message_id, views, forwards, replies, posted_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (history_id, msg.id, msg.reactions, chat_message_id, msg.views, msg.forwards, msg.replies, msg.posted_at))
+            else:
+                # Without a numeric chat id the message cannot be shared, keep it inline
+                cursor.execute('''
+                    INSERT INTO search_results (history_id, message_id, reaction_count, message_preview, message_link, views, forwards, replies, posted_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (history_id, msg.id, msg.reactions, msg.preview, link, msg.views, msg.forwards, msg.replies, msg.posted_at))
 
             result_id = cursor.lastrowid # Get ID of the inserted search_results row
 
+            # Save the per-reaction breakdown if available
+            if msg.reaction_breakdown:
+                type_ids = _reaction_type_ids(cursor, msg.reaction_breakdown, reaction_type_cache)
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO result_reactions (history_id, reaction_type_id, message_id, count)
+                    VALUES (?, ?, ?, ?)
+                ''', [(history_id, type_ids[key], msg.id, count) for key, count in msg.reaction_breakdown.items()])
+
             # Save media paths if available
-            if 'media_paths' in msg and msg['media_paths']:
-                media_to_insert = [(result_id, media_path) for media_path in msg['media_paths']]
+            if msg.media_paths:
+                media_to_insert = [(result_id, media_path) for media_path in msg.media_paths]
                 cursor.executemany('''
                     INSERT INTO message_media (result_id, media_path)
                     VALUES (?, ?)
                 ''', media_to_insert)
 
+        _bump_history_revision(cursor, history_id)
         conn.commit()
         print(f"{len(messages)} results and associated media saved to database (history_id: {history_id}).")
         return True
@@ -163,6 +518,147 @@ def save_search_results(history_id, messages, build_link_func):
         if conn:
             conn.close()
 
+def _upsert_chat_message(cursor, chat_id, message_id, preview, link, seen_at, text=None):
+    """Insert or refresh a message in the shared store and return its chat_messages id."""
+    cursor.execute('''
+        INSERT INTO chat_messages (chat_id, message_id, message_preview, message_link, first_seen, last_seen, message_text)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (chat_id, message_id) DO UPDATE SET
+            message_preview = excluded.message_preview,
+            message_link = excluded.message_link,
+            last_seen = excluded.last_seen,
+            message_text = COALESCE(excluded.message_text, message_text)
+    ''', (chat_id, message_id, preview, link, seen_at, seen_at, text))
+    cursor.execute("SELECT id FROM chat_messages WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+    return cursor.fetchone()[0]
+
+def _reaction_type_ids(cursor, reaction_keys, cache):
+    """Return {reaction_key: reaction_types.id}, creating missing types."""
+    for key in reaction_keys:
+        if key not in cache:
+            cursor.execute("INSERT OR IGNORE INTO reaction_types (reaction_key) VALUES (?)", (key,))
+            cursor.execute("SELECT id FROM reaction_types WHERE reaction_key = ?", (key,))
+            cache[key] = cursor.fetchone()[0]
+    return cache
+
+def _append_reaction_snapshot(cursor, chat_message_id, captured_at, reaction_count, history_id=None):
+    """Append a reaction snapshot unless the count is unchanged since the last one."""
+    cursor.execute('''
+        INSERT OR REPLACE INTO reaction_snapshots (chat_message_id, captured_at, reaction_count, history_id)
+        SELECT ?, ?, ?, ?
+        WHERE COALESCE((
+            SELECT reaction_count FROM reaction_snapshots
+            WHERE chat_message_id = ? ORDER BY captured_at DESC LIMIT 1
+        ), -1) != ?
+    ''', (chat_message_id, captured_at, reaction_count, history_id, chat_message_id, reaction_count))
+
+def _bump_history_revision(cursor, history_id):
+    cursor.execute("UPDATE search_history SET revision = revision + 1 WHERE id = ?", (history_id,))
+
+def _bump_following_revisions(cursor, deleted_ids):
+    """
+    Before entries are deleted: bump the revision of the next remaining entry of
+    the same chat, whose cached pages link to its previous scan.
+    """
+    placeholders = ','.join('?' for _ in deleted_ids)
+    cursor.execute(f"""
+        UPDATE search_history SET revision = revision + 1
+        WHERE id IN (
+            SELECT MIN(following.id)
+            FROM search_history deleted
+            JOIN search_history following
+              ON following.id > deleted.id
+             AND (following.chat_numeric_id = deleted.chat_numeric_id
+                  OR (following.chat_numeric_id IS NULL AND following.chat_identifier = deleted.chat_identifier))
+            WHERE deleted.id IN ({placeholders}) AND following.id NOT IN ({placeholders})
+            GROUP BY deleted.id
+        )
+    """, [*deleted_ids, *deleted_ids])
+
+def get_history_revision(history_id):
+    """Return the revision counter of a history entry, or None if it does not exist."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute("SELECT revision FROM search_history WHERE id = ?", (history_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def get_history_list_state():
+    """Return (entry count, newest id, sum of revisions); changes whenever the history list does."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(revision), 0) FROM search_history")
+    state = cursor.fetchone()
+    conn.close()
+    return state
+
+def get_history_entries_after(before_id=None, limit=50):
+    """Return up to `limit` history entries, newest first, with ids below before_id (keyset pagination)."""
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, timestamp, chat_identifier, chat_title, chat_username, chat_numeric_id,
+               period_days, messages_found, scanned_count, stop_reason, batch_id, revision
+        FROM search_history
+        WHERE ? IS NULL OR id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    """, (before_id, before_id, limit))
+    entries = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return entries
+
+def get_history_results_after(history_id, after=None, limit=50):
+    """
+    Return up to `limit` results of a history entry in ranking order, starting after
+    the (reaction_count, result id) position `after` (keyset pagination). Each result
+    carries its `result_id` so the caller can build the next position.
+    """
+    after_count, after_id = after if after else (None, None)
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT
+            sr.id AS result_id,
+            sr.message_id,
+            sr.reaction_count,
+            COALESCE(cm.message_preview, sr.message_preview) AS message_preview,
+            COALESCE(cm.message_link, sr.message_link) AS message_link,
+            (SELECT GROUP_CONCAT(media_path) FROM message_media WHERE result_id = sr.id) AS media_paths
+        FROM search_results sr
+        LEFT JOIN chat_messages cm ON cm.id = sr.chat_message_id
+        WHERE sr.history_id = ?
+          AND (? IS NULL OR sr.reaction_count < ? OR (sr.reaction_count = ? AND sr.id > ?))
+        ORDER BY sr.reaction_count DESC, sr.id
+        LIMIT ?
+    """, (history_id, after_count, after_count, after_count, after_id, limit))
+    results = []
+    for row in cursor.fetchall():
+        result_dict = dict(row)
+        media_paths_str = result_dict['media_paths']
+        result_dict['media_paths'] = [path.strip() for path in media_paths_str.split(',') if path.strip()] if media_paths_str else []
+        results.append(result_dict)
+    conn.close()
+    return results
+
+def get_result_media(history_id, message_id):
+    """Return the media paths of one result of a history entry, in download order."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT mm.media_path
+        FROM search_results sr
+        JOIN message_media mm ON mm.result_id = sr.id
+        WHERE sr.history_id = ? AND sr.message_id = ?
+        ORDER BY mm.id
+    """, (history_id, message_id))
+    paths = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return paths
+
 def get_search_history():
     """Return all search history."""
     conn = sqlite3.connect(DATABASE)
@@ -192,10 +688,15 @@ def get_history_results(history_id):
         SELECT
             sr.message_id,
             sr.reaction_count,
-            sr.message_preview,
-            sr.message_link,
+            COALESCE(cm.message_preview, sr.message_preview) AS message_preview,
+            COALESCE(cm.message_link, sr.message_link) AS message_link,
+            sr.views,
+            sr.forwards,
+            sr.replies,
+            sr.posted_at,
             GROUP_CONCAT(mm.media_path) AS media_paths
         FROM search_results sr
+        LEFT JOIN chat_messages cm ON cm.id = sr.chat_message_id
         LEFT JOIN message_media mm ON sr.id = mm.result_id
         WHERE sr.history_id = ?
         GROUP BY sr.id
@@ -220,6 +721,109 @@ def get_history_results(history_id):
     conn.close()
     return processed_results
 
+# Numeric result columns that engagement scoring reads; missing values count as 0
+SCORE_COLUMNS = ('reaction_count', 'views', 'forwards', 'replies', 'posted_at')
+
+def get_history_score_columns(history_id, columns=SCORE_COLUMNS):
+    """
+    Return (first id, last id, result ids, column strings) for the results of a history
+    entry, or None if it has none. Each of the given numeric columns is one comma-
+    separated string in the same row order; SQLite builds the strings itself, so no
+    Python object is created per row. The results of an entry are saved together and
+    read as one rowid range; when that range holds nothing else, the ids are implied
+    by it and result ids is None.
+    """
+    unknown = set(columns) - set(SCORE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown score columns: {sorted(unknown)}")
+    conn = sqlite3.connect(DATABASE)
+    try:
+        first_id, last_id, count = conn.execute(
+            "SELECT MIN(id), MAX(id), COUNT(*) FROM search_results WHERE history_id = ?", (history_id,)
+        ).fetchone()
+        if first_id is None:
+            return None
+        selected = [f"GROUP_CONCAT(COALESCE({column}, 0))" for column in columns]
+        if count != last_id - first_id + 1:
+            selected.insert(0, "GROUP_CONCAT(id)")
+        # The + keeps SQLite on the rowid range instead of the history_id indexes
+        row = conn.execute(f"""
+            SELECT {', '.join(selected)}
+            FROM search_results
+            WHERE id BETWEEN ? AND ? AND +history_id = ?
+        """, (first_id, last_id, history_id)).fetchone()
+    finally:
+        conn.close()
+    if len(row) > len(columns):
+        return first_id, last_id, row[0], row[1:]
+    return first_id, last_id, None, row
+
+def get_history_results_by_ids(result_ids):
+    """Return results (as get_history_results() does) by search_results id, in the order of the ids given."""
+    if not result_ids:
+        return []
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    placeholders = ','.join('?' for _ in result_ids)
+    cursor.execute(f"""
+        SELECT
+            sr.id AS result_id,
+            sr.message_id,
+            sr.reaction_count,
+            COALESCE(cm.message_preview, sr.message_preview) AS message_preview,
+            COALESCE(cm.message_link, sr.message_link) AS message_link,
+            sr.views,
+            sr.forwards,
+            sr.replies,
+            sr.posted_at,
+            (SELECT GROUP_CONCAT(media_path) FROM message_media WHERE result_id = sr.id) AS media_paths
+        FROM search_results sr
+        LEFT JOIN chat_messages cm ON cm.id = sr.chat_message_id
+        WHERE sr.id IN ({placeholders})
+    """, list(result_ids))
+    results_by_id = {}
+    for row in cursor.fetchall():
+        result_dict = dict(row)
+        media_paths_str = result_dict['media_paths']
+        result_dict['media_paths'] = [path.strip() for path in media_paths_str.split(',') if path.strip()] if media_paths_str else []
+        results_by_id[result_dict['result_id']] = result_dict
+    conn.close()
+    return [results_by_id[result_id] for result_id in result_ids if result_id in results_by_id]
+
+def iter_history_results(history_id, batch_size=500):
+    """
+    Yield the results of a history entry one dict at a time, in ranking order,
+    straight from the database cursor so memory use does not grow with the entry.
+    """
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT
+                sr.message_id,
+                sr.reaction_count,
+                COALESCE(cm.message_preview, sr.message_preview) AS message_preview,
+                COALESCE(cm.message_link, sr.message_link) AS message_link,
+                (SELECT GROUP_CONCAT(media_path) FROM message_media WHERE result_id = sr.id) AS media_paths
+            FROM search_results sr
+            LEFT JOIN chat_messages cm ON cm.id = sr.chat_message_id
+            WHERE sr.history_id = ?
+            ORDER BY sr.reaction_count DESC, sr.id
+        """, (history_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                result_dict = dict(row)
+                media_paths_str = result_dict['media_paths']
+                result_dict['media_paths'] = [path.strip() for path in media_paths_str.split(',') if path.strip()] if media_paths_str else []
+                yield result_dict
+    finally:
+        conn.close()
+
 def delete_history_entry(history_id):
     """Delete a history entry and all related results."""
     try:
@@ -228,10 +832,13 @@ def delete_history_entry(history_id):
         cursor.execute("PRAGMA foreign_keys = ON;") # Ensure FK constraints are enforced
         
         # First delete related results (which should cascade to message_media)
+        cursor.execute("DELETE FROM result_reactions WHERE history_id = ?", (history_id,))
+        cursor.execute("DELETE FROM history_senders WHERE history_id = ?", (history_id,))
         cursor.execute("DELETE FROM search_results WHERE history_id = ?", (history_id,))
         results_deleted = cursor.rowcount
         
         # Then delete the history entry
+        _bump_following_revisions(cursor, [history_id])
         cursor.execute("DELETE FROM search_history WHERE id = ?", (history_id,))
         history_deleted = cursor.rowcount
         
@@ -246,3 +853,497 @@ def delete_history_entry(history_id):
     finally:
         if conn:
             conn.close()
+
+def get_batch_entries(batch_id):
+    """Return the history entries saved by a batch scan, in the order they were saved."""
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, timestamp, chat_identifier, chat_title, period_days, messages_found, scanned_count, stop_reason
+        FROM search_history WHERE batch_id = ? ORDER BY id
+    """, (batch_id,))
+    entries = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return entries
+
+def get_batch_leaderboard(batch_id, limit=50):
+    """
+    Return the top results across all chats of a batch scan.
+
+    Raw counts are not comparable between a large and a small channel, so each
+    result is scored by its reaction count divided by the average count of the
+    results of its own chat; 2.0 means twice as many reactions as usual there.
+    """
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        WITH scored AS (
+            SELECT
+                sh.id AS history_id,
+                COALESCE(sh.chat_title, sh.chat_identifier) AS chat_title,
+                sr.message_id,
+                sr.reaction_count,
+                COALESCE(cm.message_preview, sr.message_preview) AS message_preview,
+                COALESCE(cm.message_link, sr.message_link) AS message_link,
+                AVG(sr.reaction_count) OVER (PARTITION BY sr.history_id) AS chat_average
+            FROM search_results sr
+            JOIN search_history sh ON sh.id = sr.history_id
+            LEFT JOIN chat_messages cm ON cm.id = sr.chat_message_id
+            WHERE sh.batch_id = ?
+        )
+        SELECT *, CASE WHEN chat_average > 0 THEN reaction_count / chat_average ELSE 0 END AS score
+        FROM scored
+        ORDER BY score DESC, reaction_count DESC
+        LIMIT ?
+    """, (batch_id, limit))
+    leaderboard = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return leaderboard
+
+def save_sender_stats(history_id, sender_stats):
+    """Save the per-sender aggregates of a scan (dicts from telegram_client.sender_leaderboard)."""
+    if not history_id or not sender_stats:
+        return False
+    conn = None
+    try:
+        conn = sqlite3.connect(DATABASE)
+        conn.executemany('''
+            INSERT OR REPLACE INTO history_senders
+                (history_id, sender_id, sender_name, sender_username, message_count, reaction_total, top_message_id, top_reactions)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(history_id, sender['sender_id'], sender['name'], sender['username'], sender['message_count'],
+               sender['reaction_total'], sender['top_message_id'], sender['top_reactions']) for sender in sender_stats])
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error saving sender stats: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def get_history_senders(history_id, limit=20):
+    """Return the senders of a history entry with the most reactions, with a link to their top post if it was kept."""
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT
+            hs.sender_id,
+            hs.sender_name,
+            hs.sender_username,
+            hs.message_count,
+            hs.reaction_total,
+            ROUND(CAST(hs.reaction_total AS REAL) / hs.message_count, 2) AS reaction_mean,
+            hs.top_message_id,
+            hs.top_reactions,
+            COALESCE(cm.message_link, sr.message_link) AS top_message_link
+        FROM history_senders hs
+        LEFT JOIN search_results sr ON sr.history_id = hs.history_id AND sr.message_id = hs.top_message_id
+        LEFT JOIN chat_messages cm ON cm.id = sr.chat_message_id
+        WHERE hs.history_id = ?
+        ORDER BY hs.reaction_total DESC
+        LIMIT ?
+    """, (history_id, limit))
+    senders = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return senders
+
+def get_history_comparison_rows(history_a, history_b):
+    """
+    Return the rows a comparison of two history entries is built from, read in one
+    transaction from the covering indexes alone, without touching the table:
+    (result id, reaction_count) of each entry in ranking order, and the (result id a,
+    result id b) pairs of the messages in both, joined on message id.
+    """
+    conn = sqlite3.connect(DATABASE)
+    try:
+        conn.execute("BEGIN")
+        # Most reactions first, as on the history page; ties by id so ranks are stable
+        ranked = [conn.execute("""
+            SELECT id, reaction_count FROM search_results
+            WHERE history_id = ?
+            ORDER BY reaction_count DESC, id
+        """, (history_id,)).fetchall() for history_id in (history_a, history_b)]
+        # Both sides stay on idx_search_results_history_message, which holds message_id and id
+        pairs = conn.execute("""
+            SELECT a.id, b.id
+            FROM search_results b INDEXED BY idx_search_results_history_message
+            JOIN search_results a INDEXED BY idx_search_results_history_message
+              ON a.history_id = ? AND a.message_id = b.message_id
+            WHERE b.history_id = ?
+        """, (history_a, history_b)).fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    return ranked[0], ranked[1], pairs
+
+def get_previous_history_id(history_id):
+    """Return the id of the latest earlier history entry of the same chat, or None."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT prev.id
+        FROM search_history cur
+        JOIN search_history prev
+          ON prev.id < cur.id
+         AND (prev.chat_numeric_id = cur.chat_numeric_id
+              OR (cur.chat_numeric_id IS NULL AND prev.chat_identifier = cur.chat_identifier))
+        WHERE cur.id = ?
+        ORDER BY prev.id DESC
+        LIMIT 1
+    """, (history_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def apply_reaction_updates(updates):
+    """Store live reaction counts in one transaction and return the ids of the history entries that changed.
+
+    Returns None if the transaction failed, so the caller can retry the updates.
+    updates: iterable of (chat_id, message_id, reaction_count, reaction_breakdown).
+    Messages that were never scanned are ignored. Each count is appended to the
+    message's reaction snapshots and copied into the newest history entry of the
+    chat that contains the message, whose revision is then bumped.
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(DATABASE, timeout=30)
+        cursor = conn.cursor()
+        captured_at = int(time.time())
+        reaction_type_cache = {}
+        changed_history_ids = set()
+
+        for chat_id, message_id, reaction_count, breakdown in updates:
+            cursor.execute("SELECT id FROM chat_messages WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+            row = cursor.fetchone()
+            if not row:
+                continue
+            chat_message_id = row[0]
+            _append_reaction_snapshot(cursor, chat_message_id, captured_at, reaction_count)
+            cursor.execute("UPDATE chat_messages SET last_seen = ? WHERE id = ?", (captured_at, chat_message_id))
+
+            cursor.execute('''
+                SELECT id, history_id, reaction_count FROM search_results
+                WHERE chat_message_id = ? ORDER BY history_id DESC LIMIT 1
+            ''', (chat_message_id,))
+            row = cursor.fetchone()
+            if not row:
+                continue
+            result_id, history_id, stored_count = row
+            cursor.execute("UPDATE search_results SET reaction_count = ? WHERE id = ?", (reaction_count, result_id))
+            cursor.execute("DELETE FROM result_reactions WHERE history_id = ? AND message_id = ?", (history_id, message_id))
+            if breakdown:
+                type_ids = _reaction_type_ids(cursor, breakdown, reaction_type_cache)
+                cursor.executemany('''
+                    INSERT INTO result_reactions (history_id, reaction_type_id, message_id, count)
+                    VALUES (?, ?, ?, ?)
+                ''', [(history_id, type_ids[key], message_id, count) for key, count in breakdown.items()])
+            changed_history_ids.add(history_id)
+
+        for history_id in changed_history_ids:
+            _bump_history_revision(cursor, history_id)
+        conn.commit()
+        return changed_history_ids
+    except Exception as e:
+        print(f"Error applying reaction updates: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def add_watched_chat(chat_id, chat_identifier, chat_title=None):
+    """Add a chat to the watch list (or refresh its name)."""
+    conn = sqlite3.connect(DATABASE)
+    try:
+        conn.execute('''
+            INSERT INTO watched_chats (chat_id, chat_identifier, chat_title, added_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                chat_identifier = excluded.chat_identifier,
+                chat_title = excluded.chat_title
+        ''', (chat_id, str(chat_identifier), chat_title, int(time.time())))
+        conn.commit()
+    finally:
+        conn.close()
+
+def remove_watched_chat(chat_id):
+    """Remove a chat from the watch list. Returns False if it was not watched."""
+    conn = sqlite3.connect(DATABASE)
+    try:
+        cursor = conn.execute("DELETE FROM watched_chats WHERE chat_id = ?", (chat_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+def get_watched_chats():
+    """Return the watched chats, oldest first."""
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT chat_id, chat_identifier, chat_title, datetime(added_at, 'unixepoch') AS added_at
+        FROM watched_chats ORDER BY added_at
+    """)
+    chats = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return chats
+
+def get_reaction_series(chat_id, message_id):
+    """Return the reaction history of a message as a list of (captured_at, reaction_count) tuples."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT rs.captured_at, rs.reaction_count
+        FROM reaction_snapshots rs
+        JOIN chat_messages cm ON cm.id = rs.chat_message_id
+        WHERE cm.chat_id = ? AND cm.message_id = ?
+        ORDER BY rs.captured_at
+    """, (chat_id, message_id))
+    series = cursor.fetchall()
+    conn.close()
+    return series
+
+def get_trending_messages(chat_id, since_timestamp, limit=20):
+    """Return the messages of a chat that gained the most reactions since a unix timestamp."""
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT message_id, message_preview, message_link, current_count, previous_count,
+               current_count - previous_count AS gained
+        FROM (
+            SELECT
+                cm.message_id,
+                cm.message_preview,
+                cm.message_link,
+                (SELECT reaction_count FROM reaction_snapshots
+                 WHERE chat_message_id = cm.id ORDER BY captured_at DESC LIMIT 1) AS current_count,
+                COALESCE((SELECT reaction_count FROM reaction_snapshots
+                          WHERE chat_message_id = cm.id AND captured_at <= ?
+                          ORDER BY captured_at DESC LIMIT 1), 0) AS previous_count
+            FROM chat_messages cm
+            WHERE cm.chat_id = ? AND cm.last_seen > ?
+        )
+        ORDER BY gained DESC
+        LIMIT ?
+    """, (since_timestamp, chat_id, since_timestamp, limit))
+    trending = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return trending
+
+def get_reaction_totals(history_id):
+    """Return the total count of every reaction type in a history entry, most used first."""
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT rt.reaction_key AS reaction, SUM(rr.count) AS total, COUNT(*) AS messages
+        FROM result_reactions rr
+        JOIN reaction_types rt ON rt.id = rr.reaction_type_id
+        WHERE rr.history_id = ?
+        GROUP BY rr.reaction_type_id
+        ORDER BY total DESC
+    """, (history_id,))
+    totals = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return totals
+
+def get_top_messages_by_reactions(history_id, weights, limit=20, offset=0):
+    """
+    Rank the results of a history entry by a weighted sum of reaction counts.
+    `weights` maps reaction keys to weights, e.g. {'🔥': 1} or {'👍': 1, '👎': -1}.
+    """
+    if not weights:
+        return []
+
+    weight_values = ','.join('(?, ?)' for _ in weights)
+    params = [value for key, weight in weights.items() for value in (key, float(weight))]
+
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        WITH weights (reaction_key, weight) AS (VALUES {weight_values}),
+        scores AS (
+            SELECT rr.message_id, SUM(rr.count * w.weight) AS score
+            FROM weights w
+            JOIN reaction_types rt ON rt.reaction_key = w.reaction_key
+            JOIN result_reactions rr ON rr.history_id = ? AND rr.reaction_type_id = rt.id
+            GROUP BY rr.message_id
+        )
+        SELECT
+            sr.message_id,
+            sr.reaction_count,
+            s.score,
+            COALESCE(cm.message_preview, sr.message_preview) AS message_preview,
+            COALESCE(cm.message_link, sr.message_link) AS message_link
+        FROM scores s
+        JOIN search_results sr ON sr.history_id = ? AND sr.message_id = s.message_id
+        LEFT JOIN chat_messages cm ON cm.id = sr.chat_message_id
+        ORDER BY s.score DESC, sr.reaction_count DESC
+        LIMIT ? OFFSET ?
+    """, params + [history_id, history_id, limit, offset])
+    ranked = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return ranked
+
+def get_reaction_ratio(history_id, numerator_key, denominator_key):
+    """Return the ratio between the totals of two reaction types in a history entry, or None."""
+    totals = {row['reaction']: row['total'] for row in get_reaction_totals(history_id)}
+    denominator = totals.get(denominator_key, 0)
+    if not denominator:
+        return None
+    return totals.get(numerator_key, 0) / denominator
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def search_messages(text, limit=20, offset=0):
+    """
+    Full-text search over stored message previews (and full texts, when captured).
+    Returns up to `limit` hits ordered by relevance, each with the chat, the latest
+    known reaction count and the most recent history entry containing the message.
+    Snippets mark matches with \x02 and \x03.
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    # Rank and page inside the FTS index first, then look up details for the page only
+    cursor.execute("""
+        SELECT
+            hits.chat_id,
+            hits.message_id,
+            hits.message_link,
+            hits.snippet,
+            (SELECT reaction_count FROM reaction_snapshots
+             WHERE chat_message_id = hits.id ORDER BY captured_at DESC LIMIT 1) AS reaction_count,
+            (SELECT COALESCE(chat_title, chat_identifier) FROM search_history
+             WHERE chat_numeric_id = hits.chat_id ORDER BY id DESC LIMIT 1) AS chat_title,
+            (SELECT history_id FROM search_results
+             WHERE chat_message_id = hits.id ORDER BY history_id DESC LIMIT 1) AS history_id
+        FROM (
+            SELECT
+                cm.id,
+                cm.chat_id,
+                cm.message_id,
+                cm.message_link,
+                snippet(message_search, -1, char(2), char(3), '…', 16) AS snippet,
+                message_search.rank AS rank
+            FROM message_search
+            JOIN chat_messages cm ON cm.id = message_search.rowid
+            WHERE message_search MATCH ?
+            ORDER BY message_search.rank
+            LIMIT ? OFFSET ?
+        ) hits
+        ORDER BY hits.rank
+    """, (query, limit, offset))
+    hits = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return hits
+
+def record_history_view(history_id):
+    """Record that a history entry was viewed (used to pick media for quota eviction).
+
+    Views are collected in memory and written in one transaction at most every
+    VIEW_FLUSH_SECONDS, so serving a page never waits for a database write.
+    """
+    global _view_flush_timer
+    with _pending_views_lock:
+        _pending_views[history_id] = int(time.time())
+        if _view_flush_timer is None:
+            _view_flush_timer = threading.Timer(VIEW_FLUSH_SECONDS, flush_history_views)
+            _view_flush_timer.daemon = True
+            _view_flush_timer.start()
+
+def flush_history_views():
+    """Write the views recorded since the last flush to last_viewed_at."""
+    global _view_flush_timer
+    with _pending_views_lock:
+        views = list(_pending_views.items())
+        _pending_views.clear()
+        _view_flush_timer = None
+    if not views:
+        return
+    try:
+        conn = sqlite3.connect(DATABASE, timeout=30)
+        conn.executemany("UPDATE search_history SET last_viewed_at = MAX(COALESCE(last_viewed_at, 0), ?) WHERE id = ?",
+                         [(viewed_at, history_id) for history_id, viewed_at in views])
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error updating last views of {len(views)} history entries: {e}")
+
+def get_download_folders():
+    """Return the set of download folders referenced by history entries."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute("SELECT download_folder_path FROM search_history WHERE download_folder_path IS NOT NULL")
+    folders = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return folders
+
+def get_media_paths_in_folder(folder_name):
+    """Return the set of media paths stored under a download folder."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    # Range scan on the media_path index: every path that starts with '<folder>/'
+    cursor.execute(
+        "SELECT media_path FROM message_media WHERE media_path >= ? AND media_path < ?",
+        (folder_name + '/', folder_name + '0')  # '0' sorts right after '/'
+    )
+    paths = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return paths
+
+def get_media_folders_by_last_view():
+    """Return (history_id, download_folder_path) pairs, least recently viewed first."""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, download_folder_path
+        FROM search_history
+        WHERE download_folder_path IS NOT NULL
+        ORDER BY COALESCE(last_viewed_at, CAST(strftime('%s', timestamp) AS INTEGER)) ASC
+    """)
+    folders = cursor.fetchall()
+    conn.close()
+    return folders
+
+def clear_history_media(history_id):
+    """Forget the media of a history entry after its files were evicted."""
+    try:
+        conn = sqlite3.connect(DATABASE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM message_media
+            WHERE result_id IN (SELECT id FROM search_results WHERE history_id = ?)
+        """, (history_id,))
+        cursor.execute("UPDATE search_history SET download_folder_path = NULL WHERE id = ?", (history_id,))
+        _bump_history_revision(cursor, history_id)
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error clearing media of history {history_id}: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
@@ -0,0 +1,497 @@
+"""
+Shared job state for scan tasks.
+
+Job status and progress are kept in the SQLite database instead of process
+memory, so when the app runs under several worker processes any of them can
+stream the progress of a scan or serve its results, no matter which worker
+started it.
+
+A running job (and the watcher lease) is owned by one run of one process,
+identified by a random token. The owner refreshes the row's updated_at from a
+heartbeat thread, so rows left behind by a process that died or was restarted
+(possibly under the same PID) are recognized as dead.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from telegramtracker.core import database
+from telegramtracker.core.scan_results import ScannedMessage, ScanResults
+
+# Job statuses
+RUNNING = 'running'
+COMPLETE = 'complete'
+ERROR = 'error'
+INTERRUPTED = 'interrupted'  # The owning process died while the job was running
+
+# Reasons a scan stopped early; it still completes with the results collected so far
+CANCELLED = 'cancelled'
+TIME_BUDGET = 'time_budget'
+MESSAGE_BUDGET = 'message_budget'
+
+# A process refreshes updated_at of its running jobs and watcher lease every HEARTBEAT_SECONDS;
+# rows of other processes not refreshed for OWNER_STALE_SECONDS count as dead
+HEARTBEAT_SECONDS = 15
+OWNER_STALE_SECONDS = 90
+
+_owner = (None, None)  # (pid, token) of this process
+_progress_writer = (None, None)  # (pid, executor) writing progress updates of this process
+_heartbeat_thread = None
+_heartbeat_lock = threading.Lock()
+
+
+def _connect():
+    # Several processes write job progress concurrently; wait for locks instead of failing
+    conn = sqlite3.connect(database.DATABASE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def owner_token():
+    """Token identifying this run of this process; forked workers get their own."""
+    global _owner
+    if _owner[0] != os.getpid():
+        _owner = (os.getpid(), uuid.uuid4().hex)
+    return _owner[1]
+
+
+def _owner_alive(row, now=None):
+    """True if the process that owns a job or watcher lease row is still running."""
+    if row['owner_token'] is not None and row['owner_token'] == owner_token():
+        return True
+    # Same PID with another token is an earlier run of this process, e.g. PID 1 before a restart
+    if row['owner_pid'] == os.getpid() or not _pid_alive(row['owner_pid']):
+        return False
+    # The PID may have been reused by an unrelated process; only a fresh heartbeat proves the owner lives
+    return (now or time.time()) - row['updated_at'] < OWNER_STALE_SECONDS
+
+
+def _beat():
+    """Refresh updated_at of the running jobs and the watcher lease of this process. Returns False if it owns none."""
+    conn = _connect()
+    try:
+        now = int(time.time())
+        owned = conn.execute(
+            "UPDATE jobs SET updated_at = ? WHERE status = ? AND owner_token = ?", (now, RUNNING, owner_token())
+        ).rowcount
+        owned += conn.execute("UPDATE watcher_lease SET updated_at = ? WHERE owner_token = ?", (now, owner_token())).rowcount
+        conn.commit()
+        return owned > 0
+    finally:
+        conn.close()
+
+
+def start_heartbeat():
+    """Start the heartbeat thread of this process unless it is running; it stops once the process owns nothing."""
+    global _heartbeat_thread
+
+    def heartbeat():
+        global _heartbeat_thread
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            # Decide under the lock, so a job started meanwhile never ends up without a heartbeat
+            with _heartbeat_lock:
+                try:
+                    owns_rows = _beat()
+                except sqlite3.Error as e:
+                    print(f"Job heartbeat failed: {e}")
+                    owns_rows = True
+                if not owns_rows:
+                    _heartbeat_thread = None
+                    return
+
+    with _heartbeat_lock:
+        # Threads do not survive a fork, so a worker never sees the master's thread as alive
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(target=heartbeat, name='job-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+
+# Statuses a job can be resumed from, provided it recorded its scan settings
+RESUMABLE = (INTERRUPTED, ERROR)
+
+
+def _claim_slot(conn, now):
+    """Inside a write transaction: return False if a live job is running, else mark dead ones interrupted."""
+    running = conn.execute("SELECT id, owner_pid, owner_token, updated_at FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+    for row in running:
+        if _owner_alive(row, now):
+            return False
+        conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (INTERRUPTED, now, row['id']))
+    return True
+
+
+def create_job(job_id, original_identifier, period_days, scan_params=None):
+    """Create a running job owned by this process. Returns False if another job is already running."""
+    conn = _connect()
+    try:
+        now = int(time.time())
+        conn.execute("BEGIN IMMEDIATE")  # Serialize concurrent starts from different workers
+        if not _claim_slot(conn, now):
+            conn.rollback()
+            return False
+        conn.execute('''
+            INSERT INTO jobs (id, status, owner_pid, owner_token, original_identifier, period_days, scan_params, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (job_id, RUNNING, os.getpid(), owner_token(), str(original_identifier), period_days,
+              json.dumps(scan_params) if scan_params is not None else None, now, now))
+        conn.commit()
+        start_heartbeat()
+        return True
+    finally:
+        conn.close()
+
+
+def resume_job(job_id):
+    """Hand an interrupted or failed job back to this process. Returns False if that is not possible."""
+    conn = _connect()
+    try:
+        now = int(time.time())
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT status, owner_pid, owner_token, updated_at, scan_params FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        resumable = row is not None and row['scan_params'] is not None and (
+            row['status'] in RESUMABLE or (row['status'] == RUNNING and not _owner_alive(row, now))
+        )
+        if not resumable or not _claim_slot(conn, now):
+            conn.rollback()
+            return False
+        conn.execute('''
+            UPDATE jobs SET status = ?, owner_pid = ?, owner_token = ?, error = NULL, stop_reason = NULL, updated_at = ? WHERE id = ?
+        ''', (RUNNING, os.getpid(), owner_token(), now, job_id))
+        conn.commit()
+        start_heartbeat()
+        return True
+    finally:
+        conn.close()
+
+
+def request_stop(job_id, reason):
+    """Ask a running job to stop early; picked up by the worker that runs it. Returns False if it is not running."""
+    conn = _connect()
+    try:
+        cursor = conn.execute(
+            "UPDATE jobs SET stop_reason = ?, updated_at = ? WHERE id = ? AND status = ? AND stop_reason IS NULL",
+            (reason, int(time.time()), job_id, RUNNING)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def get_stop_request(job_id):
+    """Return the stop reason requested for a job, or None."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT stop_reason FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return row['stop_reason'] if row else None
+
+
+def is_resumable(job):
+    """True if a job row can be passed to resume_job."""
+    return job is not None and job['status'] in RESUMABLE and job.get('scan_params') is not None
+
+
+def save_checkpoint(job_id, last_message_id, scanned_count, new_messages, senders=None, scan_mode=None):
+    """
+    Record scan progress: the last scanned message id, the results found since the
+    previous checkpoint, the sender aggregates that changed since then and how
+    messages are read.
+    """
+    conn = _connect()
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO job_checkpoint_messages (job_id, message_id, payload) VALUES (?, ?, ?)",
+            [(job_id, msg.id, json.dumps(msg.as_dict(), ensure_ascii=False, separators=(',', ':'))) for msg in new_messages]
+        )
+        conn.executemany(
+            """INSERT OR REPLACE INTO job_checkpoint_senders
+               (job_id, sender_id, message_count, reaction_total, top_message_id, top_reactions)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [(job_id, sender_id, *stats) for sender_id, stats in (senders or {}).items()]
+        )
+        conn.execute(
+            "UPDATE jobs SET last_message_id = ?, scanned_count = ?, scan_mode = ?, updated_at = ? WHERE id = ?",
+            (last_message_id, scanned_count, scan_mode, int(time.time()), job_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_checkpoint(job_id):
+    """Return the saved scan state of a job: its settings, position and the results collected so far."""
+    job = get_job(job_id)
+    if job is None or job['scan_params'] is None:
+        return None
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT payload FROM job_checkpoint_messages WHERE job_id = ? ORDER BY message_id", (job_id,)
+        ).fetchall()
+        # Checkpoints written before job_checkpoint_senders kept the whole map in jobs.sender_stats;
+        # JSON object keys are strings, sender ids are ints
+        senders = {int(sender_id): stats for sender_id, stats in json.loads(job['sender_stats'] or '{}').items()}
+        for row in conn.execute(
+            """SELECT sender_id, message_count, reaction_total, top_message_id, top_reactions
+               FROM job_checkpoint_senders WHERE job_id = ?""", (job_id,)
+        ):
+            senders[row['sender_id']] = [row['message_count'], row['reaction_total'], row['top_message_id'], row['top_reactions']]
+    finally:
+        conn.close()
+    return {
+        'scan_params': json.loads(job['scan_params']),
+        'since_timestamp': job['scan_since'],
+        'last_message_id': job['last_message_id'],
+        'scanned_count': job['scanned_count'] or 0,
+        'phase': job['phase'],
+        'scan_mode': job['scan_mode'],
+        'messages': ScanResults(ScannedMessage.from_dict(json.loads(row['payload'])) for row in rows),
+        'senders': senders,
+    }
+
+
+def clear_checkpoint(job_id):
+    """Drop the collected results of a job once they were saved to history."""
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM job_checkpoint_messages WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM job_checkpoint_senders WHERE job_id = ?", (job_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def prune_checkpoints(max_age_seconds):
+    """Drop checkpoints of jobs that were not touched for max_age_seconds. Returns the number of jobs pruned."""
+    conn = _connect()
+    try:
+        cutoff = int(time.time()) - max_age_seconds
+        stale = [row['id'] for row in conn.execute(
+            "SELECT id FROM jobs WHERE status != ? AND updated_at < ? AND scan_params IS NOT NULL", (RUNNING, cutoff)
+        ).fetchall()]
+        for job_id in stale:
+            conn.execute("DELETE FROM job_checkpoint_messages WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM job_checkpoint_senders WHERE job_id = ?", (job_id,))
+            conn.execute("UPDATE jobs SET scan_params = NULL WHERE id = ?", (job_id,))
+        conn.commit()
+        return len(stale)
+    finally:
+        conn.close()
+
+
+def update_job(job_id, **fields):
+    """Update columns of a job row."""
+    if not fields:
+        return
+    fields['updated_at'] = int(time.time())
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    conn = _connect()
+    try:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_job(job_id):
+    """Return a job row as a dict, or None. Running jobs whose owner process died are marked interrupted."""
+    if not job_id:
+        return None
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    if job['status'] == RUNNING and not _owner_alive(job):
+        update_job(job_id, status=INTERRUPTED)
+        job['status'] = INTERRUPTED
+    return job
+
+
+def get_running_job():
+    """Return the currently running job (in any worker process), or None."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT 1", (RUNNING,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = get_job(row['id'])
+    return job if job and job['status'] == RUNNING else None
+
+
+def claim_watcher():
+    """Make this process the reaction watcher unless another live process already is. Returns True if it is now."""
+    conn = _connect()
+    try:
+        now = int(time.time())
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT owner_pid, owner_token, updated_at FROM watcher_lease WHERE id = 1").fetchone()
+        if row is not None and _owner_alive(row, now) and row['owner_token'] != owner_token():
+            conn.rollback()
+            return False
+        conn.execute('''
+            INSERT INTO watcher_lease (id, owner_pid, owner_token, updated_at) VALUES (1, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                owner_pid = excluded.owner_pid, owner_token = excluded.owner_token, updated_at = excluded.updated_at
+        ''', (os.getpid(), owner_token(), now))
+        conn.commit()
+        start_heartbeat()
+        return True
+    finally:
+        conn.close()
+
+
+def release_watcher():
+    """Give up the watcher lease if this process holds it."""
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM watcher_lease WHERE id = 1 AND owner_token = ?", (owner_token(),))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class ProgressHub:
+    """
+    In-process fan-out of job updates to asyncio queues, so progress streams
+    served by the ASGI server wait on a queue instead of polling the database.
+    """
+    def __init__(self):
+        self._subscribers = {}  # job_id -> set of (loop, asyncio.Queue)
+        self._lock = threading.Lock()
+
+    def subscribe(self, job_id):
+        """Return an asyncio.Queue (bound to the running loop) that receives the job's updates."""
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    def publish(self, job_id, update):
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, ()))
+        for loop, queue in subscribers:
+            # Updates are published from worker threads as well as from the loop itself
+            loop.call_soon_threadsafe(queue.put_nowait, update)
+
+
+progress_hub = ProgressHub()
+
+
+class ProgressTracker:
+    """Turns successive snapshots of a job row into progress stream events."""
+    def __init__(self):
+        self.last_scanned = None
+        self.last_media_processed = None
+        self.media_phase_sent = False
+        self.finished = False
+
+    def events(self, job):
+        """Return the events (dicts) that describe what changed since the previous snapshot."""
+        if job is None:
+            self.finished = True
+            return [{'type': 'error', 'message': 'No task found.'}]
+
+        events = []
+        if job['scanned_count'] != self.last_scanned:
+            self.last_scanned = job['scanned_count']
+            events.append({'type': 'progress', 'scanned': self.last_scanned})
+        if job['phase'] == 'media':
+            if not self.media_phase_sent:
+                self.media_phase_sent = True
+                events.append({'type': 'media_phase', 'total_media': job['media_total']})
+            if job['media_processed'] != self.last_media_processed:
+                self.last_media_processed = job['media_processed']
+                events.append({'type': 'media_progress', 'processed_count': self.last_media_processed, 'total_media': job['media_total']})
+
+        if job['status'] == COMPLETE:
+            events.append({'type': 'complete', 'scanned': job['scanned_count']})
+            self.finished = True
+        elif job['status'] in (ERROR, INTERRUPTED):
+            events.append({'type': 'error', 'message': job['error'] or 'The task was interrupted.'})
+            self.finished = True
+        return events
+
+
+def _get_progress_writer():
+    """One thread per process writes progress updates, in the order they were put."""
+    global _progress_writer
+    if _progress_writer[0] != os.getpid():
+        _progress_writer = (os.getpid(), concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-progress'))
+    return _progress_writer[1]
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class JobProgress:
+    """
+    Drop-in replacement for the task's progress queue: put() records the update
+    on the job row, where /stream-progress in any worker picks it up.
+    """
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def put(self, update):
+        """Record an update. Called from the event loop, the write is queued instead of waited for."""
+        future = _get_progress_writer().submit(self._record, update)
+        if not _on_event_loop():
+            future.result()
+
+    def _record(self, update):
+        update_type = update.get('type')
+        try:
+            if update_type == 'progress':
+                update_job(self.job_id, scanned_count=update['scanned'])
+            elif update_type == 'media_phase':
+                update_job(self.job_id, phase='media', media_total=update['total_media'], media_processed=0)
+            elif update_type == 'media_progress':
+                update_job(self.job_id, media_processed=update['processed_count'], media_total=update['total_media'])
+            elif update_type == 'error':
+                update_job(self.job_id, status=ERROR, error=update['message'])
+            elif update_type == 'complete':
+                update_job(self.job_id, status=COMPLETE, scanned_count=update['scanned'])
+        except sqlite3.Error as e:
+            print(f"Error recording progress of job {self.job_id}: {e}")
+        progress_hub.publish(self.job_id, update)
@@ -0,0 +1,254 @@
+"""
+Background storage maintenance.
+
+Periodically removes downloaded media that no history entry references any more,
+returns free database pages to the file system in small incremental-vacuum
+slices, and keeps the downloads folder under a configurable quota by evicting
+the media of the least recently viewed history entries first.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+from telegramtracker.core import database
+from telegramtracker.core import job_store
+from telegramtracker.core.result_cache import result_cache
+
+# Maintenance settings - Load from .env file
+DOWNLOAD_DIR = 'downloads'
+INTERVAL_SECONDS = int(os.getenv('MAINTENANCE_INTERVAL_SECONDS', 3600))  # 0 disables the worker
+DOWNLOADS_QUOTA_MB = int(os.getenv('DOWNLOADS_QUOTA_MB', 0))              # 0 means no quota
+VACUUM_PAGES_PER_SLICE = 256
+VACUUM_SLICE_PAUSE_SECONDS = 0.2
+VACUUM_MAX_SLICES = 200
+REQUEST_POLL_SECONDS = 10  # How often the worker checks for runs requested by other processes
+REQUEST_DELAY_SECONDS = 5  # Gives deletions a moment to finish before the disk is scanned
+ORPHAN_GRACE_SECONDS = 3600  # Folders touched more recently may belong to a running scan
+CHECKPOINT_MAX_AGE_SECONDS = 7 * 24 * 3600  # Interrupted scans can be resumed for this long
+
+_wake_event = threading.Event()
+_worker_thread = None
+_vacuum_hint_shown = False
+
+
+def cleanup_orphaned_media(grace_seconds=ORPHAN_GRACE_SECONDS):
+    """Delete files under downloads/ that are not referenced by message_media. Returns bytes freed."""
+    if not os.path.isdir(DOWNLOAD_DIR):
+        return 0
+
+    freed = 0
+    now = time.time()
+    known_folders = database.get_download_folders()
+
+    for folder_name in os.listdir(DOWNLOAD_DIR):
+        folder_path = os.path.join(DOWNLOAD_DIR, folder_name)
+        if not os.path.isdir(folder_path):
+            continue
+        if now - os.path.getmtime(folder_path) < grace_seconds:
+            continue
+
+        referenced = database.get_media_paths_in_folder(folder_name)
+        for root, _, files in os.walk(folder_path):
+            for file_name in files:
+                full_path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(full_path, DOWNLOAD_DIR).replace('\\', '/')
+                if relative_path in referenced:
+                    continue
+                # The large media link list belongs to the folder, not to a single result
+                if file_name == 'large_media_links.txt' and folder_name in known_folders:
+                    continue
+                freed += _remove_file(full_path)
+
+        _remove_empty_dirs(folder_path)
+
+    if freed:
+        print(f"Maintenance: removed {freed} bytes of orphaned media.")
+    return freed
+
+
+def enforce_downloads_quota(quota_bytes):
+    """Evict media of the least recently viewed history entries until downloads/ fits the quota."""
+    if quota_bytes <= 0 or not os.path.isdir(DOWNLOAD_DIR):
+        return 0
+
+    usage = _directory_size(DOWNLOAD_DIR)
+    if usage <= quota_bytes:
+        return 0
+
+    database.flush_history_views()  # Views recorded by this process, so eviction sees them
+
+    print(f"Maintenance: downloads use {usage} bytes, quota is {quota_bytes} bytes. Evicting media...")
+    freed = 0
+    for history_id, folder_name in database.get_media_folders_by_last_view():
+        if usage - freed <= quota_bytes:
+            break
+        folder_path = os.path.join(DOWNLOAD_DIR, folder_name)
+        if os.path.isdir(folder_path):
+            for root, _, files in os.walk(folder_path):
+                for file_name in files:
+                    freed += _remove_file(os.path.join(root, file_name))
+            _remove_empty_dirs(folder_path)
+        database.clear_history_media(history_id)
+        result_cache.discard_history(history_id)
+        print(f"Maintenance: evicted media of history entry {history_id} ({folder_name}).")
+
+    return freed
+
+
+def run_incremental_vacuum(pages_per_slice=VACUUM_PAGES_PER_SLICE, max_slices=VACUUM_MAX_SLICES):
+    """Release free database pages in short slices so other writers are never blocked for long."""
+    global _vacuum_hint_shown
+    # Autocommit, so every slice is its own short write transaction
+    conn = sqlite3.connect(database.DATABASE, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Switching modes needs a full VACUUM, which blocks every writer; leave that to the admin
+            if not _vacuum_hint_shown:
+                print("Maintenance: incremental vacuum is not enabled for this database. "
+                      "Run `python -m telegramtracker.core.maintenance --enable-incremental-vacuum` while the app is stopped.")
+                _vacuum_hint_shown = True
+            return 0
+
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        free_pages = free_before
+        for _ in range(max_slices):
+            if free_pages == 0:
+                break
+            # The pragma frees one page per step; executescript() steps it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({pages_per_slice})")
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            time.sleep(VACUUM_SLICE_PAUSE_SECONDS)
+        released = free_before - free_pages
+        if released:
+            print(f"Maintenance: released {released} database pages ({free_before} -> {free_pages} free).")
+        return released
+    finally:
+        conn.close()
+
+
+def enable_incremental_vacuum():
+    """Convert a database created without incremental vacuum. Runs a full VACUUM, so stop the app first."""
+    conn = sqlite3.connect(database.DATABASE, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print("Incremental vacuum is already enabled.")
+            return
+        print("Enabling incremental vacuum (full VACUUM, this may take a while)...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print("Incremental vacuum enabled.")
+    finally:
+        conn.close()
+
+
+def run_maintenance():
+    """Run one full maintenance pass."""
+    try:
+        cleanup_orphaned_media()
+        if job_store.prune_checkpoints(CHECKPOINT_MAX_AGE_SECONDS):
+            print("Maintenance: removed checkpoints of old interrupted scans.")
+        enforce_downloads_quota(DOWNLOADS_QUOTA_MB * 1024 * 1024)
+        run_incremental_vacuum()
+    except Exception as e:
+        print(f"Error during maintenance: {e}")
+
+
+def request_maintenance():
+    """
+    Ask the maintenance worker for an early run, e.g. after history entries were
+    deleted. The request is stored in the database, since the worker may run in
+    another process (the gunicorn master with preload_app).
+    """
+    try:
+        conn = sqlite3.connect(database.DATABASE)
+        conn.execute("INSERT OR REPLACE INTO maintenance_requests (id, requested_at) VALUES (1, ?)", (int(time.time()),))
+        conn.commit()
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Error requesting maintenance: {e}")
+    _wake_event.set()
+
+
+def _take_request():
+    """Remove a pending maintenance request. Returns its time, or None if there was none."""
+    try:
+        conn = sqlite3.connect(database.DATABASE, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT requested_at FROM maintenance_requests WHERE id = 1").fetchone()
+        if row:
+            conn.execute("DELETE FROM maintenance_requests WHERE id = 1")
+        conn.execute("COMMIT")
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Error reading maintenance requests: {e}")
+        return None
+    return row[0] if row else None
+
+
+def start_maintenance_worker(interval_seconds=INTERVAL_SECONDS):
+    """Start the background maintenance thread (once per process)."""
+    global _worker_thread
+    if interval_seconds <= 0 or (_worker_thread and _worker_thread.is_alive()):
+        return
+
+    def worker():
+        next_run = 0
+        while True:
+            requested_at = _take_request()
+            if requested_at is not None or time.time() >= next_run:
+                if requested_at is not None:
+                    time.sleep(max(0, requested_at + REQUEST_DELAY_SECONDS - time.time()))
+                run_maintenance()
+                next_run = time.time() + interval_seconds
+            _wake_event.wait(min(REQUEST_POLL_SECONDS, interval_seconds))
+            _wake_event.clear()
+
+    _worker_thread = threading.Thread(target=worker, name='maintenance', daemon=True)
+    _worker_thread.start()
+
+
+def _remove_file(path):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError as e:
+        print(f"Maintenance: could not remove {path}: {e}")
+        return 0
+
+
+def _remove_empty_dirs(folder_path):
+    for root, dirs, files in os.walk(folder_path, topdown=False):
+        if not os.listdir(root):
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage maintenance of the history database and downloads folder.")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="convert an existing database to incremental vacuum (full VACUUM; stop the app first)")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+    else:
+        run_maintenance()
+
+
+if __name__ == '__main__':
+    main()
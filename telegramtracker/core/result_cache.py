@@ -0,0 +1,271 @@
+"""
+Result cache for paginated result lists.
+
+Finished result lists are split into pre-sorted pages and kept as compact JSON
+blobs in an in-memory LRU. When the memory budget is exceeded, the least
+recently used result sets are spilled to SQLite and read back page by page.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from telegramtracker.core import database
+
+# Cache settings
+MAX_MEMORY_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+SPILL_MAX_AGE_SECONDS = 7 * 24 * 3600  # Spilled sets older than this are pruned
+INFO_ONLY_BYTES = 256  # Memory charged for a set whose pages are only in SQLite
+
+
+def job_key(job_id):
+    """Cache key for the results of a live job."""
+    return f"job:{job_id}"
+
+
+def history_key(history_id, ranking=None):
+    """Cache key for the results of a saved history entry, in the order of a ranking other than the default."""
+    return f"history:{history_id}:{ranking}" if ranking and ranking != 'reactions' else f"history:{history_id}"
+
+
+def compare_key(history_a, history_b, view):
+    """Cache key for one view of the comparison of two history entries."""
+    return f"compare:{history_a}:{history_b}:{view}"
+
+
+def _is_comparison_of(key, history_id):
+    """True for the compare_key() of any view of a comparison that includes history_id."""
+    return key.startswith('compare:') and str(history_id) in key.split(':')[1:3]
+
+
+class ResultCache:
+    def __init__(self, max_bytes=MAX_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        # key -> {'pages': [bytes] or None if only in SQLite, 'page_count': int, 'total_items': int,
+        #         'per_page': int, 'meta': dict, 'size': int, 'persisted': bool}
+        self._entries = OrderedDict()
+        # Entries evicted from memory whose spill to SQLite has not finished; still readable from here
+        self._spilling = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, results, per_page, max_pages=None, meta=None, persist=False, encode_item=None):
+        """
+        Split already sorted results into pages and cache them under key.
+        With persist=True the pages are also written to SQLite right away, so other
+        worker processes can read them. encode_item, if given, turns each result
+        into a JSON-serializable value; it only runs for results on cached pages.
+        """
+        total_items = len(results)
+        page_count = (total_items + per_page - 1) // per_page
+        if max_pages is not None:
+            page_count = min(page_count, max_pages)
+
+        # Encode each page once; reads only decode the page being viewed
+        pages = []
+        for i in range(page_count):
+            page = results[i * per_page:(i + 1) * per_page]
+            if encode_item is not None:
+                page = [encode_item(item) for item in page]
+            pages.append(json.dumps(page, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        entry = {
+            'pages': pages,
+            'page_count': page_count,
+            'total_items': total_items,
+            'per_page': per_page,
+            'meta': meta or {},
+            'size': sum(len(p) for p in pages),
+            'persisted': persist,
+        }
+        if entry['size'] > self.max_bytes:
+            # Too big for the memory budget on its own: the pages go straight to SQLite
+            # and only the set's info is kept in memory
+            _spill(key, entry)
+            entry = dict(entry, pages=None, size=INFO_ONLY_BYTES, persisted=True)
+            persist = False
+
+        with self._lock:
+            self._discard_memory(key)
+            self._entries[key] = entry
+            self.current_bytes += entry['size']
+            evicted = self._evict_over_budget()
+        # Disk writes happen outside the lock, so reads of other sets never wait on them
+        self._spill_evicted(evicted)
+        if persist:
+            _spill(key, entry)
+        return entry
+
+    def get_info(self, key):
+        """Return {'total_items', 'total_pages', 'per_page', 'meta'} for a cached set, or None."""
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is not None:
+                return {
+                    'total_items': entry['total_items'],
+                    'total_pages': entry['page_count'],
+                    'per_page': entry['per_page'],
+                    'meta': entry['meta'],
+                }
+        return _load_spilled_info(key)
+
+    def get_page(self, key, page):
+        """Return the list of result dicts on a 1-based page, or None if unknown."""
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is not None and entry['pages'] is not None:
+                if 1 <= page <= len(entry['pages']):
+                    return json.loads(entry['pages'][page - 1])
+                return []
+        payload = _load_spilled_page(key, page)
+        return json.loads(payload) if payload is not None else None
+
+    def discard(self, key):
+        """Remove a key from memory and from the spill table."""
+        with self._lock:
+            self._discard_memory(key)
+        _delete_spilled(key)
+
+    def discard_history(self, history_id):
+        """Remove the cached results of a history entry under every ranking, and its comparisons."""
+        key = history_key(history_id)
+        with self._lock:
+            for cached_key in [cached_key for cached_key in list(self._entries) + list(self._spilling)
+                               if cached_key == key or cached_key.startswith(key + ':')
+                               or _is_comparison_of(cached_key, history_id)]:
+                self._discard_memory(cached_key)
+        _delete_spilled(key, prefix=True)
+        _delete_spilled_comparisons(history_id)
+
+    def _get_entry(self, key):
+        # Called with the lock held
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        return self._spilling.get(key)
+
+    def _discard_memory(self, key):
+        self._spilling.pop(key, None)
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry['size']
+
+    def _evict_over_budget(self):
+        """
+        Take least recently used entries out of memory until the budget holds. Called
+        with the lock held; returns the (key, entry) pairs that still have to be spilled.
+        """
+        evicted = []
+        while self.current_bytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self.current_bytes -= entry['size']
+            if not entry['persisted']:
+                self._spilling[key] = entry
+                evicted.append((key, entry))
+        return evicted
+
+    def _spill_evicted(self, evicted):
+        """Write evicted entries to SQLite; called without the lock."""
+        for key, entry in evicted:
+            _spill(key, entry)
+            with self._lock:
+                if self._spilling.get(key) is entry:
+                    del self._spilling[key]
+                    stale = False
+                else:
+                    # Discarded while it was being written (a replacement in memory takes precedence anyway)
+                    stale = key not in self._entries
+            if stale:
+                _delete_spilled(key)
+
+
+def _spill(key, entry):
+    """Write an entry to SQLite so it can still be paged through after leaving memory."""
+    try:
+        conn = sqlite3.connect(database.DATABASE)
+        cursor = conn.cursor()
+        now = int(time.time())
+        cursor.execute("DELETE FROM result_cache_pages WHERE cache_key = ?", (key,))
+        cursor.execute('''
+            INSERT OR REPLACE INTO result_cache_sets (cache_key, total_items, per_page, page_count, meta, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (key, entry['total_items'], entry['per_page'], len(entry['pages']), json.dumps(entry['meta']), now))
+        cursor.executemany('''
+            INSERT INTO result_cache_pages (cache_key, page, payload) VALUES (?, ?, ?)
+        ''', [(key, i + 1, payload) for i, payload in enumerate(entry['pages'])])
+
+        # Prune stale spilled sets while we are here
+        cursor.execute('''
+            DELETE FROM result_cache_pages WHERE cache_key IN
+                (SELECT cache_key FROM result_cache_sets WHERE created_at < ?)
+        ''', (now - SPILL_MAX_AGE_SECONDS,))
+        cursor.execute("DELETE FROM result_cache_sets WHERE created_at < ?", (now - SPILL_MAX_AGE_SECONDS,))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error spilling result cache entry {key}: {e}")
+
+
+def _load_spilled_info(key):
+    try:
+        conn = sqlite3.connect(database.DATABASE)
+        row = conn.execute(
+            "SELECT total_items, per_page, page_count, meta FROM result_cache_sets WHERE cache_key = ?", (key,)
+        ).fetchone()
+        conn.close()
+    except Exception as e:
+        print(f"Error reading result cache entry {key}: {e}")
+        return None
+    if not row:
+        return None
+    return {'total_items': row[0], 'per_page': row[1], 'total_pages': row[2], 'meta': json.loads(row[3] or '{}')}
+
+
+def _load_spilled_page(key, page):
+    try:
+        conn = sqlite3.connect(database.DATABASE)
+        row = conn.execute(
+            "SELECT payload FROM result_cache_pages WHERE cache_key = ? AND page = ?", (key, page)
+        ).fetchone()
+        if row is None:
+            # Distinguish an out-of-range page from an unknown key
+            known = conn.execute("SELECT 1 FROM result_cache_sets WHERE cache_key = ?", (key,)).fetchone()
+            conn.close()
+            return b'[]' if known else None
+        conn.close()
+        return row[0]
+    except Exception as e:
+        print(f"Error reading result cache page {key}/{page}: {e}")
+        return None
+
+
+def _delete_spilled(key, prefix=False):
+    """Delete a spilled set; with prefix=True also the sets whose key continues with ':'."""
+    pattern = key + ':%' if prefix else None
+    try:
+        conn = sqlite3.connect(database.DATABASE)
+        for table in ('result_cache_pages', 'result_cache_sets'):
+            conn.execute(f"DELETE FROM {table} WHERE cache_key = ? OR cache_key LIKE ?", (key, pattern))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error deleting result cache entry {key}: {e}")
+
+
+def _delete_spilled_comparisons(history_id):
+    """Delete the spilled comparison sets that include a history entry, on either side."""
+    try:
+        conn = sqlite3.connect(database.DATABASE)
+        for table in ('result_cache_pages', 'result_cache_sets'):
+            conn.execute(f"DELETE FROM {table} WHERE cache_key LIKE ? OR cache_key LIKE ?",
+                         (f"compare:{history_id}:%", f"compare:%:{history_id}:%"))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error deleting spilled comparisons of history entry {history_id}: {e}")
+
+
+# Global instance shared by the web routes
+result_cache = ResultCache()
@@ -0,0 +1,173 @@
+"""
+Compact in-memory storage of scanned messages.
+
+A scan keeps every matching message until it is saved, so long scans hold
+hundreds of thousands of them. ScanResults stores them column by column: the
+numbers in int arrays, previews in one UTF-8 buffer and reaction breakdowns as
+(key, count) pairs against a single table of reaction keys, which takes about
+a quarter of the memory of one ScannedMessage object per message. Only what
+cannot be derived later is kept: message links are built from the chat when
+results are saved or a page is cached.
+"""
+from array import array
+
+PREVIEW_LENGTH = 100
+EMPTY_PREVIEW = "[Media/Empty]"
+MISSING = -1  # Stands for None in counter columns; Telegram counters are never negative
+
+
+def make_preview(text):
+    """The first PREVIEW_LENGTH characters of a message text, on one line."""
+    return text.replace('\n', ' ')[:PREVIEW_LENGTH] if text else EMPTY_PREVIEW
+
+
+class ScannedMessage:
+    __slots__ = ('id', 'reactions', 'preview', 'reaction_breakdown', 'text', 'media_paths',
+                 'views', 'forwards', 'replies', 'posted_at')
+
+    def __init__(self, id, reactions, preview, reaction_breakdown=None, text=None, media_paths=(),
+                 views=None, forwards=None, replies=None, posted_at=None):
+        self.id = id
+        self.reactions = reactions
+        self.preview = preview
+        self.reaction_breakdown = reaction_breakdown or None  # Messages without reactions share no empty dict
+        self.text = text                                      # Only kept with STORE_MESSAGE_TEXT
+        self.media_paths = media_paths
+        # Engagement counters for scoring (see core/scoring.py); None where Telegram has none
+        self.views = views
+        self.forwards = forwards
+        self.replies = replies
+        self.posted_at = posted_at                            # Unix timestamp
+
+    @classmethod
+    def from_dict(cls, data):
+        """Record from a dict made by as_dict() (checkpoints store them as JSON)."""
+        return cls(data['id'], data['reactions'], data['preview'], data.get('reaction_breakdown'),
+                   data.get('text'), data.get('media_paths') or (), data.get('views'), data.get('forwards'),
+                   data.get('replies'), data.get('posted_at'))
+
+    def as_dict(self, link=None):
+        """The record as a JSON-serializable dict, with the message link if one is given."""
+        data = {
+            'id': self.id,
+            'reactions': self.reactions,
+            'preview': self.preview,
+            'reaction_breakdown': self.reaction_breakdown or {},
+            'text': self.text,
+            'media_paths': list(self.media_paths),
+            'views': self.views,
+            'forwards': self.forwards,
+            'replies': self.replies,
+            'posted_at': self.posted_at,
+        }
+        if link is not None:
+            data['link'] = link
+        return data
+
+
+class ScanResults:
+    """
+    Scanned messages stored in columns.
+
+    Reads like a list of ScannedMessage records: len(), iteration, indexing and
+    slicing build the records on the fly. Records are copies, so media paths are
+    attached with set_media_paths() rather than on a record.
+    """
+
+    def __init__(self, records=()):
+        # Message ids, counters and dates are 32-bit in the Telegram API
+        self._ids = array('i')
+        self._reactions = array('q')
+        self._views = array('i')
+        self._forwards = array('i')
+        self._replies = array('i')
+        self._posted_at = array('i')
+        self._previews = bytearray()
+        self._preview_ends = array('q')
+        self._reaction_keys = []          # Each reaction key once, in order of first use
+        self._reaction_key_index = {}
+        self._breakdown_keys = array('i')  # Positions in _reaction_keys
+        self._breakdown_counts = array('i')
+        self._breakdown_ends = array('q')
+        self._texts = {}                   # Position -> text, only with STORE_MESSAGE_TEXT
+        self._media_paths = {}             # Position -> paths, only for messages with downloads
+        self.extend(records)
+
+    def append(self, record):
+        position = len(self._ids)
+        self._ids.append(record.id)
+        self._reactions.append(record.reactions)
+        for column, value in ((self._views, record.views), (self._forwards, record.forwards),
+                              (self._replies, record.replies), (self._posted_at, record.posted_at)):
+            column.append(MISSING if value is None else value)
+        self._previews += record.preview.encode('utf-8', 'surrogatepass')
+        self._preview_ends.append(len(self._previews))
+        for key, count in (record.reaction_breakdown or {}).items():
+            key_index = self._reaction_key_index.get(key)
+            if key_index is None:
+                key_index = self._reaction_key_index[key] = len(self._reaction_keys)
+                self._reaction_keys.append(key)
+            self._breakdown_keys.append(key_index)
+            self._breakdown_counts.append(count)
+        self._breakdown_ends.append(len(self._breakdown_keys))
+        if record.text is not None:
+            self._texts[position] = record.text
+        if record.media_paths:
+            self._media_paths[position] = record.media_paths
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        for position in range(len(self._ids)):
+            yield self._record(position)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(position) for position in range(*index.indices(len(self._ids)))]
+        if index < 0:
+            index += len(self._ids)
+        if not 0 <= index < len(self._ids):
+            raise IndexError('scan result index out of range')
+        return self._record(index)
+
+    def _record(self, position):
+        preview_start = self._preview_ends[position - 1] if position else 0
+        breakdown_start = self._breakdown_ends[position - 1] if position else 0
+        breakdown_end = self._breakdown_ends[position]
+        breakdown = {
+            self._reaction_keys[key_index]: count
+            for key_index, count in zip(self._breakdown_keys[breakdown_start:breakdown_end],
+                                        self._breakdown_counts[breakdown_start:breakdown_end])
+        }
+        views, forwards, replies, posted_at = (
+            None if value == MISSING else value
+            for value in (self._views[position], self._forwards[position],
+                          self._replies[position], self._posted_at[position])
+        )
+        return ScannedMessage(
+            self._ids[position],
+            self._reactions[position],
+            self._previews[preview_start:self._preview_ends[position]].decode('utf-8', 'surrogatepass'),
+            breakdown,
+            self._texts.get(position),
+            self._media_paths.get(position, ()),
+            views=views, forwards=forwards, replies=replies, posted_at=posted_at
+        )
+
+    def sorted_by_reactions(self):
+        """A copy ordered by reaction count, highest first; ties keep scan order."""
+        order = sorted(range(len(self._ids)), key=self._reactions.__getitem__, reverse=True)
+        return ScanResults(self._record(position) for position in order)
+
+    def set_media_paths(self, paths_by_id):
+        """Attach downloaded media paths by message id; messages missing from paths_by_id get none."""
+        self._media_paths = {
+            position: paths_by_id[message_id]
+            for position, message_id in enumerate(self._ids)
+            if paths_by_id.get(message_id)
+        }
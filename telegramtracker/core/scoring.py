@@ -0,0 +1,89 @@
+"""
+Engagement scoring of scan results.
+
+Results are ranked by their reaction count by default. For the other rankings
+only the numeric columns the ranking needs are read, each as one string that
+SQLite concatenates and NumPy parses, and scored in one pass. The ranking is
+returned as an index permutation, so no per-result dicts are built or reordered:
+
+    weighted   weighted sum of reactions, views, forwards and replies
+    zscore     reactions relative to the posts of the same time bucket, so quiet
+               periods and big-audience moments are compared fairly
+    per_view   reactions per view (channels only; groups have no view counts)
+    per_hour   reactions per hour since the post was published
+"""
+import os
+import time
+
+import numpy as np
+
+from telegramtracker.core import database
+
+RANKINGS = ('reactions', 'weighted', 'zscore', 'per_view', 'per_hour')
+DEFAULT_RANKING = 'reactions'
+COLUMNS = database.SCORE_COLUMNS
+# Columns each ranking reads
+RANKING_COLUMNS = {
+    'reactions': ('reaction_count',),
+    'weighted': ('reaction_count', 'views', 'forwards', 'replies'),
+    'zscore': ('reaction_count', 'posted_at'),
+    'per_view': ('reaction_count', 'views'),
+    'per_hour': ('reaction_count', 'posted_at'),
+}
+
+# Scoring settings - Load from .env file
+SCORE_WEIGHT_REACTIONS = float(os.getenv('SCORE_WEIGHT_REACTIONS', 1))
+SCORE_WEIGHT_VIEWS = float(os.getenv('SCORE_WEIGHT_VIEWS', 0.01))
+SCORE_WEIGHT_FORWARDS = float(os.getenv('SCORE_WEIGHT_FORWARDS', 3))
+SCORE_WEIGHT_REPLIES = float(os.getenv('SCORE_WEIGHT_REPLIES', 2))
+SCORE_BUCKET_HOURS = float(os.getenv('SCORE_BUCKET_HOURS', 24))  # Width of the z-score time buckets
+
+
+def load_columns(history_id, ranking=None):
+    """Return (result ids, numeric columns as float arrays) of a history entry's results, for a ranking or all of them."""
+    names = RANKING_COLUMNS.get(ranking, COLUMNS)
+    loaded = database.get_history_score_columns(history_id, names)
+    if loaded is None:
+        return np.empty(0, dtype=np.int64), {name: np.empty(0) for name in names}
+    first_id, last_id, id_text, texts = loaded
+    ids = np.arange(first_id, last_id + 1) if id_text is None else np.fromstring(id_text, dtype=np.int64, sep=',')
+    return ids, {name: np.fromstring(text, dtype=np.int64, sep=',').astype(np.float64) for name, text in zip(names, texts)}
+
+
+def bucket_zscores(values, buckets):
+    """z-score of every value within its bucket; buckets with no spread score 0."""
+    _, inverse, counts = np.unique(buckets, return_inverse=True, return_counts=True)
+    means = np.bincount(inverse, weights=values) / counts
+    squares = np.bincount(inverse, weights=values * values) / counts
+    stds = np.sqrt(np.maximum(squares - means * means, 0.0))[inverse]
+    return np.divide(values - means[inverse], stds, out=np.zeros_like(values), where=stds > 0)
+
+
+def scores(columns, ranking, now=None):
+    """Score of every result under a ranking; higher is better."""
+    reactions = columns['reaction_count']
+    if ranking == 'weighted':
+        return (SCORE_WEIGHT_REACTIONS * reactions + SCORE_WEIGHT_VIEWS * columns['views']
+                + SCORE_WEIGHT_FORWARDS * columns['forwards'] + SCORE_WEIGHT_REPLIES * columns['replies'])
+    if ranking == 'zscore':
+        # Results without a post date share bucket -1
+        posted_at = columns['posted_at']
+        buckets = np.where(posted_at > 0, posted_at // (SCORE_BUCKET_HOURS * 3600), -1)
+        return bucket_zscores(reactions, buckets)
+    if ranking == 'per_view':
+        views = columns['views']
+        return np.divide(reactions, views, out=np.zeros_like(reactions), where=views > 0)
+    if ranking == 'per_hour':
+        posted_at = columns['posted_at']
+        hours = np.maximum((now or time.time()) - posted_at, 3600.0) / 3600.0  # At least one hour
+        return np.where(posted_at > 0, reactions / hours, 0.0)
+    return reactions
+
+
+def rank_order(columns, ranking, now=None):
+    """
+    Return (order, scores): the indexes of the results sorted by a ranking, best
+    first, and the score of every result. Ties keep their input order.
+    """
+    result_scores = scores(columns, ranking, now)
+    return np.argsort(-result_scores, kind='stable'), result_scores
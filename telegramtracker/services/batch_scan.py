@@ -0,0 +1,194 @@
+"""
+Batch scans of several chats.
+
+The chats of a batch are scanned concurrently on the shared event loop and
+Telegram client, at most BATCH_CONCURRENCY at a time, and their message page
+requests are paced by the client's shared request limiter. Each chat is saved
+as its own history entry; the entries are linked by the batch id (the id of the
+batch's job), from which the cross-chat leaderboard is computed.
+"""
+import asyncio
+import os
+
+from telegramtracker.core import database
+from telegramtracker.core import job_store
+from telegramtracker.services import event_loop
+from telegramtracker.services.telegram_client import (
+    fetch_reaction_stats_async, build_message_link, get_shared_client, request_limiter
+)
+
+# Batch settings - Load from .env file
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_MAX_CHATS = int(os.getenv('BATCH_MAX_CHATS', 100))
+
+
+class ChatScan:
+    """
+    State of one chat in a batch. Provides the parts of the TaskManager
+    interface that fetch_reaction_stats_async uses, and reports its progress to
+    the batch's task as totals over all chats.
+    """
+    checkpoints = False  # Batches are not resumable, so their chats skip checkpoint writes
+
+    def __init__(self, batch, index, identifier):
+        self.batch = batch  # TaskManager running the batch job
+        self.index = index
+        self.identifier = identifier
+        self.job_id = batch.job_id
+        self.progress_queue = self
+        self.results = None
+        self.error = None
+        self.entity = None
+        self.scanned_count = 0
+        self.media_processed = 0
+        self.media_total = 0
+        self.in_media_phase = False
+        self.download_folder_path = None
+        self.stop_reason = None
+        self.scan_mode = None
+        self.sender_stats = None
+        self.history_id = None
+
+    def put(self, update):
+        """Progress updates of this chat, forwarded to the batch job as sums over all chats."""
+        update_type = update.get('type')
+        if update_type == 'progress':
+            self.scanned_count = update['scanned']
+            self.batch.progress_queue.put({'type': 'progress', 'scanned': sum(scan.scanned_count for scan in self.batch.chat_scans)})
+        elif update_type == 'media_phase':
+            # The first chat to reach its media phase moves the batch job to the media phase;
+            # the chats after it only add to the media totals
+            self.media_processed = 0
+            self.media_total = update['total_media']
+            first = not any(scan.in_media_phase for scan in self.batch.chat_scans)
+            self.in_media_phase = True
+            if first:
+                self.batch.progress_queue.put({'type': 'media_phase', 'total_media': sum(scan.media_total for scan in self.batch.chat_scans)})
+            else:
+                self._put_media_progress()
+        elif update_type == 'media_progress':
+            self.media_processed = update['processed_count']
+            self.media_total = update['total_media']
+            self._put_media_progress()
+
+    def _put_media_progress(self):
+        self.batch.progress_queue.put({
+            'type': 'media_progress',
+            'processed_count': sum(scan.media_processed for scan in self.batch.chat_scans),
+            'total_media': sum(scan.media_total for scan in self.batch.chat_scans),
+        })
+
+    def set_task_error(self, error_message):
+        # One failing chat does not fail the batch
+        self.error = error_message
+
+    def request_stop(self, reason):
+        if self.stop_reason is None:
+            self.stop_reason = reason
+
+    async def poll_stop_request(self):
+        # Cancelling the batch stops every chat; budgets apply to each chat on its own
+        if self.stop_reason is None:
+            reason = await self.batch.poll_stop_request()
+            if reason:
+                self.request_stop(reason)
+        return self.stop_reason
+
+    def save(self, batch_id, period_days):
+        """Save the chat's results as a history entry of the batch."""
+        self.history_id = database.save_search_history(
+            self.identifier,
+            self.entity,
+            period_days,
+            len(self.results),
+            self.scanned_count,
+            self.download_folder_path,
+            self.stop_reason,
+            batch_id,
+            scan_mode=self.scan_mode
+        )
+        if self.history_id:
+            database.save_sender_stats(self.history_id, self.sender_stats)
+            database.save_search_results(self.history_id, self.results, lambda msg_id: build_message_link(self.entity, msg_id))
+
+
+async def get_folder_chats(folder_title):
+    """Return identifiers of the chats in a Telegram chat folder, matched by title."""
+    from telethon import functions, utils
+
+    client = await get_shared_client()
+    await request_limiter.wait()
+    result = await client(functions.messages.GetDialogFiltersRequest())
+    for dialog_filter in getattr(result, 'filters', result):
+        title = getattr(dialog_filter, 'title', None)
+        title = getattr(title, 'text', title)  # Newer layers wrap the title in TextWithEntities
+        if not title or title.strip().lower() != folder_title.strip().lower():
+            continue
+        peers = list(dialog_filter.pinned_peers) + list(dialog_filter.include_peers)
+        if not peers:
+            return []
+        # One batched lookup; Telethon groups the peers into a request per peer type
+        await request_limiter.wait()
+        entities = await client.get_entity(peers)
+        # The marked peer id (-100... for channels and supergroups, -... for basic groups) resolves
+        # back to the same chat; the entities are now in the session's cache
+        return [getattr(entity, 'username', None) or utils.get_peer_id(entity) for entity in entities]
+    raise ValueError(f"Chat folder not found: {folder_title}")
+
+
+async def run_batch_task(identifiers, folder, task_manager, period_days=None, reaction_filter=False, download_limit=None, budget=None):
+    """Scan every chat of a batch and save each one as a linked history entry."""
+    loop = asyncio.get_running_loop()
+    try:
+        identifiers = list(identifiers)
+        if folder:
+            try:
+                identifiers += await get_folder_chats(folder)
+            except Exception as e:
+                task_manager.set_task_error(f"Could not read chat folder '{folder}': {e}")
+                return
+        identifiers = list(dict.fromkeys(identifiers))[:BATCH_MAX_CHATS]  # Drop duplicates, keep the order
+        if not identifiers:
+            task_manager.set_task_error("No chats to scan.")
+            return
+
+        task_manager.chat_scans = [ChatScan(task_manager, index, identifier) for index, identifier in enumerate(identifiers)]
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        print(f"Starting batch scan of {len(identifiers)} chats, {BATCH_CONCURRENCY} at a time...")
+
+        async def scan_chat(scan):
+            async with semaphore:
+                if await scan.poll_stop_request() == job_store.CANCELLED:
+                    scan.error = "Cancelled before the scan started."
+                    return
+                await fetch_reaction_stats_async(scan.identifier, scan, period_days, reaction_filter, download_limit, budget=budget)
+                if scan.error is None and scan.results is not None:
+                    # Saving results is blocking database work; keep it off the event loop
+                    await loop.run_in_executor(None, scan.save, task_manager.job_id, period_days)
+
+        await asyncio.gather(*(scan_chat(scan) for scan in task_manager.chat_scans))
+
+        for scan in task_manager.chat_scans:
+            if scan.error:
+                print(f"Batch: {scan.identifier} failed: {scan.error}")
+        if not any(scan.history_id for scan in task_manager.chat_scans):
+            task_manager.set_task_error("; ".join(f"{scan.identifier}: {scan.error}" for scan in task_manager.chat_scans if scan.error)
+                                        or "No chat could be scanned.")
+            return
+
+        await loop.run_in_executor(None, task_manager.finish_batch_task)
+    except Exception as e:
+        error_msg = f"Critical error in batch task execution: {e}"
+        print(error_msg)
+        if not task_manager.error:
+            task_manager.set_task_error(error_msg)
+    finally:
+        task_manager.is_running = False
+        print("Batch task ended.")
+
+
+def run_batch_in_background(identifiers, folder, task_manager, period_days=None, reaction_filter=False, download_limit=None, budget=None):
+    """Schedule a batch scan on the shared event loop and return immediately with its future."""
+    return event_loop.submit(
+        run_batch_task(identifiers, folder, task_manager, period_days, reaction_filter, download_limit, budget)
+    )
@@ -0,0 +1,47 @@
+"""
+Shared asyncio event loop for Telegram work.
+
+All Telethon coroutines (scans, chat list requests) run on one long-lived loop,
+so a single connected client can be reused instead of creating a new loop and
+connection for every request. Under the WSGI server the loop runs in a
+dedicated background thread; under the ASGI server (asgi.py) the server's own
+loop is attached, so Telegram work and HTTP handling share one event loop.
+"""
+import asyncio
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def attach_loop(loop):
+    """Use an already running loop (the ASGI server's) for Telegram work."""
+    global _loop
+    with _loop_lock:
+        _loop = loop
+
+
+def get_attached_loop():
+    """Return the current shared loop without creating one."""
+    return _loop
+
+
+def get_loop():
+    """Return the shared loop, starting a background thread to run it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name='telegram-loop', daemon=True)
+            thread.start()
+        return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop from any thread; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the shared loop and wait for its result (must not be called from the loop itself)."""
+    return submit(coro).result(timeout)
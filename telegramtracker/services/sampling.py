@@ -0,0 +1,195 @@
+"""
+Approximate scans by sampling message ids.
+
+Message ids of channels and supergroups are consecutive, so instead of reading
+every message the sampler splits the chat's id range into equal strata, picks
+one random id in each and fetches the picks 100 at a time with get_messages().
+The sample gives the reaction distribution (percentiles with distribution-free
+confidence bounds) and provisional top messages within seconds. Optionally the
+neighbourhood of the hottest sampled messages is read in full, since popular
+posts tend to cluster around events. Basic groups and private chats take their
+message ids from an account-wide counter, so they are refused.
+"""
+import datetime
+import math
+import os
+import random
+import time
+
+from telegramtracker.services.telegram_client import (
+    get_shared_client, resolve_chat, message_data, get_reaction_breakdown, request_limiter, check_budget,
+    MESSAGES_PER_REQUEST
+)
+
+# Sampling settings - Load from .env file
+SAMPLE_DEFAULT_RATE = float(os.getenv('SAMPLE_DEFAULT_RATE', 0.01))  # Share of the id range to fetch
+SAMPLE_MIN_MESSAGES = 200       # Smaller samples give useless bounds
+SAMPLE_MAX_MESSAGES = int(os.getenv('SAMPLE_MAX_MESSAGES', 20000))
+REFINE_TOP_MESSAGES = 10        # Hottest sampled messages whose neighbourhood is read in full
+REFINE_RADIUS = 25              # Ids on each side of such a message
+PERCENTILES = (0.5, 0.9, 0.99)
+Z_95 = 1.96
+
+
+def stratified_ids(min_id, max_id, sample_size, rng=random):
+    """One random id from each of sample_size equal slices of [min_id, max_id]."""
+    span = max_id - min_id + 1
+    if sample_size >= span:
+        return list(range(min_id, max_id + 1))
+    ids = []
+    for stratum in range(sample_size):
+        start = min_id + stratum * span // sample_size
+        end = min_id + (stratum + 1) * span // sample_size - 1
+        ids.append(rng.randint(start, max(start, end)))
+    return ids
+
+
+def quantile_bounds(sorted_counts, q, z=Z_95):
+    """Estimate of the q-quantile with a ~95% confidence interval from order statistics."""
+    n = len(sorted_counts)
+    spread = z * math.sqrt(n * q * (1 - q))
+    return {
+        'q': q,
+        'estimate': sorted_counts[min(n - 1, int(n * q))],
+        'lower': sorted_counts[max(0, min(n - 1, math.floor(n * q - spread)))],
+        'upper': sorted_counts[min(n - 1, math.ceil(n * q + spread))],
+    }
+
+
+def sample_statistics(counts, sampled_ids, min_id, max_id, rate, z=Z_95):
+    """Summary of a stratified sample: estimated message count, mean and percentiles of reactions."""
+    span = max_id - min_id + 1
+    stats = {
+        'rate': rate,
+        'id_range': [min_id, max_id],
+        'sampled_ids': sampled_ids,
+        'found': len(counts),
+    }
+    if not counts or not sampled_ids:
+        return stats
+
+    # Ids without a message (deleted or service messages) thin out the range
+    hit_rate = len(counts) / sampled_ids
+    hit_margin = z * math.sqrt(hit_rate * (1 - hit_rate) / sampled_ids)
+    stats['estimated_messages'] = round(hit_rate * span)
+    stats['estimated_messages_bounds'] = [round(max(0.0, hit_rate - hit_margin) * span), round(min(1.0, hit_rate + hit_margin) * span)]
+
+    n = len(counts)
+    mean = sum(counts) / n
+    variance = sum((count - mean) ** 2 for count in counts) / (n - 1) if n > 1 else 0.0
+    mean_margin = z * math.sqrt(variance / n)
+    stats['mean_reactions'] = round(mean, 2)
+    stats['mean_bounds'] = [round(max(0.0, mean - mean_margin), 2), round(mean + mean_margin, 2)]
+    stats['with_reactions'] = round(sum(1 for count in counts if count > 0) / n, 4)
+
+    sorted_counts = sorted(counts)
+    stats['percentiles'] = [quantile_bounds(sorted_counts, q, z) for q in PERCENTILES]
+    return stats
+
+
+async def _fetch_ids(client, entity, ids, task_manager, started_at, budget, on_message):
+    """Fetch messages by id in batches; returns the number of ids requested before any stop."""
+    requested = 0
+    for start in range(0, len(ids), MESSAGES_PER_REQUEST):
+        batch = ids[start:start + MESSAGES_PER_REQUEST]
+        await request_limiter.wait()
+        for msg in await client.get_messages(entity, ids=batch):
+            # Missing ids come back as None; service messages carry no reactions
+            if msg is not None and not getattr(msg, 'action', None):
+                on_message(msg)
+        requested += len(batch)
+        task_manager.progress_queue.put({'type': 'progress', 'scanned': task_manager.scanned_count + requested})
+        await task_manager.poll_stop_request()
+        if check_budget(task_manager, task_manager.scanned_count + requested, started_at, budget):
+            break
+    return requested
+
+
+async def sample_reaction_stats_async(chat_identifier, task_manager, period_days=None, sampling=None, budget=None):
+    """
+    Approximate counterpart of fetch_reaction_stats_async. `sampling` may hold 'rate'
+    (share of the id range to fetch) and 'refine'. The summary is left in
+    task_manager.sample_stats; results never include media.
+    """
+    sampling = sampling or {}
+    budget = budget or {}
+    rate = sampling.get('rate') or SAMPLE_DEFAULT_RATE
+    started_at = time.monotonic()
+    task_manager.scanned_count = 0
+
+    try:
+        client = await get_shared_client()
+        if not await client.is_user_authorized():
+            task_manager.set_task_error("User not authorized. Please run a script to login first.")
+            return
+        if not await resolve_chat(client, chat_identifier, task_manager):
+            return
+        entity = task_manager.entity
+        from telethon.tl.types import Channel
+        if not isinstance(entity, Channel):
+            # Basic groups and private chats draw message ids from the whole account, so the id range says nothing
+            task_manager.set_task_error("Quick estimates only work for channels and supergroups. Run a full scan for this chat.")
+            return
+
+        # The id range of the period: newest message, and the first one after the start date
+        await request_limiter.wait()
+        newest = await client.get_messages(entity, limit=1)
+        max_id = newest[0].id if newest else 0
+        min_id = 1
+        if period_days:
+            since_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=period_days)
+            await request_limiter.wait()
+            first = await client.get_messages(entity, limit=1, offset_date=since_date, reverse=True)
+            min_id = first[0].id if first else max_id + 1
+
+        messages = {}
+        counts = []
+
+        def keep(msg):
+            messages[msg.id] = message_data(msg, get_reaction_breakdown(msg))
+
+        def keep_sampled(msg):
+            keep(msg)
+            counts.append(messages[msg.id].reactions)
+
+        span = max_id - min_id + 1
+        sampled_ids = 0
+        if span > 0:
+            sample_size = min(span, SAMPLE_MAX_MESSAGES, max(SAMPLE_MIN_MESSAGES, round(span * rate)))
+            print(f"Sampling {sample_size} of {span} message ids ({min_id}-{max_id})...")
+            ids = stratified_ids(min_id, max_id, sample_size)
+            sampled_ids = await _fetch_ids(client, entity, ids, task_manager, started_at, budget, keep_sampled)
+        task_manager.scanned_count = sampled_ids
+
+        # Statistics only use the uniform sample; the refinement below would bias them upwards
+        stats = sample_statistics(counts, sampled_ids, min_id, max_id, rate)
+
+        if sampling.get('refine') and messages and not task_manager.stop_reason:
+            hottest = sorted(messages.values(), key=lambda item: item.reactions, reverse=True)[:REFINE_TOP_MESSAGES]
+            neighbours = sorted({
+                message_id
+                for item in hottest
+                for message_id in range(max(min_id, item.id - REFINE_RADIUS), min(max_id, item.id + REFINE_RADIUS) + 1)
+                if message_id not in messages
+            })
+            print(f"Refining around {len(hottest)} hot messages: {len(neighbours)} more ids...")
+            refined_before = len(messages)
+            task_manager.scanned_count += await _fetch_ids(client, entity, neighbours, task_manager, started_at, budget, keep)
+            stats['refined'] = len(messages) - refined_before
+
+        print(f"Sampling complete: {stats['found']} messages sampled, {len(messages)} kept in total.")
+        task_manager.progress_queue.put({'type': 'progress', 'scanned': task_manager.scanned_count})
+        # Samples are previews; media is only downloaded by full scans
+        task_manager.progress_queue.put({'type': 'media_phase', 'total_media': 0})
+        task_manager.progress_queue.put({'type': 'media_progress', 'processed_count': 0, 'total_media': 0})
+
+        results = sorted(messages.values(), key=lambda item: item.reactions, reverse=True)
+        task_manager.sample_stats = stats
+        task_manager.scan_mode = 'sample'
+        task_manager.download_folder_path = None
+        task_manager.results = results
+
+    except Exception as e:
+        error_msg = f"Error sampling messages: {e}"
+        print(f"Error: {error_msg}")
+        task_manager.set_task_error(error_msg)
@@ -1,16 +1,48 @@
 import asyncio
 import datetime
+import functools
 import os
 import re
 import time
-from telethon import TelegramClient
-from telethon.tl.types import Message, DocumentAttributeAnimated
+
+from telegramtracker.core import job_store
+from telegramtracker.core.scan_results import ScannedMessage, ScanResults, make_preview
+from telegramtracker.services import event_loop
 
 # Telegram API Settings - Load from .env file
 API_ID = int(os.getenv('API_ID', 0))
 API_HASH = os.getenv('API_HASH', '')
 SESSION_NAME = 'session'
 
+# Scan checkpoints - whichever comes first
+CHECKPOINT_EVERY_MESSAGES = int(os.getenv('CHECKPOINT_EVERY_MESSAGES', 2000))
+CHECKPOINT_INTERVAL_SECONDS = int(os.getenv('CHECKPOINT_INTERVAL_SECONDS', 30))
+
+# Pace of message page requests shared by all scans in this process (0 disables it)
+TELEGRAM_REQUESTS_PER_SECOND = float(os.getenv('TELEGRAM_REQUESTS_PER_SECOND', 10))
+MESSAGES_PER_REQUEST = 100  # Page size of iter_messages
+
+# Scan filters Telegram applies on its side (search filter class names from telethon.tl.types)
+MEDIA_TYPE_FILTERS = {
+    'photo': 'InputMessagesFilterPhotos',
+    'video': 'InputMessagesFilterVideo',
+    'gif': 'InputMessagesFilterGif',
+    'document': 'InputMessagesFilterDocument',
+}
+
+# Senders whose names are looked up (in one batched request) for the sender leaderboard
+SENDER_RESOLVE_LIMIT = 200
+
+# Stops that also skip or abort media downloads; a message budget only limits the scan
+MEDIA_STOP_REASONS = (job_store.CANCELLED, job_store.TIME_BUDGET)
+
+# One connected client per process, used from the shared event loop (see event_loop.py)
+_shared_client = None
+_shared_client_lock = None
+
+# Keep the full message text for full-text search (previews are always kept)
+STORE_MESSAGE_TEXT = os.getenv('STORE_MESSAGE_TEXT', '').lower() in ('1', 'true', 'yes')
+
 # Helper function to sanitize filenames
 def sanitize_filename(name):
     """Sanitizes a string to be safe for use as a filename or directory name."""
@@ -120,68 +152,356 @@ async def count_reactions(msg):
         return 0
     return sum(r.count for r in msg.reactions.results)
 
-async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=None, reaction_filter=False, download_limit=None):
-    """Asynchronous function to fetch reaction statistics and report progress via task_manager."""
+def reaction_key(reaction):
+    """Return a stable string key for a reaction: the emoji itself or 'custom:<document_id>'."""
+    emoticon = getattr(reaction, 'emoticon', None)
+    if emoticon:
+        return emoticon
+    document_id = getattr(reaction, 'document_id', None)
+    if document_id is not None:
+        return f"custom:{document_id}"
+    return type(reaction).__name__
+
+def get_reaction_breakdown(msg):
+    """Return a dict mapping reaction keys to their counts in a message."""
+    return breakdown_from_reactions(msg.reactions)
+
+def breakdown_from_reactions(reactions):
+    """Return a dict mapping reaction keys to their counts in a MessageReactions object."""
+    if not reactions:
+        return {}
+    breakdown = {}
+    for r in reactions.results:
+        key = reaction_key(r.reaction)
+        breakdown[key] = breakdown.get(key, 0) + r.count
+    return breakdown
+
+class RateLimiter:
+    """Spaces out requests made by concurrent scans on the shared client."""
+    def __init__(self, per_second):
+        self.interval = 1 / per_second if per_second > 0 else 0
+        self._next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        # Only used from the shared loop, so claiming the slot needs no lock
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+request_limiter = RateLimiter(TELEGRAM_REQUESTS_PER_SECOND)
+
+async def _save_checkpoint(task_manager, last_message_id, scanned, new_messages, senders=None, changed_senders=()):
+    if not task_manager.checkpoints:
+        return
+    # Only senders seen since the previous checkpoint are written; the rest are already stored
+    changed = {sender_id: list(senders[sender_id]) for sender_id in changed_senders}
+    # SQLite writes are blocking; keep them off the event loop
+    await asyncio.get_running_loop().run_in_executor(
+        None, job_store.save_checkpoint, task_manager.job_id, last_message_id, scanned, new_messages, changed, task_manager.scan_mode
+    )
+
+def count_sender(senders, msg, reactions):
+    """
+    Add a scanned message to its sender's aggregates: [messages, reactions, top message id,
+    top reactions]. Returns the sender id, or None for messages without a sender.
+    """
+    sender_id = getattr(msg, 'sender_id', None)
+    if sender_id is None:
+        return None
+    stats = senders.get(sender_id)
+    if stats is None:
+        senders[sender_id] = [1, reactions, msg.id, reactions]
+        return sender_id
+    stats[0] += 1
+    stats[1] += reactions
+    if reactions > stats[3]:
+        stats[2] = msg.id
+        stats[3] = reactions
+    return sender_id
+
+async def sender_leaderboard(client, senders):
+    """
+    Sender aggregates as dicts, most reactions first. Only the names of the top
+    SENDER_RESOLVE_LIMIT senders are looked up, with one request for users and one
+    for channels. Senders missing from the session's entity cache are asked for in
+    one more request of each kind, without an access hash; Telegram answers those
+    for peers the account has seen, the others keep no name.
+    """
+    from telethon import utils
+    from telethon.tl import functions, types
+
+    ranked = sorted(senders.items(), key=lambda item: item[1][1], reverse=True)
+    users, channels = [], []
+    unknown_users, unknown_channels = [], []
+    for sender_id, _ in ranked[:SENDER_RESOLVE_LIMIT]:
+        try:
+            # Cache only: client.get_input_entity would make one request per missing sender
+            peer = client.session.get_input_entity(sender_id)
+        except ValueError:
+            peer_id, peer_type = utils.resolve_id(sender_id)
+            if peer_type is types.PeerUser:
+                unknown_users.append(types.InputUser(peer_id, access_hash=0))
+            elif peer_type is types.PeerChannel:
+                unknown_channels.append(types.InputChannel(peer_id, access_hash=0))
+            continue
+        if isinstance(peer, (types.InputPeerUser, types.InputPeerSelf)):
+            users.append(utils.get_input_user(peer))
+        elif isinstance(peer, types.InputPeerChannel):
+            channels.append(utils.get_input_channel(peer))
+    # Unknown senders get requests of their own, so a rejected one costs no cached names
+    requests = []
+    for batch in (users, unknown_users):
+        if batch:
+            requests.append(functions.users.GetUsersRequest(batch))
+    for batch in (channels, unknown_channels):
+        if batch:
+            requests.append(functions.channels.GetChannelsRequest(batch))
+    names = {}
+    for request in requests:
+        try:
+            await request_limiter.wait()
+            result = await client(request)
+        except Exception as e:
+            print(f"Warning: Could not look up sender names: {e}")
+            continue
+        for entity in getattr(result, 'chats', result):
+            if isinstance(entity, types.UserEmpty):
+                continue
+            names[utils.get_peer_id(entity)] = (utils.get_display_name(entity) or None, getattr(entity, 'username', None))
+    return [
+        {
+            'sender_id': sender_id,
+            'name': names.get(sender_id, (None, None))[0],
+            'username': names.get(sender_id, (None, None))[1],
+            'message_count': message_count,
+            'reaction_total': reaction_total,
+            'top_message_id': top_message_id,
+            'top_reactions': top_reactions,
+        }
+        for sender_id, (message_count, reaction_total, top_message_id, top_reactions) in ranked
+    ]
+
+def check_budget(task_manager, scanned, started_at, budget):
+    """Request a stop once the scan's message or wall-clock budget is used up; returns the stop reason."""
+    if budget.get('max_messages') and scanned >= budget['max_messages']:
+        task_manager.request_stop(job_store.MESSAGE_BUDGET)
+    if budget.get('max_seconds') and time.monotonic() - started_at >= budget['max_seconds']:
+        task_manager.request_stop(job_store.TIME_BUDGET)
+    return task_manager.stop_reason
+
+def _filter_date(day, end_of_day=False):
+    """UTC datetime for a 'YYYY-MM-DD' filter date (the end of that day for upper bounds)."""
+    start = datetime.datetime.combine(datetime.date.fromisoformat(day), datetime.time(), datetime.timezone.utc)
+    return start + datetime.timedelta(days=1, microseconds=-1) if end_of_day else start
+
+def server_side_filters(filters):
+    """Keyword arguments for iter_messages that make Telegram return only matching messages."""
+    options = {}
+    if filters.get('media_type') in MEDIA_TYPE_FILTERS:
+        from telethon.tl import types
+        options['filter'] = getattr(types, MEDIA_TYPE_FILTERS[filters['media_type']])
+    if filters.get('sender'):
+        options['from_user'] = filters['sender']
+    return options
+
+async def start_takeout(client):
+    """
+    Open a takeout session for a bulk export and return the client wrapped in it, or None
+    if Telegram refuses (the user may have to confirm the export in another app and wait
+    first) or another takeout of this session is still open.
+    """
+    from telethon import errors
+    try:
+        await request_limiter.wait()
+        return await client.takeout(finalize=True, chats=True, megagroups=True, channels=True).__aenter__()
+    except errors.TakeoutInitDelayError as e:
+        print(f"Takeout refused: Telegram asks to wait {e.seconds} seconds. Falling back to the regular client.")
+    except Exception as e:
+        print(f"Takeout unavailable: {e}. Falling back to the regular client.")
+    return None
+
+async def finish_takeout(takeout, success):
+    """Close a takeout session; `success` tells Telegram whether the export completed."""
+    try:
+        takeout.success = success
+        await takeout.__aexit__(None, None, None)
+    except Exception as e:
+        print(f"Warning: Could not finish the takeout session: {e}")
+
+def _download_outcome(task):
+    """Result of a finished download task, or the exception (cancelled downloads count as failed)."""
+    if task.cancelled():
+        return RuntimeError("Download cancelled")
+    return task.exception() or task.result()
+
+async def resolve_chat(client, chat_identifier, task_manager):
+    """Look up the chat and store it as task_manager.entity; reports the error and returns False if that fails."""
+    print(f"Getting chat info: {chat_identifier}")
+    try:
+        await request_limiter.wait()
+        task_manager.entity = await client.get_entity(chat_identifier)
+        print(f"Chat found: {getattr(task_manager.entity, 'title', chat_identifier)}")
+        return True
+    except ValueError as e:
+        error_msg = f"Chat not found: {chat_identifier}. Please check username or ID. Error: {e}"
+    except Exception as e:
+        error_msg = f"Unexpected error getting chat: {e}"
+    task_manager.set_task_error(error_msg)
+    print(error_msg)
+    return False
+
+def message_data(msg, reaction_breakdown):
+    """The result record kept for a scanned message."""
+    replies = getattr(msg, 'replies', None)
+    date = getattr(msg, 'date', None)
+    return ScannedMessage(
+        msg.id,
+        sum(reaction_breakdown.values()),
+        make_preview(msg.message or msg.text),
+        reaction_breakdown,
+        msg.message if STORE_MESSAGE_TEXT else None,
+        views=getattr(msg, 'views', None),
+        forwards=getattr(msg, 'forwards', None),
+        replies=replies.replies if replies else None,
+        posted_at=int(date.timestamp()) if date else None
+    )
+
+async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=None, reaction_filter=False, download_limit=None, checkpoint=None, budget=None, filters=None, bulk_export=False):
+    """
+    Asynchronous function to fetch reaction statistics and report progress via task_manager.
+    Pass the state returned by job_store.load_checkpoint() as `checkpoint` to continue an
+    interrupted scan after its last scanned message instead of starting over.
+    `budget` may limit the scan with 'max_seconds' and 'max_messages'. When a budget runs
+    out or the job is cancelled, the scan stops and completes with the results so far.
+    `filters` may hold 'media_type', 'sender', 'date_from', 'date_to' (YYYY-MM-DD) and
+    'min_reactions'. Media type and sender are applied by Telegram, and the date range
+    bounds the requested message range; only the reaction minimum is checked here.
+    With `bulk_export`, messages are read through a takeout session, which Telegram
+    rate-limits far more generously; task_manager.scan_mode records whether one was used.
+    """
     client = None
-    messages = []
+    takeout = None
+    budget = budget or {}
+    filters = filters or {}
+    min_reactions = filters.get('min_reactions') or 0
+    started_at = time.monotonic()
+    messages = ScanResults()
+    senders = {}  # Sender id -> aggregates, see count_sender()
+    changed_senders = set()  # Senders whose aggregates changed since the last checkpoint
     scanned = 0
+    last_message_id = None
+    if checkpoint:
+        messages = checkpoint['messages']
+        senders = checkpoint['senders']
+        scanned = checkpoint['scanned_count']
+        last_message_id = checkpoint['last_message_id']
+        print(f"Resuming scan after message {last_message_id} with {len(messages)} results collected so far.")
 
     try:
-        client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
-        print("Connecting to Telegram...")
-        await client.connect()
+        client = await get_shared_client()
 
         if not await client.is_user_authorized():
             task_manager.set_task_error("User not authorized. Please run a script to login first.")
             print(task_manager.error)
             return
 
-        print(f"Getting chat info: {chat_identifier}")
-        try:
-            task_manager.entity = await client.get_entity(chat_identifier)
-            print(f"Chat found: {getattr(task_manager.entity, 'title', chat_identifier)}")
-        except ValueError as e:
-            error_msg = f"Chat not found: {chat_identifier}. Please check username or ID. Error: {e}"
-            task_manager.set_task_error(error_msg)
-            print(error_msg)
-            return
-        except Exception as e:
-            error_msg = f"Unexpected error getting chat: {e}"
-            task_manager.set_task_error(error_msg)
-            print(error_msg)
+        if not await resolve_chat(client, chat_identifier, task_manager):
             return
 
-        if period_days:
+        if checkpoint:
+            # Keep the time window of the original run
+            since_date = datetime.datetime.fromtimestamp(checkpoint['since_timestamp'], datetime.timezone.utc) if checkpoint['since_timestamp'] else None
+        elif filters.get('date_from'):
+            # An explicit date range replaces the period
+            since_date = _filter_date(filters['date_from'])
+            print(f"Getting messages since: {since_date}")
+        elif period_days:
             since_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=period_days)
             print(f"Getting messages since: {since_date}")
         else:
             since_date = None
             print("Getting all messages.")
+        until_date = _filter_date(filters['date_to'], end_of_day=True) if filters.get('date_to') else None
+        search_options = server_side_filters(filters)
+        if search_options:
+            print(f"Scan filters: {', '.join(f'{key}={value}' for key, value in filters.items() if value)}")
+        if not checkpoint:
+            # SQLite writes are blocking; keep them off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                job_store.update_job, task_manager.job_id, scan_since=int(since_date.timestamp()) if since_date else None
+            ))
+
+        # A checkpoint taken in the media phase already holds the complete scan
+        if checkpoint and checkpoint['phase'] == 'media':
+            print("Scan was already complete; continuing with media processing.")
+            task_manager.scan_mode = checkpoint['scan_mode']
+        else:
+            new_messages = []  # Results found since the last checkpoint
+            scanned_at_checkpoint = scanned
+            checkpoint_time = time.monotonic()
+
+            if bulk_export:
+                takeout = await start_takeout(client)
+            task_manager.scan_mode = 'takeout' if takeout else 'regular'
+            print(f"Reading messages through the {task_manager.scan_mode} client.")
+
+            async for msg in (takeout or client).iter_messages(task_manager.entity, offset_date=since_date, reverse=True,
+                                                               min_id=last_message_id or 0, **search_options):
+                if until_date and msg.date > until_date:
+                    # Messages arrive oldest first, so nothing after this one is in range
+                    break
+                scanned += 1
+                if scanned % MESSAGES_PER_REQUEST == 0 and not takeout:
+                    # iter_messages fetches one page per request; pacing the pages paces the requests.
+                    # Takeout requests have their own, much higher limits.
+                    await request_limiter.wait()
+                last_message_id = msg.id
+                reaction_breakdown = get_reaction_breakdown(msg)
+                reactions = sum(reaction_breakdown.values())
+                sender_id = count_sender(senders, msg, reactions)
+                if sender_id is not None:
+                    changed_senders.add(sender_id)
+
+                # With the reaction filter on, messages without reactions are skipped
+                if reactions >= min_reactions and (reactions > 0 or not reaction_filter):
+                    msg_data = message_data(msg, reaction_breakdown)
+                    messages.append(msg_data)
+                    new_messages.append(msg_data)
+
+                if scanned % 50 == 0:
+                    task_manager.progress_queue.put({'type': 'progress', 'scanned': scanned})
+                    # Picks up cancel requests made through any worker process
+                    await task_manager.poll_stop_request()
+                    await asyncio.sleep(0.1)
+
+                if check_budget(task_manager, scanned, started_at, budget):
+                    print(f"Stopping scan early ({task_manager.stop_reason}) after {scanned} messages.")
+                    break
 
-        async for msg in client.iter_messages(task_manager.entity, offset_date=since_date, reverse=True):
-            scanned += 1
-            reactions = await count_reactions(msg)
-
-            if reaction_filter and reactions == 0:
-                continue
-
-            if reactions > 0 or not reaction_filter:
-                preview = (msg.message or msg.text or "[Media/Empty]")
-                messages.append({
-                    'id': msg.id,
-                    'reactions': reactions,
-                    'preview': preview.replace('\n', ' ')[:100],
-                    'link': build_message_link(task_manager.entity, msg.id)
-                })
+                if (scanned - scanned_at_checkpoint >= CHECKPOINT_EVERY_MESSAGES
+                        or time.monotonic() - checkpoint_time >= CHECKPOINT_INTERVAL_SECONDS):
+                    await _save_checkpoint(task_manager, last_message_id, scanned, new_messages, senders, changed_senders)
+                    new_messages = []
+                    changed_senders = set()
+                    scanned_at_checkpoint = scanned
+                    checkpoint_time = time.monotonic()
 
-            if scanned % 50 == 0:
-                task_manager.progress_queue.put({'type': 'progress', 'scanned': scanned})
-                await asyncio.sleep(0.1)
+            await _save_checkpoint(task_manager, last_message_id, scanned, new_messages, senders, changed_senders)
+            if takeout:
+                # Media is downloaded through the regular client
+                await finish_takeout(takeout, success=True)
+                takeout = None
 
         print(f"Scan complete. Total scanned: {scanned}, Found matching criteria: {len(messages)}")
         task_manager.progress_queue.put({'type': 'progress', 'scanned': scanned})
+        task_manager.sender_stats = await sender_leaderboard(client, senders)
 
-        sorted_messages = sorted(messages, key=lambda x: x['reactions'], reverse=True)
+        sorted_messages = messages.sorted_by_reactions()
+        messages = None  # Only the sorted copy is kept
 
         final_message_ids_to_process = set()
         if download_limit is not None:
@@ -194,8 +514,10 @@ async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=
                 if selected_entries_count >= download_limit:
                     print(f"Download limit of {download_limit} reached.")
                     break
+                if task_manager.stop_reason in MEDIA_STOP_REASONS:
+                    break
 
-                message_id = msg_data['id']
+                message_id = msg_data.id
                 if message_id in processed_message_ids:
                     continue
 
@@ -236,7 +558,7 @@ async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=
 
             print(f"Final list of message IDs to process for media: {len(final_message_ids_to_process)}")
         else:
-            final_message_ids_to_process = {msg['id'] for msg in sorted_messages}
+            final_message_ids_to_process = {msg.id for msg in sorted_messages}
             print(f"No download limit applied. Processing all {len(final_message_ids_to_process)} messages for media.")
 
         # --- Media Processing Section ---
@@ -244,8 +566,8 @@ async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=
         media_paths_map = {}
         folder_name = None
 
-        # Media download only happens if reaction_filter is TRUE
-        if reaction_filter and final_message_ids_to_process:
+        # Media download only happens if reaction_filter is TRUE, and not after a cancel or timeout
+        if reaction_filter and final_message_ids_to_process and task_manager.stop_reason not in MEDIA_STOP_REASONS:
             # --- Start Media Download and Link Logging ---
             download_dir = "downloads"
             timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d_%H%M%S")
@@ -366,7 +688,19 @@ async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=
 
             if download_tasks:
                 print(f"Starting concurrent download of {len(download_tasks)} media items...")
-                results = await asyncio.gather(*[task for task, _, _ in download_tasks], return_exceptions=True)
+                tasks = [task for task, _, _ in download_tasks]
+                pending = set(tasks)
+                while pending:
+                    _, pending = await asyncio.wait(pending, timeout=1)
+                    if pending:
+                        await task_manager.poll_stop_request()
+                        if check_budget(task_manager, scanned, started_at, budget) in MEDIA_STOP_REASONS:
+                            print(f"Stopping early ({task_manager.stop_reason}): cancelling {len(pending)} downloads.")
+                            for task in pending:
+                                task.cancel()
+                            await asyncio.wait(pending)
+                            break
+                results = [_download_outcome(task) for task in tasks]
 
                 successful_downloads = 0; failed_downloads = 0
                 temp_group_paths = {}
@@ -404,9 +738,7 @@ async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=
                 task_manager.progress_queue.put({'type': 'media_phase', 'total_media': total_media_items})
                 task_manager.progress_queue.put({'type': 'media_progress', 'processed_count': 0, 'total_media': 0})
 
-            for msg_data in sorted_messages:
-                message_id = msg_data['id']
-                msg_data['media_paths'] = media_paths_map.get(message_id, [])
+            sorted_messages.set_media_paths(media_paths_map)
 
             if large_media_links:
                 links_file_path = os.path.join(folder_path, "large_media_links.txt")
@@ -422,16 +754,13 @@ async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=
             print("Reaction filter is off or no messages selected for media processing. Skipping media download.")
             task_manager.progress_queue.put({'type': 'media_phase', 'total_media': 0})
             task_manager.progress_queue.put({'type': 'media_progress', 'processed_count': 0, 'total_media': 0})
-            for msg_data in sorted_messages:
-                msg_data['media_paths'] = []
             task_manager.download_folder_path = None # Ensure path is None if no downloads
 
 
-        task_manager.progress_queue.put({'type': 'complete', 'scanned': scanned})
-
         task_manager.results = sorted_messages
         task_manager.scanned_count = scanned
         # download_folder_path is already set above
+        # The 'complete' update is sent by task_manager.finish_task() once the results are saved
         print(f"Results prepared: {len(sorted_messages)} messages. Download path: {task_manager.download_folder_path}")
 
 
@@ -440,9 +769,9 @@ async def fetch_reaction_stats_async(chat_identifier, task_manager, period_days=
         print(f"Error: {error_msg}")
         task_manager.set_task_error(error_msg)
     finally:
-        if client and client.is_connected():
-            print("Disconnecting client...")
-            await client.disconnect()
+        if takeout:
+            await finish_takeout(takeout, success=False)
+        # The shared client stays connected for the next request
         print("Async fetch task completed processing.")
 
 def build_message_link(chat, msg_id):
@@ -462,57 +791,78 @@ def build_message_link(chat, msg_id):
 
     return f"https://t.me/c/{cid}/{msg_id}"
 
-def run_fetch_in_background(chat_identifier, task_manager, period_days=None, reaction_filter=False, download_limit=None):
-    """Run async fetch function in background, using the TaskManager instance."""
+async def run_fetch_task(chat_identifier, task_manager, period_days=None, reaction_filter=False, download_limit=None, checkpoint=None, budget=None, filters=None, sampling=None, bulk_export=False):
+    """Run the fetch (or, with `sampling`, an approximate scan) on the shared loop and hand the results to the TaskManager instance."""
     print("Starting background task...")
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        loop.run_until_complete(
-            fetch_reaction_stats_async(chat_identifier, task_manager, period_days, reaction_filter, download_limit)
-        )
-        loop.close()
+        if sampling:
+            # Imported here because the sampler builds on this module
+            from telegramtracker.services.sampling import sample_reaction_stats_async
+            await sample_reaction_stats_async(chat_identifier, task_manager, period_days, sampling, budget)
+        else:
+            await fetch_reaction_stats_async(chat_identifier, task_manager, period_days, reaction_filter, download_limit, checkpoint, budget, filters, bulk_export)
 
         if task_manager.error:
             print(f"Background task completed with error: {task_manager.error}")
+        elif task_manager.results is not None:
+            print(f"Background task finished processing. Results count: {len(task_manager.results)}")
+            # Saving results is blocking database work; keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, task_manager.finish_task)
         else:
-            print(f"Background task finished processing. Results count: {len(task_manager.results if task_manager.results else [])}")
+            # The async function should always produce results or an error
+            task_manager.set_task_error("Task ended without producing results.")
 
     except Exception as e:
-        error_msg = f"Critical error in background thread execution: {e}"
+        error_msg = f"Critical error in background task execution: {e}"
         print(error_msg)
         if not task_manager.error:
             task_manager.set_task_error(error_msg)
     finally:
         task_manager.is_running = False
-        # Check if the queue is empty and no error occurred, but no 'complete' message was sent
-        # This might indicate an unexpected exit in the async function
-        queue_empty = task_manager.progress_queue.empty()
-        last_item_type = None
-        if not queue_empty:
-             # This is tricky without consuming the item. A simple check might be enough.
-             # For robustness, the async function should guarantee a final message.
-             pass 
-
-        if not task_manager.error and queue_empty: # Simplified check: if no error and queue empty, assume completion or issue
-             # If the async function guarantees putting 'complete' or 'error', this check might not be needed.
-             # However, as a safeguard:
-             print("Background task wrapper: No error and queue empty, ensuring 'complete' or 'error' was sent.")
-             # We cannot reliably know the final state here without more complex queue inspection.
-             # Relying on the async function's final queue message is preferred.
-             pass
-
         print("Background task wrapper function ended.")
 
+def run_fetch_in_background(chat_identifier, task_manager, period_days=None, reaction_filter=False, download_limit=None, checkpoint=None, budget=None, filters=None, sampling=None, bulk_export=False):
+    """Schedule the fetch on the shared event loop and return immediately with its future."""
+    return event_loop.submit(
+        run_fetch_task(chat_identifier, task_manager, period_days, reaction_filter, download_limit, checkpoint, budget, filters, sampling, bulk_export)
+    )
+
+def _load_session():
+    """
+    This process's own copy of the session created by create_session.py. The file
+    is only read here; each process keeps its session state (entity cache, update
+    state) in memory and opens its own MTProto session on the shared login, so
+    worker processes never write to one session file at the same time.
+    """
+    from telethon.sessions import SQLiteSession, StringSession
+    if not os.path.exists(f"{SESSION_NAME}.session"):
+        return StringSession()  # Not logged in; callers report that
+    stored = SQLiteSession(SESSION_NAME)
+    try:
+        return StringSession(StringSession.save(stored))
+    finally:
+        stored.close()
+
+async def get_shared_client():
+    """Return the process-wide Telegram client, connecting it on first use."""
+    global _shared_client, _shared_client_lock
+    if _shared_client_lock is None:
+        _shared_client_lock = asyncio.Lock()
+    async with _shared_client_lock:
+        if _shared_client is None:
+            # Telethon and its generated TL schema are slow to import; only load them when needed
+            from telethon import TelegramClient
+            _shared_client = TelegramClient(_load_session(), API_ID, API_HASH)
+        if not _shared_client.is_connected():
+            print("Connecting to Telegram...")
+            await _shared_client.connect()
+    return _shared_client
+
 async def get_user_chats_async():
     """Asynchronous function to fetch all user chats (groups, channels, private chats)."""
-    client = None
     chats_list = []
     try:
-        client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
-        print("Connecting to Telegram for chat list...")
-        await client.connect()
+        client = await get_shared_client()
 
         if not await client.is_user_authorized():
             print("User not authorized. Please run a script to login first.")
@@ -533,8 +883,4 @@ async def get_user_chats_async():
         print(f"Found {len(chats_list)} chats.")
     except Exception as e:
         print(f"Error fetching user chats: {e}")
-    finally:
-        if client and client.is_connected():
-            print("Disconnecting client after chat list fetch...")
-            await client.disconnect()
     return chats_list
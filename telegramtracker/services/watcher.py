@@ -0,0 +1,163 @@
+"""
+Live reaction tracking.
+
+Instead of rescanning a chat to refresh its reaction counts, the shared
+Telegram client listens for reaction updates and message edits in the watched
+chats. Incoming counts are collected in memory and written to SQLite in one
+transaction every WATCH_FLUSH_SECONDS, so a burst of reactions on a popular
+post costs a single write. Telegram sends the current totals of a message, so
+only the newest count per message is kept between flushes.
+
+Only one process runs the watcher at a time (see job_store.claim_watcher);
+the others check periodically and take over if that process exits. It can
+also run without the web app:
+    python -m telegramtracker.services.watcher
+"""
+import asyncio
+import os
+import threading
+
+from telegramtracker.core import database
+from telegramtracker.core import job_store
+from telegramtracker.services import event_loop
+from telegramtracker.services.telegram_client import get_shared_client, breakdown_from_reactions
+
+# Watcher settings - Load from .env file
+WATCH_FLUSH_SECONDS = float(os.getenv('WATCH_FLUSH_SECONDS', 5))
+
+
+async def _in_executor(func, *args):
+    # SQLite calls are blocking; keep them off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+class ReactionWatcher:
+    def __init__(self):
+        self.chat_ids = set()   # Bare chat ids, as stored in search_history.chat_numeric_id
+        self.pending = {}       # (chat_id, message_id) -> (reaction_count, reaction_breakdown)
+        self.is_owner = False
+        self._client = None
+        self._handlers = []
+        self._future = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Run the watcher on the shared event loop unless it is already running in this process."""
+        with self._start_lock:
+            if self._future is None or self._future.done():
+                self._future = event_loop.submit(self.run())
+            return self._future
+
+    def is_running(self):
+        return self._future is not None and not self._future.done()
+
+    async def run(self):
+        """Listen and flush until no chat is watched any more."""
+        try:
+            while True:
+                self.chat_ids = {chat['chat_id'] for chat in await _in_executor(database.get_watched_chats)}
+                if not self.chat_ids:
+                    break
+                if not self.is_owner and await _in_executor(job_store.claim_watcher):
+                    self.is_owner = True
+                    await self._listen()
+                await self.flush()
+                await asyncio.sleep(WATCH_FLUSH_SECONDS)
+        except Exception as e:
+            print(f"Watcher stopped with an error: {e}")
+        finally:
+            self._stop_listening()
+            await self.flush()
+            if self.is_owner:
+                self.is_owner = False
+                await _in_executor(job_store.release_watcher)
+        print("Watcher stopped.")
+
+    async def _listen(self):
+        from telethon import events, types
+
+        client = await get_shared_client()
+        if not await client.is_user_authorized():
+            raise RuntimeError("User not authorized. Please run a script to login first.")
+
+        self._handlers = [
+            (self._on_reactions, events.Raw(types.UpdateMessageReactions)),
+            (self._on_edit, events.MessageEdited()),
+        ]
+        for callback, event in self._handlers:
+            client.add_event_handler(callback, event)
+        self._client = client
+        # Telegram starts pushing updates to a session once it has made a request
+        await client.get_me()
+        print(f"Watcher: listening for reaction updates in {len(self.chat_ids)} chats.")
+
+    def _stop_listening(self):
+        if self._client is not None:
+            for callback, event in self._handlers:
+                self._client.remove_event_handler(callback, event)
+        self._client = None
+        self._handlers = []
+
+    async def _on_reactions(self, update):
+        from telethon import utils
+        self._queue(utils.get_peer_id(update.peer, add_mark=False), update.msg_id, update.reactions)
+
+    async def _on_edit(self, event):
+        from telethon import utils
+        message = event.message
+        if message.reactions is None:
+            return  # Edits without reaction data leave the stored counts alone
+        self._queue(utils.get_peer_id(message.peer_id, add_mark=False), message.id, message.reactions)
+
+    def _queue(self, chat_id, message_id, reactions):
+        if chat_id not in self.chat_ids:
+            return
+        breakdown = breakdown_from_reactions(reactions)
+        self.pending[(chat_id, message_id)] = (sum(breakdown.values()), breakdown)
+
+    async def flush(self):
+        """Write the queued counts in one transaction."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        updates = [(chat_id, message_id, count, breakdown) for (chat_id, message_id), (count, breakdown) in batch.items()]
+        changed = await _in_executor(database.apply_reaction_updates, updates)
+        if changed is None:
+            # Retry with the next flush; counts that arrived meanwhile are newer and win
+            for key, value in batch.items():
+                self.pending.setdefault(key, value)
+            print(f"Watcher: could not store {len(updates)} reaction updates; retrying with the next flush.")
+            return
+        print(f"Watcher: stored {len(updates)} reaction updates, {len(changed)} history entries changed.")
+
+
+# Global instance; the web app starts it on the first request if chats are watched
+watcher = ReactionWatcher()
+_checked_on_startup = False
+
+
+def ensure_started():
+    """Start the watcher once per process if any chat is watched."""
+    global _checked_on_startup
+    if _checked_on_startup:
+        return
+    _checked_on_startup = True
+    if database.get_watched_chats():
+        watcher.start()
+
+
+def main():
+    database.init_db()
+
+    async def run_forever():
+        event_loop.attach_loop(asyncio.get_running_loop())
+        await watcher.run()
+
+    if not database.get_watched_chats():
+        print("No chats are watched. Add one from a history entry in the web app first.")
+        return
+    asyncio.run(run_forever())
+
+
+if __name__ == '__main__':
+    main()
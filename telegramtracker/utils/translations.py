@@ -108,6 +108,38 @@ translations = {
         'tr': 'Örn: 100',
         'en': 'Ex: 100'
     },
+    'max_minutes_label': {
+        'tr': 'En fazla kaç dakika sürsün?',
+        'en': 'Stop after N minutes?'
+    },
+    'max_messages_label': {
+        'tr': 'En fazla kaç mesaj taransın?',
+        'en': 'Stop after N scanned messages?'
+    },
+    'budget_placeholder': {
+        'tr': 'Sınırsız',
+        'en': 'No limit'
+    },
+    'cancel_scan': {
+        'tr': 'Taramayı Durdur',
+        'en': 'Stop Scan'
+    },
+    'stopped_early': {
+        'tr': 'Tarama erken durduruldu',
+        'en': 'Scan stopped early'
+    },
+    'stop_reason_cancelled': {
+        'tr': 'kullanıcı tarafından iptal edildi',
+        'en': 'cancelled by the user'
+    },
+    'stop_reason_time_budget': {
+        'tr': 'süre sınırına ulaşıldı',
+        'en': 'time limit reached'
+    },
+    'stop_reason_message_budget': {
+        'tr': 'mesaj sınırına ulaşıldı',
+        'en': 'message limit reached'
+    },
     'download_limit_validation_error': {
         'tr': 'İndirme limiti için geçerli bir sayı girin (en az 1).',
         'en': 'Please enter a valid number for the download limit (at least 1).'
@@ -281,13 +313,430 @@ translations = {
     'delete_selected': {
         'tr': 'Seçili Olanı Sil',
         'en': 'Delete Selected'
+    },
+
+    # Arama sayfası
+    'search_messages_title': {
+        'tr': 'Mesajlarda Ara',
+        'en': 'Search Messages'
+    },
+    'search_messages_description': {
+        'tr': 'Kaydedilmiş tüm aramalardaki mesajlarda arama yapın.',
+        'en': 'Search messages across all saved searches.'
+    },
+    'search_query_placeholder': {
+        'tr': 'Aranacak kelimeler',
+        'en': 'Words to search for'
+    },
+    'search_no_hits': {
+        'tr': 'Eşleşen mesaj bulunamadı.',
+        'en': 'No matching messages found.'
+    },
+    'search_error': {
+        'tr': 'Arama sırasında bir hata oluştu.',
+        'en': 'An error occurred while searching.'
+    },
+    'view_history_entry': {
+        'tr': 'Aramayı Gör',
+        'en': 'View Search'
+    },
+
+    'task_interrupted_error': {
+        'tr': 'Görev tamamlanamadan durduruldu.',
+        'en': 'The task was stopped before it finished.'
+    },
+    'resume_scan': {
+        'tr': 'Taramaya Devam Et',
+        'en': 'Resume Scan'
+    },
+
+    # Tarama filtreleri
+    'media_type_label': {
+        'tr': 'Medya türü:',
+        'en': 'Media type:'
+    },
+    'media_type_any': {
+        'tr': 'Tüm mesajlar',
+        'en': 'All messages'
+    },
+    'media_type_photo': {
+        'tr': 'Fotoğraflar',
+        'en': 'Photos'
+    },
+    'media_type_video': {
+        'tr': 'Videolar',
+        'en': 'Videos'
+    },
+    'media_type_gif': {
+        'tr': 'GIF\'ler',
+        'en': 'GIFs'
+    },
+    'media_type_document': {
+        'tr': 'Dosyalar',
+        'en': 'Documents'
+    },
+    'sender': {
+        'tr': 'Gönderen',
+        'en': 'Sender'
+    },
+    'sender_label': {
+        'tr': 'Gönderen (isteğe bağlı):',
+        'en': 'Sender (optional):'
+    },
+    'sender_placeholder': {
+        'tr': 'Kullanıcı adı veya ID',
+        'en': 'Username or ID'
+    },
+    'date_range_label': {
+        'tr': 'Tarih aralığı (dönemin yerine geçer):',
+        'en': 'Date range (replaces the period):'
+    },
+    'date_from': {
+        'tr': 'Başlangıç tarihi',
+        'en': 'From date'
+    },
+    'date_to': {
+        'tr': 'Bitiş tarihi',
+        'en': 'To date'
+    },
+    'date_range_error': {
+        'tr': 'Geçersiz tarih aralığı.',
+        'en': 'Invalid date range.'
+    },
+    'min_reactions_label': {
+        'tr': 'En az tepki sayısı:',
+        'en': 'Minimum reactions:'
+    },
+    'scan_filters': {
+        'tr': 'Filtreler',
+        'en': 'Filters'
+    },
+
+    # Örneklemeli tarama
+    'scan_mode_label': {
+        'tr': 'Tarama türü:',
+        'en': 'Scan mode:'
+    },
+    'scan_mode_full': {
+        'tr': 'Tam tarama (tüm mesajlar)',
+        'en': 'Full scan (every message)'
+    },
+    'scan_mode_sample': {
+        'tr': 'Hızlı tahmin (örneklem)',
+        'en': 'Quick estimate (sample)'
+    },
+    'scan_mode_export': {
+        'tr': 'Toplu dışa aktarma (tüm geçmiş için)',
+        'en': 'Bulk export (for full history)'
+    },
+    'scan_mode': {
+        'tr': 'Tarama türü',
+        'en': 'Scan mode'
+    },
+    'scan_mode_regular': {
+        'tr': 'Normal',
+        'en': 'Regular'
+    },
+    'scan_mode_takeout': {
+        'tr': 'Toplu dışa aktarma (takeout)',
+        'en': 'Bulk export (takeout)'
+    },
+    'sample_rate_label': {
+        'tr': 'Örneklem oranı (%):',
+        'en': 'Sample rate (%):'
+    },
+    'sample_refine': {
+        'tr': 'En popüler mesajların çevresini tamamen tara',
+        'en': 'Fully scan around the most popular messages'
+    },
+    'sample_stats_title': {
+        'tr': 'Örneklem Tahmini',
+        'en': 'Sample Estimate'
+    },
+    'sample_note': {
+        'tr': 'Bu sonuçlar mesajların bir örnekleminden hesaplanmıştır; medya indirilmedi. Aralıklar %95 güven aralığıdır.',
+        'en': 'These results were computed from a sample of the messages; no media was downloaded. Ranges are 95% confidence intervals.'
+    },
+    'sample_size': {
+        'tr': 'Örneklenen mesaj',
+        'en': 'Sampled messages'
+    },
+    'sample_estimated_messages': {
+        'tr': 'Tahmini mesaj sayısı',
+        'en': 'Estimated messages'
+    },
+    'sample_mean_reactions': {
+        'tr': 'Mesaj başına ortalama tepki',
+        'en': 'Average reactions per message'
+    },
+    'sample_with_reactions': {
+        'tr': 'Tepki alan mesajlar',
+        'en': 'Messages with reactions'
+    },
+    'sample_percentile': {
+        'tr': 'Yüzdelik',
+        'en': 'Percentile'
+    },
+    'sample_refined': {
+        'tr': 'Çevreden eklenen mesaj',
+        'en': 'Neighbouring messages added'
+    },
+
+    # Gönderen sıralaması
+    'sender_leaderboard': {
+        'tr': 'En Çok Tepki Alan Gönderenler',
+        'en': 'Top Senders by Reactions'
+    },
+    'sender_messages': {
+        'tr': 'Mesaj',
+        'en': 'Messages'
+    },
+    'sender_reactions': {
+        'tr': 'Toplam tepki',
+        'en': 'Total reactions'
+    },
+    'sender_mean': {
+        'tr': 'Mesaj başına',
+        'en': 'Per message'
+    },
+    'sender_top_post': {
+        'tr': 'En iyi mesaj',
+        'en': 'Top post'
+    },
+
+    # Tarama karşılaştırma
+    'compare_title': {
+        'tr': 'Tarama Karşılaştırması',
+        'en': 'Scan Comparison'
+    },
+    'compare_previous': {
+        'tr': 'Bu sohbetin önceki taramasıyla karşılaştır',
+        'en': 'Compare with the previous scan of this chat'
+    },
+    'compare_entries_error': {
+        'tr': 'Karşılaştırılacak geçmiş kayıtları bulunamadı.',
+        'en': 'The history entries to compare were not found.'
+    },
+    'compare_different_chats': {
+        'tr': 'Yalnızca aynı sohbetin taramaları karşılaştırılabilir.',
+        'en': 'Only scans of the same chat can be compared.'
+    },
+    'compare_older': {
+        'tr': 'Önceki',
+        'en': 'Before'
+    },
+    'compare_newer': {
+        'tr': 'Sonraki',
+        'en': 'After'
+    },
+    'compare_view_gained': {
+        'tr': 'En çok tepki kazananlar',
+        'en': 'Most reactions gained'
+    },
+    'compare_view_rank': {
+        'tr': 'Sıralamada yükselenler',
+        'en': 'Biggest rank changes'
+    },
+    'compare_view_new': {
+        'tr': 'Yeni mesajlar',
+        'en': 'New messages'
+    },
+    'compare_view_dropped': {
+        'tr': 'Listeden çıkanlar',
+        'en': 'Dropped messages'
+    },
+    'compare_reactions_gained': {
+        'tr': 'Ortak mesajlarda kazanılan tepki',
+        'en': 'Reactions gained on shared messages'
+    },
+    'compare_rank': {
+        'tr': 'Sıra',
+        'en': 'Rank'
+    },
+    'message': {
+        'tr': 'Mesaj',
+        'en': 'Message'
+    },
+    'compare_change': {
+        'tr': 'Değişim',
+        'en': 'Change'
+    },
+
+    # Sıralama ölçütleri
+    'rank_label': {
+        'tr': 'Sıralama:',
+        'en': 'Rank by:'
+    },
+    'rank_reactions': {
+        'tr': 'Tepki sayısı',
+        'en': 'Reaction count'
+    },
+    'rank_weighted': {
+        'tr': 'Ağırlıklı etkileşim (tepki, görüntülenme, iletme, yanıt)',
+        'en': 'Weighted engagement (reactions, views, forwards, replies)'
+    },
+    'rank_zscore': {
+        'tr': 'Kendi dönemine göre öne çıkanlar',
+        'en': 'Standouts of their time period'
+    },
+    'rank_per_view': {
+        'tr': 'Görüntülenme başına tepki',
+        'en': 'Reactions per view'
+    },
+    'rank_per_hour': {
+        'tr': 'Saat başına tepki',
+        'en': 'Reactions per hour since posting'
+    },
+    'rank_button': {
+        'tr': 'Sırala',
+        'en': 'Rank'
+    },
+    'score': {
+        'tr': 'Puan',
+        'en': 'Score'
+    },
+    'views': {
+        'tr': 'görüntülenme',
+        'en': 'views'
+    },
+    'forwards': {
+        'tr': 'iletme',
+        'en': 'forwards'
+    },
+    'replies': {
+        'tr': 'yanıt',
+        'en': 'replies'
+    },
+
+    # Toplu tarama
+    'batch_scan': {
+        'tr': 'Toplu Tarama',
+        'en': 'Batch Scan'
+    },
+    'batch_description': {
+        'tr': 'Birden fazla sohbeti aynı anda tarayın ve en iyi mesajlarını tek bir listede karşılaştırın.',
+        'en': 'Scan several chats at once and compare their top messages in one leaderboard.'
+    },
+    'batch_chats_label': {
+        'tr': 'Sohbetler (her satıra bir kullanıcı adı veya ID):',
+        'en': 'Chats (one username or ID per line):'
+    },
+    'batch_chats_placeholder': {
+        'tr': '@kanal1\n@kanal2',
+        'en': '@channel1\n@channel2'
+    },
+    'batch_folder_label': {
+        'tr': 'veya Telegram klasörü:',
+        'en': 'or Telegram chat folder:'
+    },
+    'batch_folder_placeholder': {
+        'tr': 'Klasör adı (isteğe bağlı)',
+        'en': 'Folder name (optional)'
+    },
+    'batch_download_limit_label': {
+        'tr': 'Sohbet başına indirme limiti:',
+        'en': 'Download limit per chat:'
+    },
+    'batch_button': {
+        'tr': 'Hepsini Tara',
+        'en': 'Scan All'
+    },
+    'batch_results_title': {
+        'tr': 'Toplu Tarama Sonuçları',
+        'en': 'Batch Scan Results'
+    },
+    'batch_leaderboard': {
+        'tr': 'Ortak Sıralama',
+        'en': 'Combined Leaderboard'
+    },
+    'batch_leaderboard_description': {
+        'tr': 'Mesajlar, tepki sayılarının kendi sohbetlerinin ortalamasına oranıyla sıralanır; böylece küçük ve büyük kanallar karşılaştırılabilir.',
+        'en': "Messages are ranked by their reactions relative to their own chat's average, so small and large channels can be compared."
+    },
+    'batch_score': {
+        'tr': 'Puan',
+        'en': 'Score'
+    },
+    'batch_show_more': {
+        'tr': 'Daha Fazla Göster',
+        'en': 'Show More'
+    },
+    'batch_view_leaderboard': {
+        'tr': 'Bu arama bir toplu taramanın parçası. Ortak sıralamayı görüntüle',
+        'en': 'This search is part of a batch scan. View the combined leaderboard'
+    },
+
+    # Canlı takip
+    'watch': {
+        'tr': 'Canlı Takip',
+        'en': 'Live Tracking'
+    },
+    'watch_description': {
+        'tr': 'Takip edilen sohbetlerdeki tepki sayıları, yeniden tarama yapmadan Telegram güncellemeleriyle güncel tutulur. Yalnızca daha önce taranmış mesajlar güncellenir.',
+        'en': 'Reaction counts in watched chats are kept current from Telegram updates, without rescanning. Only messages that were scanned before are updated.'
+    },
+    'watch_chat': {
+        'tr': 'Canlı Takip Et',
+        'en': 'Track Live'
+    },
+    'unwatch_chat': {
+        'tr': 'Takibi Bırak',
+        'en': 'Stop Tracking'
+    },
+    'watch_empty': {
+        'tr': 'Henüz takip edilen sohbet yok. Bir geçmiş kaydından sohbet ekleyebilirsiniz.',
+        'en': 'No chats are tracked yet. Add one from a history entry.'
+    },
+    'watch_running': {
+        'tr': 'Takip bu işlemde çalışıyor.',
+        'en': 'Tracking is running in this process.'
+    },
+    'watch_not_running': {
+        'tr': 'Takip bu işlemde çalışmıyor (başka bir işlem yürütüyor olabilir).',
+        'en': 'Tracking is not running in this process (another process may be running it).'
+    },
+    'watch_added_at': {
+        'tr': 'Eklenme',
+        'en': 'Added'
+    },
+
+    # Dışa aktarma
+    'export_csv': {
+        'tr': 'CSV Olarak İndir',
+        'en': 'Export CSV'
+    },
+    'export_jsonl': {
+        'tr': 'JSONL Olarak İndir',
+        'en': 'Export JSONL'
     }
 }
 
+class TranslationTable(dict):
+    """Flat key -> text mapping for one language; unknown keys render as the key itself."""
+    def __missing__(self, key):
+        return key
+
+
+def compile_tables():
+    """Flatten the translations into one table per language, with English as the fallback."""
+    tables = {}
+    for lang in LANGUAGES:
+        tables[lang] = TranslationTable(
+            (key, texts[lang] if lang in texts else texts['en'])
+            for key, texts in translations.items()
+        )
+    return tables
+
+
+# Compiled once at import; templates receive a whole table instead of looking up each key
+TABLES = compile_tables()
+
+
+def get_table(lang='tr'):
+    """Returns the compiled translation table of a language (English if unknown)."""
+    return TABLES.get(lang) or TABLES['en']
+
+
 def get_text(key, lang='tr'):
     """Returns the translation for a specific key in the selected language."""
-    if key not in translations:
-        return key  # Return the key itself if key doesn't exist
-    if lang not in translations[key]:
-        return translations[key]['en']  # Return English if language doesn't exist
-    return translations[key][lang]
+    return get_table(lang)[key]
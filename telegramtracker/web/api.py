@@ -0,0 +1,182 @@
+"""
+Versioned JSON API for jobs, history entries and their results.
+
+Lists use opaque cursors instead of page numbers, so pages stay stable while
+new entries are added. Responses carry ETags derived from the job row or from
+the per-history revision counter; a matching If-None-Match is answered with a
+304 before any result rows are read.
+"""
+import base64
+import json
+
+from flask import request, jsonify, make_response
+
+from telegramtracker.core import database
+from telegramtracker.core import job_store
+
+API_PREFIX = '/api/v1'
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Fields that can be requested with ?fields=
+RESULT_FIELDS = ('message_id', 'reaction_count', 'message_preview', 'message_link', 'media_paths')
+JOB_FIELDS = ('id', 'status', 'original_identifier', 'period_days', 'phase', 'scanned_count',
+              'media_total', 'media_processed', 'history_id', 'error', 'stop_reason', 'created_at', 'updated_at')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeDecodeError):
+        raise ApiError('Invalid cursor.')
+
+
+def _limit_arg():
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _fields_arg():
+    """Return the requested result fields, or all of them."""
+    if not request.args.get('fields'):
+        return RESULT_FIELDS
+    fields = tuple(field.strip() for field in request.args['fields'].split(',') if field.strip())
+    unknown = [field for field in fields if field not in RESULT_FIELDS]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(RESULT_FIELDS)}.")
+    return fields
+
+
+def _not_modified(etag):
+    """Return a 304 response if the client already has this version, else None."""
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def _json_with_etag(payload, etag):
+    response = jsonify(payload)
+    response.set_etag(etag)
+    # Clients may keep the response but must revalidate it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _history_results_response(history_id, revision):
+    etag = f"history-{history_id}-r{revision}"
+    cached = _not_modified(etag)
+    if cached is not None:
+        return cached
+
+    fields = _fields_arg()
+    limit = _limit_arg()
+    after = _decode_cursor(request.args.get('cursor'))
+    if after is not None and (not isinstance(after, list) or len(after) != 2):
+        raise ApiError('Invalid cursor.')
+
+    # Fetch one extra row to know whether there is a next page
+    rows = database.get_history_results_after(history_id, after, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor([rows[-1]['reaction_count'], rows[-1]['result_id']])
+
+    return _json_with_etag({
+        'history_id': history_id,
+        'revision': revision,
+        'results': [{field: row[field] for field in fields} for row in rows],
+        'next_cursor': next_cursor,
+    }, etag)
+
+
+def register_api_routes(app):
+    @app.errorhandler(ApiError)
+    def handle_api_error(error):
+        return jsonify({'error': error.message}), error.status
+
+    @app.route(f'{API_PREFIX}/history')
+    def api_history_list():
+        """History entries, newest first."""
+        count, newest_id, revisions = database.get_history_list_state()
+        etag = f"history-list-{count}-{newest_id}-{revisions}"
+        cached = _not_modified(etag)
+        if cached is not None:
+            return cached
+
+        limit = _limit_arg()
+        before_id = _decode_cursor(request.args.get('cursor'))
+        if before_id is not None and not isinstance(before_id, int):
+            raise ApiError('Invalid cursor.')
+
+        entries = database.get_history_entries_after(before_id, limit + 1)
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = _encode_cursor(entries[-1]['id'])
+
+        return _json_with_etag({'history': entries, 'next_cursor': next_cursor}, etag)
+
+    @app.route(f'{API_PREFIX}/history/<int:history_id>')
+    def api_history_entry(history_id):
+        entry = database.get_history_entry(history_id)
+        if not entry:
+            raise ApiError('History entry not found.', 404)
+        entry = dict(entry)
+        etag = f"history-{history_id}-r{entry['revision']}"
+        cached = _not_modified(etag)
+        if cached is not None:
+            return cached
+        entry.pop('download_folder_path', None)
+        entry.pop('last_viewed_at', None)
+        return _json_with_etag(entry, etag)
+
+    @app.route(f'{API_PREFIX}/history/<int:history_id>/results')
+    def api_history_results(history_id):
+        """Ranked results of a history entry. Query parameters: cursor, limit, fields."""
+        revision = database.get_history_revision(history_id)
+        if revision is None:
+            raise ApiError('History entry not found.', 404)
+        return _history_results_response(history_id, revision)
+
+    @app.route(f'{API_PREFIX}/jobs/<job_id>')
+    def api_job(job_id):
+        job = job_store.get_job(job_id)
+        if job is None:
+            raise ApiError('Job not found.', 404)
+        etag = f"job-{job_id}-{job['status']}-{job['scanned_count']}-{job['media_processed']}-{job['updated_at']}"
+        cached = _not_modified(etag)
+        if cached is not None:
+            return cached
+        return _json_with_etag({field: job[field] for field in JOB_FIELDS}, etag)
+
+    @app.route(f'{API_PREFIX}/jobs/<job_id>/results')
+    def api_job_results(job_id):
+        """Results of a finished job; they are read from the history entry the job saved."""
+        job = job_store.get_job(job_id)
+        if job is None:
+            raise ApiError('Job not found.', 404)
+        if job['status'] == job_store.RUNNING:
+            return jsonify({'error': 'Job is still running.', 'status': job['status']}), 409
+        if job['status'] != job_store.COMPLETE or not job['history_id']:
+            return jsonify({'error': job['error'] or 'Job has no results.', 'status': job['status']}), 409
+
+        revision = database.get_history_revision(job['history_id'])
+        if revision is None:
+            raise ApiError('The results of this job were deleted.', 410)
+        return _history_results_response(job['history_id'], revision)
@@ -0,0 +1,161 @@
+"""
+Fingerprinted, precompressed static assets.
+
+At startup every file under static/ is hashed and copied to the asset cache
+under a content-addressed name (css/style.3f2a9c1b04.css), together with gzip
+and, when the brotli package is installed, brotli variants. Templates link to
+these names through asset_url(), and /assets/ serves them with year-long
+immutable caching and Content-Encoding negotiation, so browsers only fetch an
+asset again after its content changed.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import request, url_for, send_file, abort
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip variants are always written
+    brotli = None
+
+# Asset settings
+ASSET_CACHE_DIR = '.asset_cache'
+ASSET_MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 10
+# Fonts in these formats and images are already compressed
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.ttf', '.ico', '.json', '.txt'}
+CSS_URL_PATTERN = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+# logical path ('css/style.css') -> {'name', 'mimetype', 'encodings': {'identity'|'gzip'|'br': file path}}
+_manifest = {}
+# fingerprinted name -> manifest entry
+_by_name = {}
+
+
+def build_manifest(static_folder):
+    """Fingerprint and precompress everything under static_folder."""
+    _manifest.clear()
+    _by_name.clear()
+    if not static_folder or not os.path.isdir(static_folder):
+        return _manifest
+
+    paths = []
+    for root, _, files in os.walk(static_folder):
+        for file_name in files:
+            paths.append(os.path.relpath(os.path.join(root, file_name), static_folder).replace('\\', '/'))
+
+    # Stylesheets reference fonts and images, so their fingerprints are needed first
+    for logical_path in sorted(paths, key=lambda path: path.endswith('.css')):
+        with open(os.path.join(static_folder, logical_path), 'rb') as f:
+            content = f.read()
+        if logical_path.endswith('.css'):
+            content = _rewrite_css_urls(logical_path, content)
+        _add_asset(logical_path, content)
+
+    print(f"Static assets: {len(_manifest)} files fingerprinted.")
+    return _manifest
+
+
+def _rewrite_css_urls(css_path, content):
+    """Point relative url()s in a stylesheet at the fingerprinted assets."""
+    css_dir = posixpath.dirname(css_path)
+
+    def replace(match):
+        quote, target = match.group(1), match.group(2)
+        if target.startswith(('data:', 'http:', 'https:', '//', '/')):
+            return match.group(0)
+        path, _, suffix = target.partition('?')
+        logical_path = posixpath.normpath(posixpath.join(css_dir, path))
+        entry = _manifest.get(logical_path)
+        if entry is None:
+            return match.group(0)
+        # Both files are served from /assets/, so a path relative to the stylesheet still works
+        relative = posixpath.relpath(entry['name'], css_dir)
+        return f"url({quote}{relative}{quote})"
+
+    return CSS_URL_PATTERN.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def _add_asset(logical_path, content):
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    stem, extension = posixpath.splitext(logical_path)
+    name = f"{stem}.{digest}{extension}"
+
+    encodings = {'identity': _write_once(name, content)}
+    if extension.lower() in COMPRESSIBLE_EXTENSIONS:
+        gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(gzipped) < len(content):
+            encodings['gzip'] = _write_once(name + '.gz', gzipped)
+        if brotli is not None:
+            compressed = brotli.compress(content, quality=11)
+            if len(compressed) < len(content):
+                encodings['br'] = _write_once(name + '.br', compressed)
+
+    entry = {
+        'name': name,
+        'mimetype': mimetypes.guess_type(logical_path)[0] or 'application/octet-stream',
+        'encodings': encodings,
+    }
+    _manifest[logical_path] = entry
+    _by_name[name] = entry
+
+
+def _write_once(name, content):
+    """Write a content-addressed file unless it already exists; returns its absolute path."""
+    path = os.path.abspath(os.path.join(ASSET_CACHE_DIR, name))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent workers never serve a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    return path
+
+
+def asset_url(filename):
+    """url_for('static', ...) replacement that links to the fingerprinted asset."""
+    entry = _manifest.get(filename)
+    if entry is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', name=entry['name'])
+
+
+def register_asset_routes(app):
+    build_manifest(app.static_folder)
+
+    @app.context_processor
+    def inject_asset_url():
+        return {'asset_url': asset_url}
+
+    @app.route('/assets/<path:name>')
+    def serve_asset(name):
+        """Serves a fingerprinted asset in the best encoding the client accepts."""
+        entry = _by_name.get(name)
+        if entry is None:
+            abort(404)
+
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in entry['encodings'] and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        response = send_file(
+            entry['encodings'][encoding],
+            mimetype=entry['mimetype'],
+            max_age=ASSET_MAX_AGE,
+            conditional=True,
+            etag=f"{name}-{encoding}"
+        )
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        # The name changes with the content, so browsers never need to revalidate
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
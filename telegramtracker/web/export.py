@@ -0,0 +1,68 @@
+"""
+Streaming encoders for exporting history results.
+
+Rows are encoded in small batches as they come off the database cursor, so an
+export starts sending immediately and uses constant memory regardless of size.
+"""
+import csv
+import io
+import json
+import zlib
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_FIELDS = ['message_id', 'reaction_count', 'message_preview', 'message_link', 'media_paths']
+ROWS_PER_CHUNK = 200
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow([
+            row['message_id'],
+            row['reaction_count'],
+            row['message_preview'],
+            row['message_link'],
+            '|'.join(row['media_paths']),
+        ])
+        count += 1
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def _jsonl_chunks(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({field: row[field] for field in EXPORT_FIELDS}, ensure_ascii=False))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream_export(rows, export_format, compress=False):
+    """Yield the encoded export of `rows` as bytes, gzip-compressed if requested."""
+    chunks = _csv_chunks(rows) if export_format == 'csv' else _jsonl_chunks(rows)
+
+    if not compress:
+        for chunk in chunks:
+            if chunk:
+                yield chunk.encode('utf-8')
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        # Sync-flush each chunk so the client receives data as it is produced
+        data = compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
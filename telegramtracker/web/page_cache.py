@@ -0,0 +1,66 @@
+"""
+Rendered page cache for history views.
+
+Saved history entries only change when their revision counter is bumped, so
+the rendered HTML of a page can be reused as long as the key it was stored
+under - which includes the revision - is still current. Entries are kept in a
+size-bounded LRU and dropped explicitly when history entries are deleted.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# Cache settings
+MAX_MEMORY_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+
+HISTORY_LIST = 'list'  # First key element of cached /history pages
+
+
+class PageCache:
+    def __init__(self, max_bytes=MAX_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key tuple -> encoded HTML
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached HTML (bytes) for a key, or None."""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, html):
+        """Store rendered HTML under key and return it encoded."""
+        body = html.encode('utf-8')
+        if len(body) > self.max_bytes:
+            return body
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous)
+            self._entries[key] = body
+            self.current_bytes += len(body)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+        return body
+
+    def invalidate_history(self, history_id):
+        """Drop every cached page of a history entry and the history list pages."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in (history_id, HISTORY_LIST)]:
+                self.current_bytes -= len(self._entries.pop(key))
+
+
+def history_page_key(history_id, revision, page, lang, ranking=None):
+    return (history_id, revision, page, lang, ranking)
+
+
+def history_list_key(list_state, lang):
+    return (HISTORY_LIST, list_state, lang)
+
+
+# Global instance shared by the web routes
+page_cache = PageCache()
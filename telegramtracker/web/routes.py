@@ -1,34 +1,238 @@
-import threading
-import queue
 import os
+import json
+import asyncio
+import time
+import datetime
+import uuid
+import mimetypes
+from urllib.parse import quote as url_quote
 from flask import render_template, request, redirect, url_for, Response, jsonify, session, flash, make_response, send_from_directory
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
 
 from telegramtracker.core import database
-import asyncio
-from telegramtracker.services.telegram_client import run_fetch_in_background, API_ID, API_HASH, build_message_link, get_user_chats_async
-from telegramtracker.utils.translations import get_text, LANGUAGES
+from telegramtracker.core.result_cache import result_cache, job_key, history_key, compare_key
+from telegramtracker.core import maintenance
+from telegramtracker.core import job_store
+from telegramtracker.core.scoring import load_columns, rank_order, RANKINGS, DEFAULT_RANKING
+from telegramtracker.core import comparison
+from telegramtracker.web.export import stream_export, EXPORT_FORMATS
+from telegramtracker.web.page_cache import page_cache, history_page_key, history_list_key
+from telegramtracker.services import event_loop
+from telegramtracker.services import watcher
+from telegramtracker.services.batch_scan import run_batch_in_background, BATCH_MAX_CHATS
+from telegramtracker.services.telegram_client import run_fetch_in_background, API_ID, API_HASH, build_message_link, get_user_chats_async, MEDIA_TYPE_FILTERS
+from telegramtracker.utils.translations import get_text, get_table, LANGUAGES
+
+# Media serving settings - Load from .env file
+MEDIA_MAX_AGE = 365 * 24 * 3600
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE', '').lower()  # '', 'x-sendfile' or 'x-accel-redirect'
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-downloads')
+
+# Default scan budgets - Load from .env file (0 means no limit)
+SCAN_MAX_SECONDS = int(os.getenv('SCAN_MAX_SECONDS', 0))
+SCAN_MAX_MESSAGES = int(os.getenv('SCAN_MAX_MESSAGES', 0))
+
+# How often /stream-progress checks the job store for updates
+PROGRESS_POLL_SECONDS = 0.5
+
+# Entries shown in the cross-chat leaderboard of a batch scan (?top= overrides it)
+BATCH_LEADERBOARD_SIZE = 50
+
+# Senders shown in the sender leaderboard of a history entry
+SENDER_LEADERBOARD_SIZE = 20
+
+# Most results /history/<id>/reactions returns at once (?limit= is clamped to it)
+REACTION_RANKING_MAX_LIMIT = 100
+
+# Rows per page when comparing two history entries
+COMPARE_PER_PAGE = 50
+
+# Results page settings
+RESULTS_PER_PAGE = 10   # Items per page
+RESULTS_MAX_PAGES = 10  # Max number of pages to show in pagination
+
+# File extensions the media gallery can display
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp')
+VIDEO_EXTENSIONS = ('mp4', 'mov', 'avi', 'mkv', 'webm')
+
+def media_kind(media_path):
+    """Return 'image', 'video' or 'other' for a media path."""
+    extension = media_path.rsplit('.', 1)[-1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    return 'other'
+
+PERIOD_CHOICES = {'7': 7, '30': 30, '90': 90, '180': 180, 'all': None, '1': 1}
+
+def parse_chat_identifier(chat_input):
+    """Return a numeric chat ID as int, anything else as a stripped username."""
+    try:
+        # If it looks like a numeric ID, convert to int
+        processed_identifier = int(chat_input)
+        print(f"'{chat_input}' processed as ID: {processed_identifier}")
+    except ValueError:
+        # If conversion fails, treat as username
+        processed_identifier = chat_input.strip()
+        print(f"'{chat_input}' processed as username: {processed_identifier}")
+    return processed_identifier
+
+def budget_from_form(form):
+    """Scan budget from the max_minutes/max_messages fields, falling back to the configured defaults."""
+    max_minutes = form.get('max_minutes', type=int)
+    max_messages = form.get('max_messages', type=int)
+    return {
+        'max_seconds': max_minutes * 60 if max_minutes and max_minutes > 0 else SCAN_MAX_SECONDS or None,
+        'max_messages': max_messages if max_messages and max_messages > 0 else SCAN_MAX_MESSAGES or None,
+    }
+
+def filters_from_form(form):
+    """Scan filters from the form, or None if none were set. Raises ValueError for invalid dates."""
+    min_reactions = form.get('min_reactions', 0, type=int)
+    filters = {
+        'media_type': form.get('media_type') if form.get('media_type') in MEDIA_TYPE_FILTERS else None,
+        'sender': parse_chat_identifier(form['sender']) if form.get('sender', '').strip() else None,
+        'date_from': form.get('date_from') or None,
+        'date_to': form.get('date_to') or None,
+        'min_reactions': min_reactions if min_reactions > 0 else None,
+    }
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            filters[key] = datetime.date.fromisoformat(filters[key]).isoformat()
+    if filters['date_from'] and filters['date_to'] and filters['date_from'] > filters['date_to']:
+        raise ValueError("date_from is after date_to")
+    return {key: value for key, value in filters.items() if value is not None} or None
+
+def sampling_from_form(form):
+    """Sampling options of an approximate scan, or None for a full scan."""
+    if form.get('scan_mode') != 'sample':
+        return None
+    rate_percent = form.get('sample_rate', type=float)
+    return {
+        'rate': min(rate_percent, 100.0) / 100 if rate_percent and rate_percent > 0 else None,
+        'refine': form.get('sample_refine') == 'true',
+    }
 
 # Task Management
 class TaskManager:
+    """
+    Runs scan tasks in this process. Job status and progress are kept in the
+    shared job store and results in the result cache, so any worker process
+    can stream progress and serve results for a task started by another one.
+    """
+    checkpoints = True  # Single-chat scans save checkpoints and can be resumed
+
     def __init__(self):
-        self.progress_queue = queue.Queue()
+        self.job_id = None              # Identifies the task in the job store and result cache
+        self.progress_queue = None      # JobProgress for the current job
         self.results = None
         self.error = None
         self.entity = None  # Telegram entity object
-        self.is_running = False
+        self.is_running = False         # True while this process runs a task
         self.original_identifier = None # Raw input from user for history
         self.original_period = None     # Numeric period for history
         self.scanned_count = 0          # Total messages scanned in the task
         self.download_folder_path = None # Path to folder where media is saved
-
-    def start_new_task(self, identifier_to_process, raw_identifier_for_history, period_for_history, reaction_filter_enabled, download_limit_count):
+        self.stop_reason = None         # Set when the task should stop early (cancel or budget)
+        self.chat_scans = []            # Per-chat state while a batch scan runs
+        self.scan_filters = None        # Media type, sender, date range and reaction minimum of the scan
+        self.sampling = None            # Sampling options when the scan is approximate
+        self.sample_stats = None        # Estimates computed by an approximate scan
+        self.bulk_export = False        # Read messages through a takeout session if Telegram allows it
+        self.scan_mode = None           # How the messages were read: 'regular', 'takeout' or 'sample'
+        self.sender_stats = None        # Per-sender aggregates of the scan, most reactions first
+
+    def start_new_task(self, identifier_to_process, raw_identifier_for_history, period_for_history, reaction_filter_enabled, download_limit_count, budget=None, filters=None, sampling=None, bulk_export=False):
         """Initializes state for a new background task and starts it."""
         if self.is_running:
             print("Warning: Attempted to start a new task while another is already running.")
             return False
 
+        job_id = uuid.uuid4().hex
+        # Everything needed to resume the scan from a checkpoint after a restart
+        scan_params = {
+            'identifier': identifier_to_process,
+            'reaction_filter': reaction_filter_enabled,
+            'download_limit': download_limit_count,
+            'budget': budget,
+            'filters': filters,
+            'sampling': sampling,
+            'bulk_export': bulk_export,
+        }
+        if not job_store.create_job(job_id, raw_identifier_for_history, period_for_history, scan_params):
+            print("Warning: Attempted to start a new task while another worker is running one.")
+            return False
+
+        self._reset_for_job(job_id, raw_identifier_for_history, period_for_history)
+        self.scan_filters = filters
+        self.sampling = sampling
+        self.bulk_export = bulk_export
+
+        # Runs on the shared Telegram event loop; returns immediately
+        run_fetch_in_background(identifier_to_process, self, period_for_history, reaction_filter_enabled, download_limit_count,
+                                budget=budget, filters=filters, sampling=sampling, bulk_export=bulk_export)
+        return True
+
+    def start_batch_task(self, identifiers, folder, period_for_history, reaction_filter_enabled, download_limit_count, budget=None):
+        """Starts a scan of several chats; the job id doubles as the batch id of the saved history entries."""
+        if self.is_running:
+            print("Warning: Attempted to start a batch while another task is already running.")
+            return False
+
+        job_id = uuid.uuid4().hex
+        label = ', '.join(str(identifier) for identifier in identifiers[:3]) or folder
+        if len(identifiers) > 3 or (identifiers and folder):
+            label += ', ...'
+        if not job_store.create_job(job_id, f"Batch: {label}", period_for_history):
+            print("Warning: Attempted to start a batch while another worker is running a task.")
+            return False
+
+        self._reset_for_job(job_id, None, period_for_history)
+        run_batch_in_background(identifiers, folder, self, period_for_history, reaction_filter_enabled, download_limit_count, budget)
+        return True
+
+    def resume_task(self, job_id):
+        """Continues an interrupted or failed job from its last checkpoint."""
+        if self.is_running:
+            print("Warning: Attempted to resume a task while another is already running.")
+            return False
+
+        checkpoint = job_store.load_checkpoint(job_id)
+        if checkpoint is None or not job_store.resume_job(job_id):
+            return False
+        job = job_store.get_job(job_id)
+
+        self._reset_for_job(job_id, job['original_identifier'], job['period_days'])
+        params = checkpoint['scan_params']
+        self.scan_filters = params.get('filters')
+        self.sampling = params.get('sampling')
+        self.bulk_export = params.get('bulk_export', False)
+        run_fetch_in_background(params['identifier'], self, job['period_days'], params['reaction_filter'],
+                                params['download_limit'], checkpoint=checkpoint, budget=params.get('budget'),
+                                filters=self.scan_filters, sampling=self.sampling, bulk_export=self.bulk_export)
+        return True
+
+    def request_stop(self, reason):
+        """Asks the running task to stop early; the first reason wins."""
+        if self.stop_reason is None:
+            self.stop_reason = reason
+            print(f"Stop requested for task {self.job_id}: {reason}")
+
+    async def poll_stop_request(self):
+        """Picks up a stop requested through the job store (possibly by another worker)."""
+        if self.stop_reason is None and self.job_id:
+            # Called from the shared event loop; the SQLite read must not block it
+            reason = await asyncio.get_running_loop().run_in_executor(None, job_store.get_stop_request, self.job_id)
+            if reason:
+                self.request_stop(reason)
+        return self.stop_reason
+
+    def _reset_for_job(self, job_id, raw_identifier_for_history, period_for_history):
         # Reset all task-specific fields
-        self.progress_queue = queue.Queue()
+        self.job_id = job_id
+        self.progress_queue = job_store.JobProgress(job_id)
         self.results = None
         self.error = None
         self.entity = None
@@ -37,27 +241,64 @@ class TaskManager:
         self.original_period = period_for_history
         self.scanned_count = 0
         self.download_folder_path = None
-
-        # The run_fetch_in_background function will need to be adapted
-        # to accept this TaskManager instance and update its attributes.
-        # For now, we pass 'self' (the task_manager instance) instead of task_data dict.
-        thread = threading.Thread(
-            target=run_fetch_in_background,
-            args=(identifier_to_process, self, period_for_history, reaction_filter_enabled, download_limit_count)
-            # Original args: (processed_identifier, task_data['progress_queue'], task_data, period, reaction_filter, download_limit)
-        )
-        thread.daemon = True
-        thread.start()
-        return True
+        self.stop_reason = None
+        self.chat_scans = []
+        self.scan_filters = None
+        self.sampling = None
+        self.sample_stats = None
+        self.bulk_export = False
+        self.scan_mode = None
+        self.sender_stats = None
 
     def set_task_error(self, error_message):
         """Sets error information for the current task and marks it as not running."""
         self.error = error_message
         self.is_running = False
-        # Ensure the queue is signaled if the background task errored out early
-        # Use a dictionary format consistent with other queue messages
+        # Record the error on the job so every worker's progress stream reports it
         self.progress_queue.put({'type': 'error', 'message': error_message})
 
+    def finish_task(self):
+        """Saves the finished task to history, publishes its results and marks the job complete."""
+        history_id = None
+        if self.original_identifier:
+            try:
+                history_id = database.save_search_history(
+                    self.original_identifier,
+                    self.entity, # Entity object of the scanned chat
+                    self.original_period,
+                    len(self.results), # Total results from this task
+                    self.scanned_count,
+                    self.download_folder_path,
+                    self.stop_reason,
+                    scan_filters=self.scan_filters,
+                    scan_mode=self.scan_mode,
+                    sample_stats=self.sample_stats
+                )
+                if history_id:
+                    database.save_sender_stats(history_id, self.sender_stats)
+                    database.save_search_results(history_id, self.results, lambda msg_id: build_message_link(self.entity, msg_id))
+            except Exception as e:
+                print(f"Error saving to history: {e}")
+
+        # Only the pages reachable through pagination are cached; persisting them
+        # lets other worker processes serve /results for this job.
+        # Links are derived here, only for the results on cached pages
+        result_cache.put(job_key(self.job_id), self.results, RESULTS_PER_PAGE, max_pages=RESULTS_MAX_PAGES,
+                         meta={'history_id': history_id, 'sample_stats': self.sample_stats}, persist=True,
+                         encode_item=lambda msg: msg.as_dict(build_message_link(self.entity, msg.id)))
+        job_store.update_job(self.job_id, history_id=history_id, stop_reason=self.stop_reason)
+        self.progress_queue.put({'type': 'complete', 'scanned': self.scanned_count})
+        job_store.clear_checkpoint(self.job_id)
+
+        # The results now live in the cache (and history); release them.
+        self.clear_task_data_after_processing()
+
+    def finish_batch_task(self):
+        """Marks a batch job complete; its chats were saved to history as they finished."""
+        self.scanned_count = sum(scan.scanned_count for scan in self.chat_scans)
+        job_store.update_job(self.job_id, stop_reason=self.stop_reason)
+        self.progress_queue.put({'type': 'complete', 'scanned': self.scanned_count})
+        self.clear_task_data_after_processing()
 
     def clear_task_data_after_processing(self):
         """Resets fields that should not persist after results are viewed/saved or an error is handled."""
@@ -68,12 +309,31 @@ class TaskManager:
         self.original_period = None
         self.scanned_count = 0
         self.download_folder_path = None
+        self.stop_reason = None
+        self.chat_scans = []
+        self.scan_filters = None
+        self.sampling = None
+        self.sample_stats = None
+        self.bulk_export = False
+        self.scan_mode = None
+        self.sender_stats = None
         # self.is_running should already be False at this point.
 
 # Global instance of the TaskManager
 task_manager = TaskManager()
 
 def register_routes(app):
+    app.jinja_env.globals['media_kind'] = media_kind
+
+    # Templates look texts up in the compiled table of the session language: tr['key']
+    @app.context_processor
+    def inject_translations():
+        return {'tr': get_table(session.get('lang', 'tr'))}
+
+    if MEDIA_SENDFILE == 'x-sendfile':
+        # Apache mod_xsendfile / lighttpd deliver file bodies for send_file responses
+        app.config['USE_X_SENDFILE'] = True
+
     # Store language selection in session
     @app.before_request
     def before_request():
@@ -86,6 +346,9 @@ def register_routes(app):
         if 'lang' not in session:
             session['lang'] = 'en'
 
+        # Resume live reaction tracking after a restart
+        watcher.ensure_started()
+
     # Language selection route
     @app.route('/set_language/<lang>')
     def set_language(lang):
@@ -113,8 +376,10 @@ def register_routes(app):
         """Starts a process to fetch Telegram data."""
         # No longer need 'global task_data'
         
-        if task_manager.is_running: # Use task_manager instance
-            # If a task is already running, redirect directly to loading page
+        running_job = job_store.get_running_job()
+        if running_job:
+            # If a task is already running (in any worker), redirect directly to its loading page
+            session['job_id'] = running_job['id']
             return redirect(url_for('loading'))
 
         chat_input = request.form.get('chat_id')
@@ -142,18 +407,25 @@ def register_routes(app):
                 return redirect(url_for('index'))
 
         # Process input for username or ID format
+        processed_identifier = parse_chat_identifier(chat_input)
+
+        # Process time period selection
+        period = PERIOD_CHOICES.get(period_choice)
+
+        # Optional budgets; the scan stops on its own and keeps its results when one runs out
+        budget = budget_from_form(request.form)
+
+        # Optional filters, applied by Telegram where it supports them
         try:
-            # If it looks like a numeric ID, convert to int
-            processed_identifier = int(chat_input)
-            print(f"'{chat_input}' processed as ID: {processed_identifier}")
+            filters = filters_from_form(request.form)
         except ValueError:
-            # If conversion fails, treat as username
-            processed_identifier = chat_input.strip()
-            print(f"'{chat_input}' processed as username: {processed_identifier}")
+            flash(get_text('date_range_error', session.get('lang', 'tr')), 'error')
+            return redirect(url_for('index'))
 
-        # Process time period selection
-        mapping = {'7': 7, '30': 30, '90': 90, '180': 180, 'all': None, '1': 1}
-        period = mapping.get(period_choice)
+        # Approximate scans read a sample of the chat's message ids instead of every message
+        sampling = sampling_from_form(request.form)
+        # Bulk exports read the full history through a Telegram takeout session
+        bulk_export = request.form.get('scan_mode') == 'export'
 
         # Process period for history saving (it's the same as 'period' used for fetching)
 
@@ -161,12 +433,51 @@ def register_routes(app):
         # The args passed to start_new_task now include all necessary info.
         # The run_fetch_in_background function (called within start_new_task)
         # will need to be updated separately to accept the task_manager instance.
-        if not task_manager.start_new_task(processed_identifier, chat_input, period, reaction_filter, download_limit):
+        if not task_manager.start_new_task(processed_identifier, chat_input, period, reaction_filter, download_limit, budget, filters, sampling, bulk_export):
             # This case (task already running) is handled by the check at the beginning.
             # If start_new_task had other failure modes, they could be handled here.
             flash(get_text('task_already_running_error', session.get('lang', 'tr')), 'error') # Example error
             return redirect(url_for('index'))
 
+        # Remember the job so any worker can serve its progress and results
+        session['job_id'] = task_manager.job_id
+        return redirect(url_for('loading'))
+
+    @app.route('/fetch_batch', methods=['POST'])
+    def fetch_batch():
+        """Starts a scan of several chats (a list and/or a Telegram chat folder)."""
+        running_job = job_store.get_running_job()
+        if running_job:
+            session['job_id'] = running_job['id']
+            return redirect(url_for('loading'))
+
+        # One chat per line; commas work as well
+        chat_lines = request.form.get('chat_list', '').replace(',', '\n').splitlines()
+        identifiers = [parse_chat_identifier(line) for line in chat_lines if line.strip()]
+        folder = request.form.get('folder', '').strip() or None
+        if not identifiers and not folder:
+            flash(get_text('chat_id_required_error', session.get('lang', 'tr')), 'error')
+            return redirect(url_for('index'))
+        if len(identifiers) > BATCH_MAX_CHATS:
+            identifiers = identifiers[:BATCH_MAX_CHATS]
+
+        download_limit = request.form.get('download_limit', type=int)
+        if download_limit is not None and download_limit < 1:
+            flash(get_text('download_limit_validation_error', session.get('lang', 'tr')), 'error')
+            return redirect(url_for('index'))
+
+        if not task_manager.start_batch_task(
+            identifiers,
+            folder,
+            PERIOD_CHOICES.get(request.form.get('period')),
+            request.form.get('reaction_filter') == 'true',
+            download_limit,
+            budget_from_form(request.form)
+        ):
+            flash(get_text('task_already_running_error', session.get('lang', 'tr')), 'error')
+            return redirect(url_for('index'))
+
+        session['job_id'] = task_manager.job_id
         return redirect(url_for('loading'))
 
     @app.route('/loading')
@@ -175,61 +486,61 @@ def register_routes(app):
         lang = session.get('lang', 'tr')
         return render_template(
             'loading.html',
+            job_id=session.get('job_id'),
             lang=lang,
             t=get_text,
             languages=LANGUAGES
         )
 
+    @app.route('/jobs/<job_id>/resume', methods=['POST'])
+    def resume_job(job_id):
+        """Continues an interrupted scan from its last checkpoint."""
+        if job_store.get_running_job():
+            flash(get_text('task_already_running_error', session.get('lang', 'tr')), 'error')
+            return redirect(url_for('index'))
+
+        if not task_manager.resume_task(job_id):
+            return redirect(url_for('results', job=job_id))
+
+        session['job_id'] = job_id
+        return redirect(url_for('loading'))
+
+    @app.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_job(job_id):
+        """Stops a running scan early; it completes with the results collected so far."""
+        requested = job_store.request_stop(job_id, job_store.CANCELLED)
+        if task_manager.job_id == job_id and task_manager.is_running:
+            # Running in this process: stop without waiting for the next job store poll
+            task_manager.request_stop(job_store.CANCELLED)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'success': requested}), 200 if requested else 409
+        return redirect(url_for('loading'))
+
     @app.route('/stream-progress')
     def stream_progress():
         """Server-Sent Events endpoint for progress updates."""
+        job_id = request.args.get('job') or session.get('job_id')
+
+        def event(data):
+            return f"data: {json.dumps(data)}\n\n"
+
         def generate():
-            # No longer need 'global task_data'
-            q = task_manager.progress_queue # Use queue from task_manager
-            last_scanned_count_for_stream = 0 # Keep track of the last count sent
-
-            # Loop while the task is running OR there are still items in the queue
-            while task_manager.is_running or not q.empty():
-                try:
-                    update = q.get(timeout=1)  # Wait for an update
-
-                    if update['type'] == 'progress':
-                        last_scanned_count_for_stream = update['scanned']
-                        yield f"data: {{\"type\": \"progress\", \"scanned\": {last_scanned_count_for_stream}}}\n\n"
-                    elif update['type'] == 'media_phase':
-                        yield f"data: {{\"type\": \"media_phase\", \"total_media\": {update['total_media']}}}\n\n"
-                    elif update['type'] == 'media_progress':
-                        yield f"data: {{\"type\": \"media_progress\", \"processed_count\": {update['processed_count']}, \"total_media\": {update['total_media']}}}\n\n"
-                    elif update['type'] == 'error':
-                        # Error message put in queue by background task or set_task_error
-                        yield f"data: {{\"type\": \"error\", \"message\": \"{update['message']}\"}}\n\n"
-                        # No need to break here, let the loop condition (is_running) handle termination
-                    elif update['type'] == 'complete':
-                        # Task completion message put in queue by background task
-                        # Use the scanned count from the message if available, otherwise use the last known
-                        final_scanned_count = update.get('scanned', last_scanned_count_for_stream)
-                        yield f"data: {{\"type\": \"complete\", \"scanned\": {final_scanned_count}}}\n\n"
-                        # No need to break here, let the loop condition handle termination
-
-                    q.task_done() # Mark task as done in the queue
-
-                except queue.Empty:
-                    # No update received within the timeout.
+            # Progress is read from the shared job store, so the stream works in any worker
+            tracker = job_store.ProgressTracker()
+            last_sent = time.time()
+
+            while True:
+                for update in tracker.events(job_store.get_job(job_id)):
+                    yield event(update)
+                    last_sent = time.time()
+                if tracker.finished:
+                    break
+
+                if time.time() - last_sent >= 15:
                     # Send a keepalive comment to prevent the connection from closing.
                     yield ": keepalive\n\n"
-                except Exception as e:
-                    # Handle unexpected errors during streaming
-                    print(f"Error in SSE stream processing queue item: {e}")
-                    # Send a generic error to the client
-                    yield f"data: {{\"type\": \"error\", \"message\": \"An internal error occurred during streaming.\"}}\n\n"
-                    # Consider breaking or letting the loop condition handle it based on task_manager.is_running
-                    # If the error is critical, ensure task_manager.is_running is set to False elsewhere.
-
-            # After the loop finishes (task is no longer running AND queue is empty)
-            # Perform final checks if needed, although most states should be handled within the loop.
-            # For example, if an error occurred and was set directly on task_manager without going through the queue:
-            if task_manager.error and update.get('type') != 'error': # Avoid sending duplicate error
-                 yield f"data: {{\"type\": \"error\", \"message\": \"{task_manager.error}\"}}\n\n"
+                    last_sent = time.time()
+                time.sleep(PROGRESS_POLL_SECONDS)
 
             print("SSE stream closing.")
 
@@ -238,170 +549,391 @@ def register_routes(app):
     @app.route('/results')
     def results():
         """Shows paginated results."""
-        # No longer need 'global task_data'
         lang = session.get('lang', 'tr')
-        
-        if task_manager.error:
-            error_message = task_manager.error
-            # Important: Clear task data AFTER retrieving the error message
-            # and before rendering, so the error isn't shown again on refresh.
-            task_manager.clear_task_data_after_processing()
+        job_id = request.args.get('job') or session.get('job_id')
+        job = job_store.get_job(job_id)
+
+        if job is None:
+            # No task to show, implies direct access without a task
+            return redirect(url_for('index'))
+
+        if job['status'] in (job_store.ERROR, job_store.INTERRUPTED):
+            # Forget the job so the error isn't shown again on refresh.
+            session.pop('job_id', None)
             return render_template(
                 'results.html',
-                error=error_message, # Pass the retrieved error message
+                error=job['error'] or get_text('task_interrupted_error', lang),
+                resumable=job_store.is_resumable(job),
+                job_id=job_id,
                 lang=lang,
                 t=get_text,
                 languages=LANGUAGES
             )
 
-        if task_manager.results is None:
-            if task_manager.is_running:
-                return redirect(url_for('loading'))
-            else:
-                # Not running and no results/error, implies an issue or direct access without task
-                # Consider flashing a message or just redirecting
-                # Clearing data here might be premature if it's a direct access attempt
-                # but if it's an unexpected state, clearing might be safer.
-                # For now, let's assume it's an invalid state and clear.
-                task_manager.clear_task_data_after_processing()
-                return redirect(url_for('index'))
+        if job['status'] == job_store.RUNNING:
+            return redirect(url_for('loading'))
 
-        # Paginate results
-        page = request.args.get('page', 1, type=int)
-        per_page = 10  # Items per page
-        max_pages = 10 # Max number of pages to show in pagination
+        cache_info = result_cache.get_info(job_key(job_id))
+        if cache_info is None:
+            # Results expired from the cache; they remain available in history
+            if job['history_id']:
+                return redirect(url_for('view_history_results', history_id=job['history_id']))
+            # Batch scans save one history entry per chat and show a combined leaderboard
+            if database.get_batch_entries(job_id):
+                return redirect(url_for('batch_results', batch_id=job_id))
+            return redirect(url_for('index'))
 
-        all_task_results = task_manager.results # Use results from task_manager
-        total_items = len(all_task_results)
-        
-        # Calculate total pages, respecting max_pages limit for display
-        actual_total_pages = (total_items + per_page - 1) // per_page
-        display_total_pages = min(max_pages, actual_total_pages)
+        # Other rankings re-score the saved results of the entry
+        ranking = request.args.get('rank')
+        if ranking in RANKINGS and ranking != DEFAULT_RANKING and cache_info['meta'].get('history_id'):
+            return redirect(url_for('view_history_results', history_id=cache_info['meta']['history_id'], rank=ranking))
 
+        # Paginate results
+        page = request.args.get('page', 1, type=int)
+        total_items = cache_info['total_items']
+        display_total_pages = cache_info['total_pages']
 
         # Ensure current page is within valid range
         if page < 1:
             page = 1
         elif page > display_total_pages and display_total_pages > 0 : # if display_total_pages is 0, page 1 is fine
-             return redirect(url_for('results', page=display_total_pages))
+             return redirect(url_for('results', job=job_id, page=display_total_pages))
         elif page > 1 and total_items == 0: # No items, but requested page > 1
-             return redirect(url_for('results', page=1))
-
-
-        start_index = (page - 1) * per_page
-        end_index = start_index + per_page
-        
-        # Slice results for the current page
-        # Ensure results are dicts if they need modification (e.g. adding links directly)
-        # If results are already in the desired format (e.g. from database.py), direct slicing is fine.
-        # The original code converted to dicts: paginated_results = [dict(row) for row in all_task_results[start_index:end_index]]
-        # Assuming all_task_results are already list of dicts or similar.
-        paginated_results = all_task_results[start_index:end_index]
+             return redirect(url_for('results', job=job_id, page=1))
 
+        # Pages are stored pre-sorted, so this only decodes the requested page
+        paginated_results = result_cache.get_page(job_key(job_id), page) or []
 
-        # Save to history if this is the first view of results (page 1)
-        # and the task has original identifier (meaning it was a new search)
-        history_id = None
-        if page == 1 and task_manager.original_identifier and not request.args.get('no_save'):
-            try:
-                history_id = database.save_search_history(
-                    task_manager.original_identifier,
-                    task_manager.entity, # Entity object from task_manager
-                    task_manager.original_period,
-                    len(all_task_results), # Total results from this task
-                    task_manager.scanned_count, # Scanned count from task_manager
-                    task_manager.download_folder_path # download_folder_path from task_manager
-                )
-
-                if history_id:
-                    # The build_link function now uses the entity from task_manager
-                    def build_link_for_history(msg_id):
-                        return build_message_link(task_manager.entity, msg_id)
-                    
-                    database.save_search_results(history_id, all_task_results, build_link_for_history)
-            except Exception as e:
-                print(f"Error saving to history: {e}")
-                # Optionally flash a message to the user about history saving failure
-                flash(get_text('history_save_error', lang), 'warning')
-
-
-        # Data for the current task has been processed (either displayed or saved to history).
-        # Clear it now, but only if it was a new search that just completed.
-        # If we are just browsing pages of an already completed task (e.g. via direct URL with page > 1),
-        # we should not clear it, as it might be needed if the user navigates back to page 1.
-        # However, the current logic re-fetches task_data for each page, so this might be complex.
-        # A safer approach: clear if page == 1 and history_id was processed (or attempted).
-        if page == 1 and task_manager.original_identifier:
-            task_manager.clear_task_data_after_processing()
-
-
-        # Function to build links for the current view (might be different from history saving if entity changes)
-        current_task_entity_for_links = task_manager.entity # Or re-fetch if necessary for paged views
-        
         return render_template(
             'results.html',
             results=paginated_results,
             lang=lang,
             t=get_text,
             languages=LANGUAGES,
-            # Pass entity for link building; ensure it's available if task_manager was cleared
-            build_link=lambda msg_id: build_message_link(current_task_entity_for_links, msg_id),
             page=page,
             total_pages=display_total_pages,
             total_messages=total_items, # Renamed from total_items for clarity in template
-            history_id=history_id # Pass history_id if created
+            history_id=cache_info['meta'].get('history_id'),
+            job_id=job_id,
+            stop_reason=job['stop_reason'],
+            sample_stats=cache_info['meta'].get('sample_stats'),
+            rankings=RANKINGS,
+            ranking=DEFAULT_RANKING
         )
 
     @app.route('/history')
     def history():
         """Shows search history."""
         lang = session.get('lang', 'tr')
-        history_entries = database.get_search_history()
+
+        # The list only changes when entries are added, deleted or updated
+        page_key = history_list_key(database.get_history_list_state(), lang)
+        body = page_cache.get(page_key)
+        if body is None:
+            history_entries = database.get_search_history()
+            body = page_cache.put(page_key, render_template(
+                'history.html',
+                history=history_entries,
+                lang=lang,
+                t=get_text,
+                languages=LANGUAGES
+            ))
+        return Response(body, mimetype='text/html')
+        
+    @app.route('/history/compare')
+    def compare_history():
+        """Compares two history entries: reaction gains, rank changes, new and dropped messages."""
+        lang = session.get('lang', 'tr')
+        history_a = request.args.get('a', type=int)
+        history_b = request.args.get('b', type=int)
+        if history_a and history_b and history_a > history_b:
+            # Entries are always compared older to newer
+            history_a, history_b = history_b, history_a
+        entry_a = database.get_history_entry(history_a) if history_a else None
+        entry_b = database.get_history_entry(history_b) if history_b else None
+        if entry_a is None or entry_b is None or history_a == history_b:
+            flash(get_text('compare_entries_error', lang), 'error')
+            return redirect(url_for('history'))
+        # Same rule as get_previous_history_id(): the numeric chat id if known, else the identifier
+        if entry_a['chat_numeric_id'] is not None and entry_b['chat_numeric_id'] is not None:
+            same_chat = entry_a['chat_numeric_id'] == entry_b['chat_numeric_id']
+        else:
+            same_chat = entry_a['chat_identifier'] == entry_b['chat_identifier']
+        if not same_chat:
+            flash(get_text('compare_different_chats', lang), 'error')
+            return redirect(url_for('history'))
+
+        view = request.args.get('view', 'gained')
+        if view not in comparison.VIEWS:
+            view = 'gained'
+        # All views and the summary are built in one pass and cached until either entry's revision changes
+        revision = [entry_a['revision'], entry_b['revision']]
+        cache_key = compare_key(history_a, history_b, view)
+        cache_info = result_cache.get_info(cache_key)
+        if cache_info is None or cache_info['meta'].get('revision') != revision:
+            summary, views = comparison.compare(history_a, history_b)
+            for name, view_rows in views.items():
+                result_cache.put(compare_key(history_a, history_b, name), view_rows, COMPARE_PER_PAGE,
+                                 meta={'revision': revision, 'summary': summary})
+            cache_info = result_cache.get_info(cache_key)
+        summary = cache_info['meta']['summary']
+        total_pages = max(1, cache_info['total_pages'])
+        page = max(1, min(request.args.get('page', 1, type=int), total_pages))
+
+        rows = comparison.page_rows(result_cache.get_page(cache_key, page) or [])
         return render_template(
-            'history.html',
-            history=history_entries,
+            'compare.html',
+            entry_a=entry_a,
+            entry_b=entry_b,
+            summary=summary,
+            views=comparison.VIEWS,
+            view=view,
+            rows=rows,
+            page=page,
+            total_pages=total_pages,
             lang=lang,
             t=get_text,
             languages=LANGUAGES
         )
-        
+
     @app.route('/history/<int:history_id>')
     def view_history_results(history_id):
         """Shows results from a specific history entry."""
         lang = session.get('lang', 'tr')
         
-        # Get history entry and results
-        history_entry = database.get_history_entry(history_id)
-        if not history_entry:
+        # The revision changes whenever the entry's results or media do
+        revision = database.get_history_revision(history_id)
+        if revision is None:
             # History entry not found
             return redirect(url_for('history'))
-            
-        # get_history_results now returns results with media_paths
-        processed_results = database.get_history_results(history_id)
 
         # Paginate results
         page = request.args.get('page', 1, type=int)
         per_page = 24
+        ranking = request.args.get('rank', DEFAULT_RANKING)
+        if ranking not in RANKINGS:
+            ranking = DEFAULT_RANKING
+
+        page_key = history_page_key(history_id, revision, page, lang, ranking)
+        body = page_cache.get(page_key)
+        # Media of recently viewed entries is kept longest when the downloads quota is enforced
+        database.record_history_view(history_id)
+        if body is not None:
+            return Response(body, mimetype='text/html')
+
+        history_entry = database.get_history_entry(history_id)
+        if not history_entry:
+            return redirect(url_for('history'))
+
+        # Saved results are paged out of the result cache, one set per ranking, until their revision changes
+        cache_key = history_key(history_id, ranking)
+        cache_info = result_cache.get_info(cache_key)
+        if cache_info is None or cache_info['meta'].get('revision') != revision:
+            if ranking == DEFAULT_RANKING:
+                # get_history_results now returns results with media_paths
+                result_cache.put(cache_key, database.get_history_results(history_id), per_page, meta={'revision': revision})
+            else:
+                # Ranked sets only hold (result id, score) pairs; the rows of a page are read when it is rendered
+                result_ids, columns = load_columns(history_id, ranking)
+                order, result_scores = rank_order(columns, ranking)
+                ranked = list(zip(result_ids[order].tolist(), result_scores[order].round(4).tolist()))
+                result_cache.put(cache_key, ranked, per_page, meta={'revision': revision})
+            cache_info = result_cache.get_info(cache_key)
+
+        total_items = cache_info['total_items']
+        total_pages = cache_info['total_pages']
         
-        total_items = len(processed_results)
-        total_pages = (total_items + per_page - 1) // per_page
-        
-        start_index = (page - 1) * per_page
-        end_index = min(start_index + per_page, total_items)
-        
-        paginated_results = processed_results[start_index:end_index] if start_index < total_items else []
+        paginated_results = (result_cache.get_page(cache_key, page) or []) if page >= 1 else []
+        if ranking != DEFAULT_RANKING:
+            scores_by_id = dict(paginated_results)
+            paginated_results = [dict(row, score=scores_by_id[row['result_id']])
+                                 for row in database.get_history_results_by_ids(list(scores_by_id))]
         
-        return render_template(
+        body = page_cache.put(page_key, render_template(
             'history_results.html',
             history=history_entry,
+            scan_filters=json.loads(history_entry['scan_filters']) if history_entry['scan_filters'] else None,
+            sample_stats=json.loads(history_entry['sample_stats']) if history_entry['sample_stats'] else None,
+            # The sender leaderboard is shown above the first page only
+            senders=database.get_history_senders(history_id, SENDER_LEADERBOARD_SIZE) if page == 1 else [],
+            previous_history_id=database.get_previous_history_id(history_id),
             results=paginated_results, # Pass results with media_paths
             lang=lang,
             t=get_text,
             languages=LANGUAGES,
             page=page,
             total_pages=total_pages,
-            total_items=total_items
+            total_items=total_items,
+            rankings=RANKINGS,
+            ranking=ranking
+        ))
+        return Response(body, mimetype='text/html')
+
+    @app.route('/batches/<batch_id>')
+    def batch_results(batch_id):
+        """Shows the chats of a batch scan and the normalized leaderboard across them."""
+        lang = session.get('lang', 'tr')
+        entries = database.get_batch_entries(batch_id)
+        if not entries:
+            return redirect(url_for('history'))
+
+        top = max(1, min(request.args.get('top', BATCH_LEADERBOARD_SIZE, type=int), 500))
+        return render_template(
+            'batch_results.html',
+            batch_id=batch_id,
+            entries=entries,
+            leaderboard=database.get_batch_leaderboard(batch_id, top),
+            top=top,
+            lang=lang,
+            t=get_text,
+            languages=LANGUAGES
+        )
+
+    @app.route('/history/<int:history_id>/reactions')
+    def history_reaction_stats(history_id):
+        """Returns reaction totals and a ranking by reaction type as JSON.
+
+        Query parameters:
+          reaction=🔥              rank by a single reaction
+          weights=👍:1,👎:-1       rank by a weighted combination of reactions
+        """
+        if not database.get_history_entry(history_id):
+            return jsonify({'error': 'History entry not found.'}), 404
+
+        weights = {}
+        if request.args.get('weights'):
+            try:
+                for part in request.args['weights'].split(','):
+                    key, _, weight = part.rpartition(':')
+                    weights[key.strip()] = float(weight)
+            except ValueError:
+                return jsonify({'error': 'Weights must look like 👍:1,👎:-1.'}), 400
+        elif request.args.get('reaction'):
+            weights = {request.args['reaction']: 1}
+
+        limit = max(1, min(request.args.get('limit', 20, type=int), REACTION_RANKING_MAX_LIMIT))
+        offset = max(request.args.get('offset', 0, type=int), 0)
+
+        return jsonify({
+            'history_id': history_id,
+            'totals': database.get_reaction_totals(history_id),
+            'weights': weights,
+            'results': database.get_top_messages_by_reactions(history_id, weights, limit, offset) if weights else [],
+        })
+
+    @app.route('/history/<int:history_id>/media/<int:message_id>')
+    def result_media(history_id, message_id):
+        """Returns the media of one result as JSON, so galleries load their items on demand."""
+        revision = database.get_history_revision(history_id)
+        if revision is None:
+            return jsonify({'error': 'History entry not found.'}), 404
+
+        # Media only changes when the entry's revision does
+        etag = f"media-{history_id}-{message_id}-r{revision}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            media = []
+            for media_path in database.get_result_media(history_id, message_id):
+                media.append({
+                    'url': url_for('serve_downloaded_file', subpath=media_path),
+                    'type': media_kind(media_path),
+                    'name': media_path.rsplit('/', 1)[-1],
+                })
+            response = jsonify({'history_id': history_id, 'message_id': message_id, 'media': media})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/history/<int:history_id>/export')
+    def export_history_results(history_id):
+        """Streams the results of a history entry as CSV or JSON Lines, optionally gzipped."""
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+        compress = request.args.get('gzip') in ('1', 'true')
+
+        if not database.get_history_entry(history_id):
+            return jsonify({'error': 'History entry not found.'}), 404
+
+        file_name = f"history_{history_id}.{export_format}" + ('.gz' if compress else '')
+        headers = {'Content-Disposition': f'attachment; filename="{file_name}"'}
+        if compress:
+            mimetype = 'application/gzip'
+        else:
+            mimetype = EXPORT_FORMATS[export_format]
+
+        rows = database.iter_history_results(history_id)
+        return Response(stream_export(rows, export_format, compress), mimetype=mimetype, headers=headers)
+
+    @app.route('/search')
+    def search():
+        """Full-text search over messages stored by previous searches."""
+        lang = session.get('lang', 'tr')
+        query = request.args.get('q', '').strip()
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = 20
+
+        hits = []
+        has_next = False
+        if query:
+            try:
+                # Fetch one extra hit to know whether a next page exists without counting all matches
+                hits = database.search_messages(query, per_page + 1, (page - 1) * per_page)
+            except Exception as e:
+                print(f"Error searching messages: {e}")
+                flash(get_text('search_error', lang), 'error')
+            has_next = len(hits) > per_page
+            hits = hits[:per_page]
+            for hit in hits:
+                # Escape the snippet, then turn the match markers into <mark> tags
+                hit['snippet'] = Markup(str(escape(hit['snippet'] or ''))
+                                        .replace('\x02', '<mark>').replace('\x03', '</mark>'))
+
+        return render_template(
+            'search.html',
+            query=query,
+            hits=hits,
+            page=page,
+            has_next=has_next,
+            lang=lang,
+            t=get_text,
+            languages=LANGUAGES
+        )
+
+    @app.route('/watch')
+    def watch():
+        """Shows the chats whose reactions are tracked live."""
+        lang = session.get('lang', 'tr')
+        return render_template(
+            'watch.html',
+            chats=database.get_watched_chats(),
+            watcher_running=watcher.watcher.is_running(),
+            lang=lang,
+            t=get_text,
+            languages=LANGUAGES
+        )
+
+    @app.route('/watch', methods=['POST'])
+    def watch_chat():
+        """Starts tracking the reactions of a history entry's chat live."""
+        history_entry = database.get_history_entry(request.form.get('history_id', type=int))
+        if not history_entry or history_entry['chat_numeric_id'] is None:
+            return redirect(url_for('watch'))
+
+        database.add_watched_chat(
+            history_entry['chat_numeric_id'],
+            history_entry['chat_identifier'],
+            history_entry['chat_title']
         )
+        watcher.watcher.start()
+        return redirect(url_for('watch'))
+
+    @app.route('/watch/<int:chat_id>/remove', methods=['POST'])
+    def unwatch_chat(chat_id):
+        """Stops tracking a chat; the watcher drops it on its next flush."""
+        database.remove_watched_chat(chat_id)
+        return redirect(url_for('watch'))
 
     # Route to serve downloaded files
     @app.route('/downloads/<path:subpath>')
@@ -410,19 +942,40 @@ def register_routes(app):
         # Construct the absolute path to the downloads directory
         # Assumes 'downloads' is in the CWD where Flask is run
         download_dir = os.path.abspath('downloads')
-        # Prevent accessing files outside the download_dir using safe_join (implicitly handled by send_from_directory)
-        print(f"Attempting to serve: {subpath} from {download_dir}")
         try:
-            # send_from_directory handles security (path traversal)
-            return send_from_directory(download_dir, subpath)
+            if MEDIA_SENDFILE == 'x-accel-redirect':
+                # Let nginx deliver the file from an internal location mapped to downloads/
+                file_path = safe_join(download_dir, subpath)
+                if not file_path or not os.path.isfile(file_path):
+                    return "File not found", 404
+                response = make_response('')
+                response.headers['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX.rstrip('/')}/{url_quote(subpath)}"
+                response.headers['Content-Type'] = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+            else:
+                # send_from_directory handles security (path traversal), byte ranges for video
+                # seeking and a strong ETag built from mtime and size (If-None-Match -> 304).
+                # With USE_X_SENDFILE the body is handed to the front-end server instead.
+                response = send_from_directory(download_dir, subpath, conditional=True, etag=True, max_age=MEDIA_MAX_AGE)
         except Exception as e:
             print(f"Error serving file {subpath}: {e}")
             return "File not found", 404
 
+        # Advertise range support so browsers seek videos instead of re-downloading them
+        response.headers.setdefault('Accept-Ranges', 'bytes')
+
+        # Downloaded files are written once and never change
+        response.cache_control.public = True
+        response.cache_control.max_age = MEDIA_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
     @app.route('/delete_history/<int:history_id>', methods=['POST'])
     def delete_history(history_id):
         """Deletes a history entry and its results."""
         success = database.delete_history_entry(history_id)
+        result_cache.discard_history(history_id)
+        page_cache.invalidate_history(history_id)
+        maintenance.request_maintenance() # Remove the entry's media from disk
         
         if success:
             flash('History entry deleted successfully.', 'success')
@@ -435,10 +988,8 @@ def register_routes(app):
     def get_chats():
         """Returns a JSON list of user's Telegram chats."""
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            chats = loop.run_until_complete(get_user_chats_async())
-            loop.close()
+            # Reuses the shared loop and its connected client instead of a new loop per request
+            chats = event_loop.run(get_user_chats_async(), timeout=120)
             return jsonify(chats)
         except Exception as e:
             print(f"Error in /get_chats route: {e}")
@@ -453,6 +1004,10 @@ def register_routes(app):
 
         try:
             deleted_count = database.delete_history_entries_by_ids(selected_ids)
+            for history_id in selected_ids:
+                result_cache.discard_history(history_id)
+                page_cache.invalidate_history(int(history_id))
+            maintenance.request_maintenance() # Remove the entries' media from disk
             return jsonify({'success': True, 'deleted_count': deleted_count}), 200
         except Exception as e:
             print(f"Error deleting selected history entries: {e}")
@@ -0,0 +1,11 @@
+"""
+Production entry point.
+
+Run several worker processes with gunicorn (settings in gunicorn.conf.py):
+    gunicorn wsgi:app
+or a single multi-threaded process with waitress:
+    waitress-serve --port=5001 --threads=16 wsgi:app
+"""
+from app import create_app
+
+app = create_app()